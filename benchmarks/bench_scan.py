@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+'''
+Throughput benchmark for the yara-disk and yara-mem client modules
+
+Generates a reproducible synthetic file tree and rule set, serves them from a
+local stand-in for the /rule and /results endpoints and reports files/s, MB/s,
+peak RSS and upload latency as JSON, so runs can be compared across commits.
+'''
+import gzip
+import importlib.util
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socketserver
+import string
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BASE_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils import http_utils, upload_utils
+
+RULE_NAME = 'bench'
+
+# String planted in the files and processes meant to match
+MARKER = 'rastrea2r-bench-marker'
+
+# Ballast text the synthetic files are made of
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo',
+         'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform']
+
+# Child process of the yara-mem benchmark, holding the marker and ballast_mb MiB of heap
+MEM_CHILD = ("import sys; ballast = bytearray(int(sys.argv[1]) * 1048576); marker = sys.argv[2][::-1]; "
+             "print(flush=True); sys.stdin.read()")
+
+
+def generate_rules(count, seed):
+    """ Returns the source of a rule set of count rules, the first one matching MARKER """
+
+    rnd = random.Random(seed)
+    rules = ['rule bench_marker { strings: $a = "%s" condition: $a }' % MARKER]
+    for i in range(1, count):
+        strings = ' '.join('$s%d = "%s"' % (j, ''.join(rnd.choice(string.ascii_letters) for _ in range(12)))
+                           for j in range(3))
+        rules.append('rule bench_%d { strings: %s condition: any of them }' % (i, strings))
+    return '\n'.join(rules)
+
+
+def _content(rnd, size, binary, marker):
+    if binary:
+        data = bytearray(rnd.getrandbits(8) for _ in range(min(size, 65536)))
+        data = bytes(data) * (size // len(data) + 1) if data else b''
+    else:
+        line = ' '.join(rnd.choice(WORDS) for _ in range(16)).encode('utf-8') + b'\n'
+        data = line * (size // len(line) + 1)
+    data = data[:size]
+    if marker:
+        offset = rnd.randrange(0, max(1, len(data) - len(MARKER)))
+        data = data[:offset] + MARKER.encode('utf-8') + data[offset + len(MARKER):]
+    return data
+
+
+def _archive(rnd, kind, members):
+    buf = io.BytesIO()
+    if kind == 'zip':
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, data in members:
+                archive.writestr(name, data)
+    else:
+        with tarfile.open(fileobj=buf, mode='w:gz') as archive:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = 0
+                archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def generate_corpus(root, files, seed, max_size=1048576, max_depth=4, archive_ratio=0.05, binary_ratio=0.3,
+                    match_ratio=0.01):
+    """ Writes a reproducible tree of files below root and returns its statistics
+
+    File sizes are log-uniform up to max_size, directories nest up to
+    max_depth levels, and the given fractions of files are zip/tar.gz
+    archives, binary data and files containing MARKER.
+    """
+
+    rnd = random.Random(seed)
+    directories = [root]
+    stats = {'files': 0, 'bytes': 0, 'archives': 0, 'binary': 0, 'matching': 0}
+
+    for i in range(files):
+        if rnd.random() < 0.1:
+            parent = rnd.choice(directories)
+            if parent.count(os.sep) - root.count(os.sep) < max_depth:
+                directories.append(os.path.join(parent, 'd%05d' % i))
+                os.makedirs(directories[-1], exist_ok=True)
+
+        size = int(2 ** rnd.uniform(6, max(7, max_size.bit_length() - 1)))
+        binary = rnd.random() < binary_ratio
+        marker = rnd.random() < match_ratio
+        path = os.path.join(rnd.choice(directories), 'f%05d' % i)
+
+        if rnd.random() < archive_ratio:
+            kind = rnd.choice(['zip', 'tar'])
+            members = [('m%d.%s' % (j, 'bin' if binary else 'txt'), _content(rnd, size // 4, binary, marker and j == 0))
+                       for j in range(4)]
+            data = _archive(rnd, kind, members)
+            path += '.zip' if kind == 'zip' else '.tar.gz'
+            stats['archives'] += 1
+        else:
+            data = _content(rnd, size, binary, marker)
+            path += '.bin' if binary else '.txt'
+
+        with open(path, 'wb') as f:
+            f.write(data)
+        stats['files'] += 1
+        stats['bytes'] += len(data)
+        stats['binary'] += binary
+        stats['matching'] += marker
+
+    return stats
+
+
+class StandInServer(socketserver.ThreadingMixIn, HTTPServer):
+    """ Local stand-in for the /rule and /results endpoints of the rastrea2r server """
+
+    daemon_threads = True
+
+    def __init__(self, rule_source):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.rule_source = rule_source.encode('utf-8')
+        self.etag = '"%s"' % abs(hash(rule_source))
+        self.records = 0
+        self.posts = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if '/rule' not in self.path:
+            self.send_error(404)
+        elif self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.server.etag)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', self.server.etag)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(self.server.rule_source)))
+            self.end_headers()
+            self.wfile.write(self.server.rule_source)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        if self.headers.get('Content-Type', '').startswith(upload_utils.NDJSON_TYPE):
+            # Header line followed by one record per line
+            records = body.decode('utf-8').splitlines()[1:]
+        else:
+            records = json.loads(body.decode('utf-8'))
+        with self.server.lock:
+            self.server.posts += 1
+            self.server.records += len(records) if isinstance(records, list) else 1
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def load_client():
+    """ Imports the platform client script as a module """
+
+    name = {'linux': 'linux/rastrea2r_linux.py', 'darwin': 'osx/rastrea2r_osx.py',
+            'win32': 'windows/rastrea2r_windows.py'}[sys.platform if sys.platform != 'linux2' else 'linux']
+    spec = importlib.util.spec_from_file_location('rastrea2r_client', os.path.join(SRC_DIR, 'rastrea2r', name))
+    client = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(client)
+    return client
+
+
+def peak_rss():
+    """ Returns the peak RSS in bytes of this process and its finished children, if known """
+
+    try:
+        import resource
+    except ImportError:
+        import psutil
+        return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+def _latency_stats(latencies):
+    if not latencies:
+        return {'posts': 0}
+    latencies = sorted(latencies)
+    return {'posts': len(latencies),
+            'mean_ms': round(1000 * sum(latencies) / len(latencies), 3),
+            'p50_ms': round(1000 * latencies[len(latencies) // 2], 3),
+            'p95_ms': round(1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+            'max_ms': round(1000 * latencies[-1], 3)}
+
+
+def _run_case(mode, options, port, state_dir, conn):
+    """ Runs one client module in a fresh process and sends its measurements through conn """
+
+    client = load_client()
+    logging.getLogger('').setLevel(logging.WARNING)
+    client.SERVER_PORT = str(port)
+    client.RULE_CACHE_DIR = os.path.join(state_dir, 'rules')
+    if hasattr(client, 'INDEX_DB'):
+        client.INDEX_DB = os.path.join(state_dir, 'index.db')
+
+    latencies = []
+    http_post_request = http_utils.http_post_request
+
+    def timed_post_request(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return http_post_request(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    http_utils.http_post_request = timed_post_request
+
+    start = time.perf_counter()
+    if mode == 'yara-disk':
+        client.yaradisk(options['path'], 'http://127.0.0.1', RULE_NAME, True, **options['kwargs'])
+    else:
+        client.yaramem('http://127.0.0.1', RULE_NAME, True, **options['kwargs'])
+    elapsed = time.perf_counter() - start
+
+    conn.send({'seconds': elapsed, 'peak_rss': peak_rss(), 'upload': _latency_stats(latencies)})
+    conn.close()
+
+
+def run_case(mode, options, server, state_dir):
+    """ Runs a client module against server in a child process, so peak RSS is its own """
+
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_case,
+                                      args=(mode, options, server.server_port, state_dir, child_conn))
+    records = server.records
+    process.start()
+    child_conn.close()
+    result = parent_conn.recv()
+    process.join()
+    result['records'] = server.records - records
+    return result
+
+
+def bench_disk(args, server, workdir):
+    corpus = os.path.join(workdir, 'corpus')
+    os.makedirs(corpus)
+    start = time.perf_counter()
+    corpus_stats = generate_corpus(corpus, args.files, args.seed, max_size=args.max_size, max_depth=args.max_depth,
+                                   archive_ratio=args.archive_ratio, binary_ratio=args.binary_ratio,
+                                   match_ratio=args.match_ratio)
+    corpus_stats['generate_seconds'] = round(time.perf_counter() - start, 3)
+
+    kwargs = {'workers': args.workers}
+    results = {'corpus': corpus_stats}
+    # The warm run hits the file-state index populated by the cold one
+    for run in ('cold', 'warm'):
+        result = run_case('yara-disk', {'path': corpus, 'kwargs': kwargs}, server, workdir)
+        result['files_per_second'] = round(corpus_stats['files'] / result['seconds'], 1)
+        result['mb_per_second'] = round(corpus_stats['bytes'] / 1048576 / result['seconds'], 2)
+        result['seconds'] = round(result['seconds'], 3)
+        results[run] = result
+    return results
+
+
+def bench_mem(args, server, workdir):
+    children = [subprocess.Popen([sys.executable, '-c', MEM_CHILD, str(args.mem_ballast), MARKER[::-1]],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                for _ in range(args.mem_processes)]
+    try:
+        for child in children:
+            child.stdout.readline()
+
+        import psutil
+        processes = len(psutil.pids())
+        kwargs = {'workers': args.workers}
+        if args.mem_timeout:
+            kwargs['timeout'] = args.mem_timeout
+        if args.regions:
+            kwargs['regions'] = True
+
+        result = run_case('yara-mem', {'kwargs': kwargs}, server, workdir)
+        result['processes'] = processes
+        result['processes_per_second'] = round(processes / result['seconds'], 1)
+        result['seconds'] = round(result['seconds'], 3)
+        return result
+    finally:
+        for child in children:
+            child.stdin.close()
+            child.wait()
+            child.stdout.close()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the rastrea2r yara-disk and yara-mem modules')
+    parser.add_argument('--mode', choices=['all', 'yara-disk', 'yara-mem'], default='all',
+                        help='Client modules to benchmark')
+    parser.add_argument('--files', type=int, default=2000, help='Number of files in the synthetic tree')
+    parser.add_argument('--max-size', type=int, default=1048576, help='Largest synthetic file in bytes')
+    parser.add_argument('--max-depth', type=int, default=4, help='Deepest directory nesting')
+    parser.add_argument('--archive-ratio', type=float, default=0.05, help='Fraction of files that are archives')
+    parser.add_argument('--binary-ratio', type=float, default=0.3, help='Fraction of files with binary content')
+    parser.add_argument('--match-ratio', type=float, default=0.01, help='Fraction of files containing the marker')
+    parser.add_argument('--rules', type=int, default=100, help='Number of rules in the rule set')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic tree and rule set')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Workers passed to the client modules')
+    parser.add_argument('--mem-processes', type=int, default=4, help='Processes holding the marker for yara-mem')
+    parser.add_argument('--mem-ballast', type=int, default=16, help='MiB of heap in each yara-mem process')
+    parser.add_argument('--mem-timeout', type=int, help='Per-process timeout passed to yara-mem')
+    parser.add_argument('--regions', action='store_true', help='Benchmark region-selective yara-mem (Linux)')
+    parser.add_argument('-o', '--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    server = StandInServer(generate_rules(args.rules, args.seed)).start()
+    report = {'commit': git_commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'parameters': vars(args),
+              'results': {}}
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='rastrea2r-bench-') as workdir:
+            if args.mode in ('all', 'yara-disk'):
+                report['results']['yara-disk'] = bench_disk(args, server, workdir)
+            if args.mode in ('all', 'yara-mem'):
+                report['results']['yara-mem'] = bench_mem(args, server, workdir)
+    finally:
+        server.stop()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
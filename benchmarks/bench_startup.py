@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+'''
+Startup benchmark for the rastrea2r client entry point
+
+Launches fresh interpreters running quick client commands (--version,
+--help, a mode's --help) and reports their wall time and the modules they
+imported, read from python -X importtime, as JSON. The bare interpreter is
+timed too, as a baseline: modules it imports (e.g. from site .pth files)
+are not held against the client, and over_baseline_ms is the time the client
+adds. With --max-ms, exits with status 1 if any command adds more than that
+or imports one of HEAVY_MODULES, so it can guard startup time in CI.
+'''
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BASE_DIR, '..', 'src')
+
+# Commands timed, as interpreter arguments
+BASELINE = ['-c', 'pass']
+CASES = {'import': ['-c', 'import rastrea2r'],
+         'version': ['-m', 'rastrea2r', '--version'],
+         'help': ['-m', 'rastrea2r', '--help'],
+         'yara-disk-help': ['-m', 'rastrea2r', 'yara-disk', '--help']}
+
+# Scan dependencies the quick commands must not import
+HEAVY_MODULES = ('yara', 'psutil', 'requests', 'urllib3', 'multiprocessing', 'sqlite3', 'tarfile', 'zipfile')
+
+# "import time: self | cumulative | name" lines of -X importtime, names indented by nesting level
+_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = SRC_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def run_once(args, cwd):
+    """ Returns the wall time in seconds of one interpreter running args """
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=cwd, env=_env(), stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, check=False)
+    return time.perf_counter() - start
+
+
+def import_profile(args, cwd, top=10):
+    """ Returns (modules imported, the top slowest top-level imports in ms) of an interpreter running args """
+
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=cwd, env=_env(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    modules = set()
+    top_level = []
+    for line in result.stderr.decode('utf-8', 'replace').splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            modules.add(match.group(4))
+            if len(match.group(3)) == 1:
+                top_level.append((int(match.group(2)), match.group(4)))
+    slowest = {name: round(us / 1000, 3) for us, name in sorted(top_level, reverse=True)[:top]}
+    return modules, slowest
+
+
+def bench_case(args, runs, cwd, baseline=frozenset()):
+    """ Returns the timings and imports of a case, not counting the modules in baseline """
+
+    run_once(args, cwd)  # warm the bytecode and page caches
+    times = sorted(run_once(args, cwd) for _ in range(runs))
+    modules, slowest = import_profile(args, cwd)
+    modules -= baseline
+    return {'runs': runs,
+            'median_ms': round(1000 * statistics.median(times), 3),
+            'min_ms': round(1000 * times[0], 3),
+            'p95_ms': round(1000 * times[min(runs - 1, int(runs * 0.95))], 3),
+            'modules': len(modules),
+            'heavy_modules': sorted(name for name in HEAVY_MODULES if name in modules),
+            'slowest_imports_ms': {name: ms for name, ms in slowest.items() if name not in baseline}}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the startup time of the rastrea2r client')
+    parser.add_argument('--case', choices=['all'] + list(CASES), default='all', help='Commands to benchmark')
+    parser.add_argument('-n', '--runs', type=int, default=20, help='Timed runs of each command')
+    parser.add_argument('--max-ms', type=float,
+                        help='Fail if a command adds more than this to the interpreter startup or imports a '
+                             'scan dependency')
+    parser.add_argument('-o', '--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = {'commit': git_commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'parameters': vars(args),
+              'results': {}}
+
+    # Runs in a scratch directory, the client may log to a file in its working directory
+    with tempfile.TemporaryDirectory(prefix='rastrea2r-bench-') as workdir:
+        baseline = frozenset(import_profile(BASELINE, workdir)[0])
+        report['baseline'] = bench_case(BASELINE, args.runs, workdir)
+        for name, case_args in CASES.items():
+            if args.case in ('all', name):
+                result = bench_case(case_args, args.runs, workdir, baseline)
+                result['over_baseline_ms'] = round(result['median_ms'] - report['baseline']['median_ms'], 3)
+                report['results'][name] = result
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.max_ms is not None:
+        failed = [name for name, result in report['results'].items()
+                  if result['over_baseline_ms'] > args.max_ms or result['heavy_modules']]
+        if failed:
+            print("Startup budget exceeded by: " + ', '.join(failed), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -41,11 +41,15 @@ if __name__ == '__main__':
         maintainer='Sudheendra Bhat',
         maintainer_email='bhat.sudheendra@gmail.com',
         install_requires=requirements,
+        python_requires='>=3.7',
         keywords=['rastrea2r'],
         package_dir={'': 'src'},
         packages=find_packages('src'),
+        package_data={'rastrea2r': ['rastrea2r.ini']},
+        entry_points={'console_scripts': ['rastrea2r = rastrea2r.__main__:main']},
         zip_safe=False,
         classifiers=['Development Status :: 3 - Alpha',
                      'Intended Audience :: Developers',
-                     'Programming Language :: Python :: 3.6']
+                     'Programming Language :: Python :: 3',
+                     'Programming Language :: Python :: 3.7']
     )
@@ -1,53 +1,129 @@
 '''
 rastrea2r client
+
+The configuration is parsed once, the first time one of its settings (e.g.
+rastrea2r.AUTH_USER) is read through the module __getattr__ (PEP 562,
+hence Python 3.7 or later), so importing the package costs nothing.
+Logging is set up by configure_logging(), called by the entry points.
 '''
 import sys
 import os
 import logging
-from logging.handlers import RotatingFileHandler
 import configparser
 
 __version__ = '1.0.0'
 
-# Initialize Configuration
-config = configparser.ConfigParser()
-config.read(os.path.join(os.path.abspath(os.path.dirname(__file__)), '../rastrea2r', 'rastrea2r.ini'))
-
-ENABLE_TRACE = config["rastrea2r"]["enable_trace"]
-AUTH_USER = config["rastrea2r"]["username"]
-AUTH_PASSWD = config["rastrea2r"]["password"]
-SERVER_PORT = config["rastrea2r"]["server_port"]
-CLIENT_VERSION = config["rastrea2r"]["version"]
-API_VERSION = config["rastrea2r"]["api_version"]
-WINDOWS_COMMANDS = config["rastrea2r"]["windows_commands"].split(',')
-
-
-# Check for sane config file
-if "rastrea2r" not in config:
-    print("Could not parse config file")
-    sys.exit(1)
-
-# Logging Configuration, default level INFO
-logger = logging.getLogger("")
-logger.setLevel(logging.INFO)
-lformat = logging.Formatter("%(asctime)s %(name)s:%(levelname)s: %(message)s")
-
-# Debug mode Enabled
-if "debug" in config["rastrea2r"] and int(config["rastrea2r"]["debug"]) != 0:
-    debug = int(config["rastrea2r"]["debug"])
-    logger.setLevel(logging.DEBUG)
-    logging.debug("Enabled Debug mode")
-else:
-    # STDOUT Logging defaults to INFO
-    lsh = logging.StreamHandler(sys.stdout)
-    lsh.setFormatter(lformat)
-    lsh.setLevel(logging.INFO)
-    logger.addHandler(lsh)
-
-# Enable logging to file if configured
-if "logfile" in config["rastrea2r"]:
-    lfh = RotatingFileHandler(
-        config["rastrea2r"]["logfile"], maxBytes=(1048576 * 5), backupCount=3
-    )
-    lfh.setFormatter(lformat)
-    logger.addHandler(lfh)
+CONFIG_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), '../rastrea2r', 'rastrea2r.ini')
+
+_config = None
+_settings = None
+_logging_configured = False
+
+
+def get_config():
+    """ Returns the parsed rastrea2r.ini, reading it on the first call """
+
+    global _config
+    if _config is None:
+        config = configparser.ConfigParser()
+        config.read(CONFIG_FILE)
+
+        # Check for sane config file
+        if "rastrea2r" not in config:
+            print("Could not parse config file")
+            sys.exit(1)
+        _config = config
+    return _config
+
+
+def _split_commands(value):
+    """ Splits a configured command list on the commas outside the {...} options, e.g. {after=a,b} """
+
+    entries = ['']
+    depth = 0
+    for char in value:
+        if char == ',' and not depth:
+            entries.append('')
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+        entries[-1] += char
+    return entries
+
+
+def _read_settings(config):
+    section = config["rastrea2r"]
+    return {
+        'ENABLE_TRACE': section["enable_trace"],
+        'AUTH_USER': section["username"],
+        'AUTH_PASSWD': section["password"],
+        'SERVER_PORT': section["server_port"],
+        'CLIENT_VERSION': section["version"],
+        'API_VERSION': section["api_version"],
+        'WINDOWS_COMMANDS': _split_commands(section["windows_commands"]),
+        'TRIAGE_COMMANDS': _split_commands(section.get("triage_commands", "")),
+        'RULE_CACHE_DIR': os.path.expanduser(section.get("rule_cache_dir", "~/.rastrea2r/rules")),
+        'INDEX_DB': os.path.expanduser(section.get("index_db", "~/.rastrea2r/index.db")),
+        'KNOWN_GOOD_DIR': os.path.expanduser(section.get("known_good_dir", "~/.rastrea2r/knowngood")),
+        'REPORT_DIR': os.path.expanduser(section.get("report_dir", "~/.rastrea2r/reports")),
+        'CHECKPOINT_DIR': os.path.expanduser(section.get("checkpoint_dir", "~/.rastrea2r/checkpoints")),
+        'TRIAGE_DIR': os.path.expanduser(section.get("triage_dir", "~/.rastrea2r/triage")),
+        'SERVER_RULES_DIR': os.path.expanduser(section.get("server_rules_dir", "~/.rastrea2r/server/rules")),
+        'SERVER_KNOWN_GOOD_DIR': os.path.expanduser(section.get("server_known_good_dir",
+                                                                "~/.rastrea2r/server/knowngood")),
+        'SERVER_RESULTS_DB': os.path.expanduser(section.get("server_results_db", "~/.rastrea2r/server/results.db")),
+    }
+
+
+def __getattr__(name):
+    """ Returns the configuration settings, e.g. AUTH_USER, parsing the configuration on first use """
+
+    global _settings
+    if name == 'config':
+        return get_config()
+    if name.startswith('__'):
+        raise AttributeError(name)
+    if _settings is None:
+        _settings = _read_settings(get_config())
+    try:
+        return _settings[name]
+    except KeyError:
+        raise AttributeError("module 'rastrea2r' has no attribute '" + name + "'") from None
+
+
+def configure_logging():
+    """ Sets up root logging from the configuration, once """
+
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    config = get_config()
+
+    # Logging Configuration, default level INFO
+    logger = logging.getLogger("")
+    logger.setLevel(logging.INFO)
+    lformat = logging.Formatter("%(asctime)s %(name)s:%(levelname)s: %(message)s")
+
+    # Debug mode Enabled
+    if "debug" in config["rastrea2r"] and int(config["rastrea2r"]["debug"]) != 0:
+        logger.setLevel(logging.DEBUG)
+        logging.debug("Enabled Debug mode")
+    else:
+        # STDOUT Logging defaults to INFO
+        lsh = logging.StreamHandler(sys.stdout)
+        lsh.setFormatter(lformat)
+        lsh.setLevel(logging.INFO)
+        logger.addHandler(lsh)
+
+    # Enable logging to file if configured
+    if "logfile" in config["rastrea2r"]:
+        from logging.handlers import RotatingFileHandler
+
+        lfh = RotatingFileHandler(
+            config["rastrea2r"]["logfile"], maxBytes=(1048576 * 5), backupCount=3
+        )
+        lfh.setFormatter(lformat)
+        logger.addHandler(lfh)
@@ -0,0 +1,34 @@
+'''
+rastrea2r client entry point, run as rastrea2r or python -m rastrea2r
+
+Only the client module of the running platform is imported, and it imports
+the scan dependencies of the mode given on the command line only.
+'''
+import importlib
+import sys
+
+# Client module of each sys.platform prefix
+PLATFORM_CLIENTS = (('win', 'rastrea2r.windows.rastrea2r_windows'),
+                    ('darwin', 'rastrea2r.osx.rastrea2r_osx'),
+                    ('linux', 'rastrea2r.linux.rastrea2r_linux'))
+
+
+def client_module(platform=sys.platform):
+    """ Returns the name of the client module of platform, a sys.platform value, None if unsupported """
+
+    for prefix, module in PLATFORM_CLIENTS:
+        if platform.startswith(prefix):
+            return module
+    return None
+
+
+def main():
+    module = client_module()
+    if module is None:
+        print("Unsupported platform: " + sys.platform)
+        sys.exit(1)
+    importlib.import_module(module).main()
+
+
+if __name__ == '__main__':
+    main()
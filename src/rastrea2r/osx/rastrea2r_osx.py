@@ -1,142 +1,263 @@
 #!/usr/bin/env python3
 
 import os
-import psutil  # New multiplatform library
-import yara
 from argparse import ArgumentParser
-from requests.auth import HTTPBasicAuth
-from utils import http_utils
-from rastrea2r import ENABLE_TRACE, AUTH_USER, AUTH_PASSWD, SERVER_PORT, CLIENT_VERSION, API_VERSION
+from rastrea2r import AUTH_USER, AUTH_PASSWD, SERVER_PORT, CLIENT_VERSION, API_VERSION, RULE_CACHE_DIR, \
+    INDEX_DB, KNOWN_GOOD_DIR, REPORT_DIR, CHECKPOINT_DIR, TRIAGE_DIR, TRIAGE_COMMANDS, \
+    configure_logging
 import json
 import logging
-import traceback
 
 __version__ = CLIENT_VERSION
 
 logger = logging.getLogger(__name__)
 
-
-def yaradisk(path, server, rule, silent):
-    """ Yara file/directory object scan module """
-
-    results = []
-    rule_url = server + ":" + SERVER_PORT + API_VERSION + "/rule?rulename=" + rule
-    logger.debug("Rule_URL:"+rule_url)
-    rule_text = http_utils.http_get_request(url=rule_url, auth=HTTPBasicAuth(AUTH_USER, AUTH_PASSWD))
+# Device nodes, and the data volume already reached through its firmlinks
+DEFAULT_EXCLUDES = ['/dev', '/System/Volumes/Data']
+
+
+def yaradisk(path, server, rule, silent, workers=1, full=False, excludes=None, one_file_system=False,
+             max_size=None, known_good=None, large_file_size=None, window_size=None, window_workers=1,
+             byte_budget=None, archive_depth=None, archive_member_size=None, archive_memory=None, report=None,
+             prometheus=None, slowest=None, governor=None, resume=False,
+             checkpoint_interval=None, prefilter=False,
+             strings=False):
+    """ Yara file/directory object scan module
+
+    Archive members are scanned only with an archive_depth. window_size, the
+    other archive_ limits, checkpoint_interval and slowest default to those
+    of scan_utils, archive_utils, checkpoint_utils and metrics_utils when
+    None.
+    """
+
+    # Imported here so the modes that do not scan start without yara, psutil and requests
+    from utils import api_utils, archive_utils, checkpoint_utils, hash_utils, http_utils, index_utils, \
+        metrics_utils, rule_utils, scan_utils, upload_utils
+
+    window_size = scan_utils.WINDOW_SIZE if window_size is None else window_size
+    archive_depth = archive_depth or 0
+    archive_member_size = archive_utils.MAX_MEMBER_SIZE if archive_member_size is None else archive_member_size
+    archive_memory = archive_utils.MEMORY_CAP if archive_memory is None else archive_memory
+    if checkpoint_interval is None:
+        checkpoint_interval = checkpoint_utils.CHECKPOINT_INTERVAL
+    slowest = metrics_utils.SLOWEST if slowest is None else slowest
+    auth = http_utils.basic_auth(AUTH_USER, AUTH_PASSWD)
+
+    metrics = metrics_utils.RunMetrics('yaradisk', slowest)
+    if governor is not None:
+        governor.apply_priority()
+
+    # Several rule sets are compiled together, one namespace each, and matched in a single pass
+    rules = [rule] if isinstance(rule, str) else list(rule)
+    rule_urls = [(name, server + ":" + SERVER_PORT + API_VERSION + "/rule?rulename=" + name) for name in rules]
+    logger.debug("Rule_URL:" + ', '.join(rule_url for _, rule_url in rule_urls))
+    rule_bin = rule_utils.load_rule_sets(rule_urls, RULE_CACHE_DIR, auth=auth, metrics=metrics)
+    rule = rule_utils.rule_set_name(rules)
+    if rule_bin is None:
+        return
 
     if not silent:
         logger.debug('\nPulling ' + rule + ' from ' + server + '\n')
-        #logger.info(str(rule_text) + '\n')
         logger.debug('\nScanning ' + path + '\n')
 
-    rule_bin = yara.compile(sources={'namespace': rule_text})
-
-    for root, dirs, filenames in os.walk(path):
-        for name in filenames:
-            try:
-                file_path = os.path.join(root, name)
-                matches = rule_bin.match(filepath=file_path)
-
-                if matches:
-                    result = {"rulename": str(matches[0]),
-                              "filename": file_path,
-                              "module": 'yaradisk',
-                              "hostname": os.uname()[1]}
-                    if not silent:
-                        logger.debug(result)
-
-                    results.append(result)
-
-            except Exception as e:
-                logging.error(
-                    "Exception when executing yara-disk ERROR: {error}, TRACE: {stack_trace}".format(
-                        error=str(e), stack_trace=traceback.format_exc() if ENABLE_TRACE else ""))
-
-    if len(results) > 0:
-        headers = {'module': 'yara-disk-scan',
-                   'Content-Type': 'application/json'}
-        results_url = server + ":" + SERVER_PORT + API_VERSION + '/results'
-        response = http_utils.http_post_request(url=results_url, body=json.dumps(results),
-                                                auth=HTTPBasicAuth(AUTH_USER, AUTH_PASSWD),
-                                                headers=headers)
-
-        if response.status_code == 200:
-            logger.info("yara-disk Results pushed to server successfully")
-        else:
-            logger.error("Error uploading the results: " + response.text)
+    known_good_set = None
+    if known_good:
+        known_good_url = server + ":" + SERVER_PORT + API_VERSION + "/knowngood?name=" + known_good
+        with metrics.phase('known_good_fetch'):
+            known_good_path = hash_utils.fetch_hash_set(known_good_url, known_good, KNOWN_GOOD_DIR, auth=auth)
+        if known_good_path is None:
+            return
+        try:
+            known_good_set = hash_utils.KnownGoodSet(known_good_path)
+        except ValueError as e:
+            logger.error(str(e))
+            return
+
+    # Windows of large files overlap by the longest rule string when it is bounded
+    overlap = rule_utils.rule_info(RULE_CACHE_DIR, rule).get('max_string_length') or scan_utils.WINDOW_OVERLAP
+    scanner = scan_utils.FileScanner(rule_bin, known_good=known_good_set, large_file_size=large_file_size,
+                                     window_size=window_size, overlap=overlap, window_workers=window_workers,
+                                     byte_budget=byte_budget, archive_depth=archive_depth,
+                                     archive_member_size=archive_member_size, archive_memory=archive_memory,
+                                     governor=governor, prefilter=prefilter, strings=strings)
+    index = index_utils.FileIndex(INDEX_DB, scanner.fingerprint())
+    checkpoint = checkpoint_utils.Checkpoint(checkpoint_utils.state_path(CHECKPOINT_DIR, path, rule),
+                                             scanner.fingerprint(), checkpoint_interval)
+    if not resume or not checkpoint.resume():
+        checkpoint.remove()
+
+    headers = {'module': 'yara-disk-scan',
+               'Content-Type': 'application/json'}
+    results_url = server + ":" + SERVER_PORT + API_VERSION + '/results'
+
+    with upload_utils.ResultUploader(results_url, headers=headers, auth=auth, metrics=metrics,
+                                     keep_unsent=True,
+                                     header={"hostname": os.uname()[1], "module": 'yaradisk',
+                                             "client_version": CLIENT_VERSION}) as uploader:
+        # Results whose upload failed before the scan was interrupted
+        for record in checkpoint.unsent:
+            uploader.add(json.loads(record))
+
+        # Checkpoints keep the results of finished files that could not be uploaded
+        scan = api_utils.scan_path(scanner, path, workers, excludes=DEFAULT_EXCLUDES + (excludes or []),
+                                   one_file_system=one_file_system, max_size=max_size, index=index, full=full,
+                                   checkpoint=checkpoint, on_checkpoint=uploader.flush, metrics=metrics)
+        for result in scan:
+            if not silent:
+                logger.debug(result)
+
+            uploader.add(result)
 
+    index.close()
+    if known_good_set is not None:
+        known_good_set.close()
+
+    # Keep the results that could not be uploaded for the next --resume
+    if uploader.unsent:
+        checkpoint.save(uploader.unsent)
     else:
+        checkpoint.remove()
+
+    if uploader.records == 0:
         logger.info("No matches found!!!")
+    elif uploader.failed == 0:
+        logger.info("yara-disk Results pushed to server successfully")
+    else:
+        logger.error("Error uploading " + str(uploader.failed) + " of " + str(uploader.records) + " results")
+
+    metrics_utils.write_reports(metrics, report or os.path.join(REPORT_DIR, 'yaradisk.json'), prometheus)
 
 
-def yaramem(server, rule, silent):
-    """ Yara process memory scan module """
+def yaramem(server, rule, silent, workers=1, timeout=None, report=None, prometheus=None,
+            slowest=None, governor=None, strings=False):
+    """ Yara process memory scan module, timeout and slowest defaulting to those of mem_utils and metrics_utils """
 
-    results = []
-    rule_url = server + ":" + SERVER_PORT + API_VERSION + "/rule?rulename=" + rule
-    rule_text = http_utils.http_get_request(url=rule_url, auth=HTTPBasicAuth(AUTH_USER, AUTH_PASSWD))
+    from utils import api_utils, http_utils, mem_utils, metrics_utils, rule_utils, upload_utils
+
+    slowest = metrics_utils.SLOWEST if slowest is None else slowest
+    auth = http_utils.basic_auth(AUTH_USER, AUTH_PASSWD)
+
+    metrics = metrics_utils.RunMetrics('yaramem', slowest)
+    if governor is not None:
+        governor.apply_priority()
+
+    rules = [rule] if isinstance(rule, str) else list(rule)
+    rule_urls = [(name, server + ":" + SERVER_PORT + API_VERSION + "/rule?rulename=" + name) for name in rules]
+    rule_bin = rule_utils.load_rule_sets(rule_urls, RULE_CACHE_DIR, auth=auth, metrics=metrics)
+    rule = rule_utils.rule_set_name(rules)
+    if rule_bin is None:
+        return
 
     if not silent:
         logger.debug('\nPulling ' + rule + ' from ' + server + '\n')
-        #logger.info(rule_text + '\n')
         logger.debug('\nScanning running processes in memory\n')
 
-    mypid = os.getpid()
-
-    rule_bin = yara.compile(source=rule_text)
+    headers = {'module': 'yara-mem-scan',
+               'Content-Type': 'application/json'}
+    results_url = server + ":" + SERVER_PORT + API_VERSION + '/results'
 
-    # TODO: Use psutil.OneShot()
-    for process in psutil.process_iter():
-        try:
-            pinfo = process.as_dict(attrs=['pid', 'name', 'cmdline'])
-        except psutil.NoSuchProcess:
-            pass
-        else:
+    summary = mem_utils.ScanSummary()
+    with upload_utils.ResultUploader(results_url, headers=headers, auth=auth, metrics=metrics,
+                                     header={"hostname": os.uname()[1], "module": 'yaramem',
+                                             "client_version": CLIENT_VERSION}) as uploader:
+        for result in api_utils.scan_memory(rule_bin, workers=workers, timeout=timeout, strings=strings,
+                                            summary=summary, metrics=metrics, governor=governor):
             if not silent:
-                logger.debug(pinfo)
-
-        client_pid = pinfo['pid']
-        client_pname = pinfo['name']
-        #client_ppath = pinfo['exe()']
-        client_pcmd = pinfo['cmdline']
-
-        if client_pid != mypid:
-            try:
-                matches = rule_bin.match(pid=client_pid)
-            except Exception as e:
-                if not silent:
-                    logging.debug(
-                        "Exception when executing yara-mem for PID: {pid}, ERROR: {error}, TRACE: {stack_trace}".format(
-                            pid=client_pid,
-                            error=str(e), stack_trace=traceback.format_exc() if ENABLE_TRACE else ""))
-                continue
-
-            if matches:
-                result = {"rulename": matches,
-                          # "processpath": client_ppath,
-                          "processpid": client_pid,
-                          "module": 'yaramem',
-                          "hostname": os.uname()[1]}
-                if not silent:
-                    logger.debug(result)
-
-                results.append(result)
-
-    if len(results) > 0:
-        headers = {'module': 'yara-mem-scan',
-                   'Content-Type': 'application/json'}
-        results_url = server + ":" + SERVER_PORT + API_VERSION + '/results'
-        response = http_utils.http_post_request(url=results_url, body=json.dumps(results),
-                                                auth=HTTPBasicAuth(AUTH_USER, AUTH_PASSWD),
-                                                headers=headers)
-
-        if response.status_code == 200:
-            logger.info("yara-mem Results pushed to server successfully")
-        else:
-            logger.error("Error uploading the results: " + response.text)
+                logger.debug(result)
 
-    else:
+            uploader.add(result)
+
+    summary.log()
+    if uploader.records == 0:
         logger.info("No matches found!!!")
+    elif uploader.failed == 0:
+        logger.info("yara-mem Results pushed to server successfully")
+    else:
+        logger.error("Error uploading " + str(uploader.failed) + " of " + str(uploader.records) + " results")
+
+    metrics_utils.write_reports(metrics, report or os.path.join(REPORT_DIR, 'yaramem.json'), prometheus)
+
+
+def triage(silent, output=None, workers=None, report=None, prometheus=None, digests=None, command_workers=None,
+           command_timeout=None):
+    """ Triage collection module
+
+    workers, command_workers and command_timeout default to those of
+    triage_utils and command_utils. The bundle and the outputs of the
+    triage_commands are hashed with SHA256, and the optional digests (md5,
+    sha1), as they are written.
+    """
+
+    import shlex
+    from utils import command_utils, metrics_utils, output_utils, triage_utils
+
+    workers = triage_utils.WORKERS if workers is None else workers
+    command_workers = command_utils.WORKERS if command_workers is None else command_workers
+    command_timeout = command_utils.COMMAND_TIMEOUT if command_timeout is None else command_timeout
+    output = output or TRIAGE_DIR
+
+    metrics = metrics_utils.RunMetrics('triage')
+    bundle_path = os.path.join(output, triage_utils.bundle_name())
+    if not silent:
+        logger.debug('\nSaving triage bundle to ' + bundle_path + '\n')
+
+    hash_log = output_utils.HashLog(os.path.join(output, 'sha256-hashing.log'))
+    manifest = triage_utils.collect(triage_utils.DARWIN_ARTIFACTS, bundle_path, workers, metrics, hash_log,
+                                    tuple(digests or ()))
+    for name, artifact in manifest['artifacts'].items():
+        if 'error' in artifact:
+            logger.error("Could not collect " + name + ": " + artifact['error'])
+        elif not silent:
+            logger.debug("Collected %s: %d entries, %d bytes in %.2fs" %
+                         (name, artifact['entries'], artifact['bytes'], artifact['seconds']))
+
+    # Configured commands run without a shell, their outputs named after the bundle
+    commands = command_utils.parse_commands(TRIAGE_COMMANDS)
+    for command in commands:
+        command.args = shlex.split(command.args)
+
+    def command_output(command):
+        return output_utils.ArtifactWriter(bundle_path[:-len('.tar.gz')] + '-' + command.name + '.log',
+                                           tuple(digests or ()))
+
+    for result in command_utils.run_commands(commands, command_output, command_workers, command_timeout, hash_log,
+                                             metrics):
+        if result['returncode']:
+            logger.warning("Command " + result['name'] + " exited with status " + str(result['returncode']))
+
+    logger.info("Triage bundle saved to " + bundle_path)
+    metrics_utils.write_reports(metrics, report or os.path.join(REPORT_DIR, 'triage.json'), prometheus)
+
+
+def prefetch(path, silent, output=None, output_format='csv', workers=None, digests=None, report=None,
+             prometheus=None):
+    """ Offline parser of the Windows prefetch files collected in directory path
+
+    The .pf files, compressed or not, are parsed natively on workers
+    processes (default of prefetch_utils) into a single CSV or NDJSON file,
+    output or prefetch-<GMT timestamp>.<format> in triage_dir, hashed as it
+    is written.
+    """
+
+    import time
+    from utils import metrics_utils, output_utils, prefetch_utils
+
+    workers = prefetch_utils.WORKERS if workers is None else workers
+    output = output or os.path.join(TRIAGE_DIR, 'prefetch-%s.%s' % (time.strftime('%Y%m%d%H%M%S', time.gmtime()),
+                                                                    output_format))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    if not silent:
+        logger.debug('\nSaving prefetch records to ' + output + '\n')
+
+    metrics = metrics_utils.RunMetrics('prefetch')
+    with output_utils.ArtifactWriter(output, tuple(digests or ())) as writer:
+        count = prefetch_utils.write_records(prefetch_utils.parse_directory(path, workers, metrics), writer,
+                                             output_format)
+    output_utils.HashLog(os.path.join(os.path.dirname(os.path.abspath(output)), 'sha256-hashing.log')).add(
+        output, writer.digests())
+
+    logger.info("%d prefetch files parsed to %s" % (count, output))
+    metrics_utils.write_reports(metrics, report or os.path.join(REPORT_DIR, 'prefetch.json'), prometheus)
 
 
 def main():
@@ -149,32 +270,146 @@ def main():
     list_parser = subparsers.add_parser('yara-disk', help='Yara scan for file/directory objects on disk')
     list_parser.add_argument('path', action='store', help='File or directory path to scan')
     list_parser.add_argument('server', action='store', help='rastrea2r REST server')
-    list_parser.add_argument('rule', action='store', help='Yara rule on REST server')
+    list_parser.add_argument('rule', action='store', nargs='+',
+                             help='Yara rules on REST server, matched in a single pass with one namespace each')
+    list_parser.add_argument('-w', '--workers', action='store', type=int, default=1,
+                             help='Number of worker processes used for matching')
+    list_parser.add_argument('--full', action='store_true', help='Rescan files unchanged since the last scan')
+    list_parser.add_argument('--resume', action='store_true',
+                             help='Continue an interrupted scan of the same path and rule from its last checkpoint')
+    list_parser.add_argument('--checkpoint-interval', action='store', type=float,
+                             help='Seconds between two checkpoints of the scan')
+    list_parser.add_argument('-e', '--exclude', action='append', default=[],
+                             help='Glob of paths or names to skip, may be repeated')
+    list_parser.add_argument('--one-file-system', action='store_true', help='Do not descend into other filesystems')
+    list_parser.add_argument('--max-size', action='store', type=int, help='Skip files larger than this many bytes')
+    list_parser.add_argument('--known-good', action='store', help='Known-good SHA256 set on REST server to skip')
+    list_parser.add_argument('--large-file-size', action='store', type=int,
+                             help='Scan files larger than this many bytes in memory-mapped windows')
+    list_parser.add_argument('--window-size', action='store', type=int,
+                             help='Size in bytes of the windows large files are scanned in')
+    list_parser.add_argument('--window-workers', action='store', type=int, default=1,
+                             help='Number of threads scanning the windows of a large file')
+    list_parser.add_argument('--byte-budget', action='store', type=int,
+                             help='Scan at most this many bytes of each large file')
+    list_parser.add_argument('--prefilter', action='store_true',
+                             help='Skip files whose type or size no rule targets, going by the rule tags and metadata')
+    list_parser.add_argument('--archive-depth', action='store', type=int,
+                             help='Levels of nested archives to scan members of, archives are not opened by default')
+    list_parser.add_argument('--archive-member-size', action='store', type=int,
+                             help='Scan at most this many bytes of each archive member')
+    list_parser.add_argument('--archive-memory', action='store', type=int,
+                             help='Bytes of an archive member held in memory before spilling to disk')
+    list_parser.add_argument('--max-bytes-per-second', action='store', type=int,
+                             help='Cap the read bandwidth of the scan, shared by all workers')
+    list_parser.add_argument('--cpu-share', action='store', type=float,
+                             help='Fraction of one CPU (0-1) each worker may keep busy')
+    list_parser.add_argument('--nice', action='store', type=int, help='Run the scan at this nice level')
+    list_parser.add_argument('--ionice-idle', action='store_true', help='Run the scan in the idle I/O class')
+    list_parser.add_argument('--max-load', action='store', type=float,
+                             help='Pause while the 1 minute load average per CPU is above this')
+    list_parser.add_argument('--max-iowait', action='store', type=float,
+                             help='Pause while the CPU iowait percentage is above this (Linux)')
+    list_parser.add_argument('--strings', action='store_true',
+                             help='Report the identifiers and offsets of the matched strings')
+    list_parser.add_argument('--report', action='store',
+                             help='Write the JSON run report to this file instead of the report_dir default')
+    list_parser.add_argument('--prometheus', action='store', help='Write the run metrics to this Prometheus textfile')
+    list_parser.add_argument('--slowest', action='store', type=int,
+                             help='Number of slowest files listed in the run report')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     """Yara memory mode"""
 
     list_parser = subparsers.add_parser('yara-mem', help='Yara scan for running processes in memory')
     list_parser.add_argument('server', action='store', help='rastrea2r REST server')
-    list_parser.add_argument('rule', action='store', help='Yara rule on REST server')
+    list_parser.add_argument('rule', action='store', nargs='+',
+                             help='Yara rules on REST server, matched in a single pass with one namespace each')
+    list_parser.add_argument('-w', '--workers', action='store', type=int, default=1,
+                             help='Number of processes matched concurrently')
+    list_parser.add_argument('-t', '--timeout', action='store', type=int,
+                             help='Seconds to spend matching a single process before skipping it')
+    list_parser.add_argument('--cpu-share', action='store', type=float,
+                             help='Fraction of one CPU (0-1) the scan may keep busy')
+    list_parser.add_argument('--nice', action='store', type=int, help='Run the scan at this nice level')
+    list_parser.add_argument('--ionice-idle', action='store_true', help='Run the scan in the idle I/O class')
+    list_parser.add_argument('--max-load', action='store', type=float,
+                             help='Pause while the 1 minute load average per CPU is above this')
+    list_parser.add_argument('--max-iowait', action='store', type=float,
+                             help='Pause while the CPU iowait percentage is above this (Linux)')
+    list_parser.add_argument('--strings', action='store_true',
+                             help='Report the identifiers and offsets of the matched strings')
+    list_parser.add_argument('--report', action='store',
+                             help='Write the JSON run report to this file instead of the report_dir default')
+    list_parser.add_argument('--prometheus', action='store', help='Write the run metrics to this Prometheus textfile')
+    list_parser.add_argument('--slowest', action='store', type=int,
+                             help='Number of slowest processes listed in the run report')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     """Triage mode"""
 
     list_parser = subparsers.add_parser('triage', help='Collect triage information from endpoint')
+    list_parser.add_argument('-o', '--output', action='store',
+                             help='Directory of the triage bundle instead of the triage_dir default')
+    list_parser.add_argument('-w', '--workers', action='store', type=int,
+                             help='Number of threads collecting artifacts concurrently')
+    list_parser.add_argument('--digest', action='append', choices=['md5', 'sha1'],
+                             help='Also hash the artifacts with this algorithm, may be repeated')
+    list_parser.add_argument('--command-workers', action='store', type=int,
+                             help='Number of triage_commands running at the same time')
+    list_parser.add_argument('--command-timeout', action='store', type=float,
+                             help='Seconds each of the triage_commands may run before it is killed')
+    list_parser.add_argument('--report', action='store',
+                             help='Write the JSON run report to this file instead of the report_dir default')
+    list_parser.add_argument('--prometheus', action='store', help='Write the run metrics to this Prometheus textfile')
+    list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
+
+    """Prefetch mode"""
+
+    list_parser = subparsers.add_parser('prefetch', help='Parse Windows prefetch files collected from endpoints')
+    list_parser.add_argument('path', action='store', help='Directory of the collected .pf files')
+    list_parser.add_argument('-o', '--output', action='store',
+                             help='File to write the records to instead of one in the triage_dir default')
+    list_parser.add_argument('-f', '--format', action='store', choices=['csv', 'ndjson'], default='csv',
+                             help='Format of the records written')
+    list_parser.add_argument('-w', '--workers', action='store', type=int,
+                             help='Number of worker processes parsing prefetch files')
+    list_parser.add_argument('--digest', action='append', choices=['md5', 'sha1'],
+                             help='Also hash the output with this algorithm, may be repeated')
+    list_parser.add_argument('--report', action='store',
+                             help='Write the JSON run report to this file instead of the report_dir default')
+    list_parser.add_argument('--prometheus', action='store', help='Write the run metrics to this Prometheus textfile')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
     args = parser.parse_args()
+    configure_logging()
+
+    governor = None
+    if args.mode in ('yara-disk', 'yara-mem'):
+        from utils import governor_utils
+
+        governor = governor_utils.Governor(getattr(args, 'max_bytes_per_second', None), args.cpu_share, args.nice,
+                                           args.ionice_idle, args.max_load, args.max_iowait)
 
     if args.mode == 'yara-disk':
-        yaradisk(args.path, args.server, args.rule, args.silent)
+        yaradisk(args.path, args.server, args.rule, args.silent, args.workers, args.full, args.exclude,
+                 args.one_file_system, args.max_size, args.known_good, args.large_file_size, args.window_size,
+                 args.window_workers, args.byte_budget, args.archive_depth, args.archive_member_size,
+                 args.archive_memory, args.report, args.prometheus, args.slowest, governor, args.resume,
+                 args.checkpoint_interval, args.prefilter, args.strings)
 
     elif args.mode == 'yara-mem':
-        yaramem(args.server, args.rule, args.silent)
+        yaramem(args.server, args.rule, args.silent, args.workers, args.timeout, args.report, args.prometheus,
+                args.slowest, governor, args.strings)
 
     elif args.mode == 'triage':
-        logger.info('Not Supported Yet!!!!')
+        triage(args.silent, args.output, args.workers, args.report, args.prometheus, args.digest,
+               args.command_workers, args.command_timeout)
+
+    elif args.mode == 'prefetch':
+        prefetch(args.path, args.silent, args.output, args.format, args.workers, args.digest, args.report,
+                 args.prometheus)
 
 
 if __name__ == '__main__':
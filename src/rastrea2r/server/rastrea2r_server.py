@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+#
+# rastrea2r reference server
+
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import zlib
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import yara
+
+from utils import rule_utils, scan_utils, upload_utils
+from rastrea2r import ENABLE_TRACE, AUTH_USER, AUTH_PASSWD, SERVER_PORT, CLIENT_VERSION, API_VERSION, \
+    SERVER_RULES_DIR, SERVER_KNOWN_GOOD_DIR, SERVER_RESULTS_DB, configure_logging
+
+__version__ = CLIENT_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Threads handling requests, and connections waiting for one before new ones are turned away
+HANDLER_THREADS = 32
+REQUEST_QUEUE_SIZE = 1024
+
+# Result batches waiting for the writer before POSTs are turned away, and rows per insert transaction
+INGEST_QUEUE_SIZE = 1000
+INSERT_ROWS = 5000
+
+# Token bucket per client host, named by its result batches: sustained requests per second and burst size
+RATE = 5.0
+BURST = 20
+
+# Largest accepted result batch, after decompression
+MAX_BODY_SIZE = 16777216
+
+# Seconds a client is asked to wait when the server is saturated
+RETRY_AFTER = 5
+
+_BUSY_RESPONSE = ('HTTP/1.0 503 Service Unavailable\r\nRetry-After: %d\r\nContent-Length: 0\r\n'
+                  'Connection: close\r\n\r\n' % RETRY_AFTER).encode('ascii')
+
+_RULE_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+class RuleStore:
+    """ Rule sources below rules_dir, with their ETags and precompiled bundles
+
+    Entries are reloaded when the file changes. Bundles are compiled on first
+    request and kept until then, so a rule is compiled once per change rather
+    than once per client. A source that does not compile is not tried again
+    until it changes. Compiling holds the lock of the entry only, requests
+    for other rules are served meanwhile.
+    """
+
+    def __init__(self, rules_dir):
+        self.rules_dir = rules_dir
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _path(self, name):
+        for suffix in ('', '.yar', '.yara'):
+            path = os.path.join(self.rules_dir, name + suffix)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def get(self, name, bundle=False):
+        """ Returns the entry of rule name, with its compiled bundle if asked for, or None if there is no such rule """
+
+        if not _RULE_NAME.match(name or ''):
+            return None
+        path = self._path(name)
+        if path is None:
+            return None
+
+        st = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or entry['stat'] != (path, st.st_size, st.st_mtime_ns):
+                with open(path, 'rb') as f:
+                    source = f.read()
+                digest = hashlib.sha256(source).hexdigest()
+                entry = {'stat': (path, st.st_size, st.st_mtime_ns),
+                         'source': source,
+                         'etag': '"' + digest + '"',
+                         'bundle_etag': '"' + digest + '-yarc"',
+                         'bundle': None,
+                         'error': None,
+                         'lock': threading.Lock(),
+                         'max_string_length': rule_utils.max_string_length(source.decode('utf-8', 'replace'))}
+                self.entries[name] = entry
+
+        if bundle:
+            with entry['lock']:
+                if entry['bundle'] is None and entry['error'] is None:
+                    try:
+                        rules = yara.compile(sources={name: entry['source'].decode('utf-8')})
+                    except (yara.Error, UnicodeDecodeError) as e:
+                        entry['error'] = str(e)
+                    else:
+                        entry['bundle'] = scan_utils.rules_to_bytes(rules)
+            if entry['error'] is not None:
+                raise yara.Error(entry['error'])
+
+        return entry
+
+
+def _rulename(record):
+    """ Returns the rule names of a record, listing every match of records carrying match records """
+
+    matches = record.get('matches')
+    if isinstance(matches, list):
+        return ', '.join(scan_utils.match_name(match) for match in matches
+                         if isinstance(match, dict) and 'rule' in match and 'namespace' in match)
+    return str(record.get('rulename', ''))
+
+
+def _batch_host(records):
+    """ Returns the hostname the first record of a batch was sent from, or None """
+
+    first = records[0] if records else None
+    if isinstance(first, dict) and first.get('hostname'):
+        # Kept apart from the addresses of the batches without a hostname
+        return 'host:' + str(first['hostname'])
+    return None
+
+
+class ResultStore:
+    """ SQLite store of result records, written in bulk by a background thread
+
+    put() only queues a batch, so request handlers never wait on the disk.
+    The writer drains up to insert_rows records per transaction. The queue
+    is bounded and put() refuses batches while it is full, which lets the
+    handlers push back on clients instead of buffering without limit.
+    """
+
+    def __init__(self, db_path, queue_size=INGEST_QUEUE_SIZE, insert_rows=INSERT_ROWS):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.insert_rows = insert_rows
+        self.received = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        db = sqlite3.connect(db_path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS results ('
+                   'id INTEGER PRIMARY KEY, received REAL, address TEXT, hostname TEXT, module TEXT, '
+                   'rulename TEXT, record TEXT)')
+        db.execute('CREATE INDEX IF NOT EXISTS results_hostname ON results (hostname)')
+        db.execute('CREATE INDEX IF NOT EXISTS results_rulename ON results (rulename)')
+        db.commit()
+        db.close()
+
+        self.thread = threading.Thread(target=self._run, name='rastrea2r-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, address, records):
+        """ Queues a list of result records, returns False if the writer is too far behind """
+
+        rows = [(time.time(), address, str(record.get('hostname', '')), str(record.get('module', '')),
+                 _rulename(record), json.dumps(record))
+                for record in records if isinstance(record, dict)]
+        try:
+            self.queue.put_nowait(rows)
+        except queue.Full:
+            with self.lock:
+                self.rejected += len(rows)
+            return False
+        with self.lock:
+            self.received += len(rows)
+        return True
+
+    def count(self):
+        db = sqlite3.connect(self.db_path)
+        try:
+            return db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        finally:
+            db.close()
+
+    def close(self):
+        """ Writes the queued batches and stops the writer thread """
+
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute('PRAGMA synchronous=NORMAL')
+        stop = False
+        while not stop:
+            rows = self.queue.get()
+            if rows is None:
+                break
+            while len(rows) < self.insert_rows:
+                try:
+                    more = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    stop = True
+                    break
+                rows.extend(more)
+
+            try:
+                with db:
+                    db.executemany('INSERT INTO results (received, address, hostname, module, rulename, record) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self.inserted += len(rows)
+            except sqlite3.Error as e:
+                logger.error(
+                    "Exception when inserting {count} results, ERROR: {error}, TRACE: {stack_trace}".format(
+                        count=len(rows), error=str(e), stack_trace=traceback.format_exc() if ENABLE_TRACE else ""))
+        db.close()
+
+
+class RateLimiter:
+    """ Token bucket per host: rate requests per second sustained, up to burst at once """
+
+    def __init__(self, rate=RATE, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, host):
+        """ Takes a token for host, returns 0 if allowed or the seconds until a token is available """
+
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.buckets[host] = (tokens, now)
+                return (1 - tokens) / self.rate
+
+            self.buckets[host] = (tokens - 1, now)
+            if len(self.buckets) > 100000:
+                # Hosts idle long enough to have refilled their bucket are forgotten
+                idle = self.burst / self.rate
+                self.buckets = {key: value for key, value in self.buckets.items() if now - value[1] < idle}
+            return 0
+
+
+class PooledHTTPServer(HTTPServer):
+    """ HTTPServer handling connections on a fixed pool of threads fed by a bounded queue
+
+    Connections arriving while max_pending are already waiting get an
+    immediate 503 with Retry-After instead of a thread of their own.
+    """
+
+    # Listen backlog, connections are accepted as fast as they arrive and queued in self.pending
+    request_queue_size = 128
+
+    def __init__(self, address, handler, threads=HANDLER_THREADS, max_pending=REQUEST_QUEUE_SIZE):
+        HTTPServer.__init__(self, address, handler)
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.busy = 0
+        self.workers = [threading.Thread(target=self._serve_pending, name='rastrea2r-handler', daemon=True)
+                        for _ in range(threads)]
+        for worker in self.workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.busy += 1
+            try:
+                request.sendall(_BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _serve_pending(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        for _ in self.workers:
+            self.pending.put(None)
+
+
+class Rastrea2rServer(PooledHTTPServer):
+    """ Serves rules and known-good sets to the clients and ingests their results """
+
+    def __init__(self, address, rules_dir, known_good_dir, results_db, auth=(AUTH_USER, AUTH_PASSWD),
+                 threads=HANDLER_THREADS, max_pending=REQUEST_QUEUE_SIZE, ingest_queue_size=INGEST_QUEUE_SIZE,
+                 rate=RATE, burst=BURST):
+        self.rules = RuleStore(rules_dir)
+        self.known_good_dir = known_good_dir
+        self.results = ResultStore(results_db, queue_size=ingest_queue_size)
+        self.limiter = RateLimiter(rate, burst)
+        self.authorization = 'Basic ' + base64.b64encode(':'.join(auth).encode('utf-8')).decode('ascii') \
+            if auth else None
+        PooledHTTPServer.__init__(self, address, Rastrea2rHandler, threads, max_pending)
+
+    def stats(self):
+        return {'received': self.results.received,
+                'inserted': self.results.inserted,
+                'rejected': self.results.rejected,
+                'ingest_queue': self.results.queue.qsize(),
+                'request_queue': self.pending.qsize(),
+                'busy': self.busy}
+
+    def server_close(self):
+        PooledHTTPServer.server_close(self)
+        self.results.close()
+
+
+class Rastrea2rHandler(BaseHTTPRequestHandler):
+
+    # Seconds a connection may stall before its handler thread is released
+    timeout = 30
+
+    server_version = 'rastrea2r/' + __version__
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.client_address[0], format % args))
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if body:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_json(self, status, value, headers=None):
+        self._send(status, json.dumps(value).encode('utf-8'), headers=headers)
+
+    def _authorized(self):
+        expected = self.server.authorization
+        if expected is None or hmac.compare_digest(self.headers.get('Authorization', ''), expected):
+            return True
+        self._send_json(401, {'error': 'unauthorized'}, headers={'WWW-Authenticate': 'Basic realm="rastrea2r"'})
+        return False
+
+    def _route(self):
+        url = urlsplit(self.path)
+        if not url.path.startswith(API_VERSION + '/'):
+            return None, {}
+        return url.path[len(API_VERSION):], {key: values[0] for key, values in parse_qs(url.query).items()}
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        route, params = self._route()
+        if route == '/rule':
+            self._get_rule(params.get('rulename'))
+        elif route == '/knowngood':
+            self._get_known_good(params.get('name'))
+        elif route == '/stats':
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        route, params = self._route()
+        if route != '/results':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        try:
+            records = self._read_records()
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        # Hosts behind one NAT or proxy share an address, each is limited on its own
+        wait = self.server.limiter.acquire(_batch_host(records) or self.client_address[0])
+        if wait:
+            self._send_json(429, {'error': 'rate limited'}, headers={'Retry-After': str(max(1, int(wait + 0.999)))})
+            return
+
+        if not self.server.results.put(self.client_address[0], records):
+            self._send_json(503, {'error': 'busy'}, headers={'Retry-After': str(RETRY_AFTER)})
+            return
+
+        self._send_json(200, {'status': 'queued'})
+
+    def _read_records(self):
+        """ Returns the records of a JSON array or object, or of an NDJSON batch with its header merged in """
+
+        body = self._read_body().decode('utf-8')
+        if self.headers.get('Content-Type', '').startswith(upload_utils.NDJSON_TYPE):
+            lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+            if not lines or not isinstance(lines[0], dict):
+                raise ValueError("missing batch header")
+            header = lines[0]
+            return [dict(header, **record) for record in lines[1:] if isinstance(record, dict)]
+
+        records = json.loads(body)
+        return records if isinstance(records, list) else [records]
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("request body too large")
+        body = self.rfile.read(length)
+
+        if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                body = decompressor.decompress(body, MAX_BODY_SIZE)
+            except zlib.error as e:
+                raise ValueError("invalid gzip body: " + str(e))
+            if decompressor.unconsumed_tail:
+                raise ValueError("request body too large")
+
+        return body
+
+    def _get_rule(self, name):
+        bundle = rule_utils.COMPILED_RULES_TYPE in self.headers.get('Accept', '')
+        try:
+            entry = self.server.rules.get(name, bundle=bundle)
+        except (yara.Error, UnicodeDecodeError) as e:
+            logger.error("Could not compile rule " + str(name) + ": " + str(e))
+            entry = self.server.rules.get(name)
+            bundle = False
+
+        if entry is None:
+            self._send_json(404, {'error': 'no such rule'})
+            return
+
+        etag = entry['bundle_etag'] if bundle else entry['etag']
+        headers = {'ETag': etag, 'Vary': 'Accept'}
+        if bundle and entry['max_string_length'] is not None:
+            headers[rule_utils.MAX_STRING_LENGTH_HEADER] = str(entry['max_string_length'])
+
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, headers=headers)
+        elif bundle:
+            self._send(200, entry['bundle'], content_type=rule_utils.COMPILED_RULES_TYPE, headers=headers)
+        else:
+            self._send(200, entry['source'], content_type='text/plain; charset=utf-8', headers=headers)
+
+    def _get_known_good(self, name):
+        if not _RULE_NAME.match(name or ''):
+            self._send_json(404, {'error': 'no such set'})
+            return
+        path = os.path.join(self.server.known_good_dir, name + '.bin')
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self._send_json(404, {'error': 'no such set'})
+            return
+
+        with f:
+            st = os.fstat(f.fileno())
+            etag = '"%x-%x"' % (st.st_size, st.st_mtime_ns)
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, headers={'ETag': etag})
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(st.st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, 1048576)
+
+
+def main():
+    parser = ArgumentParser(description='Rastrea2r reference server for rules and scan results')
+    parser.add_argument('-b', '--bind', action='store', default='0.0.0.0', help='Address to listen on')
+    parser.add_argument('-p', '--port', action='store', type=int, default=int(SERVER_PORT), help='Port to listen on')
+    parser.add_argument('--rules-dir', action='store', default=SERVER_RULES_DIR, help='Directory of rule sources')
+    parser.add_argument('--known-good-dir', action='store', default=SERVER_KNOWN_GOOD_DIR,
+                        help='Directory of known-good SHA256 sets (<name>.bin)')
+    parser.add_argument('--db', action='store', default=SERVER_RESULTS_DB, help='SQLite results store')
+    parser.add_argument('--threads', action='store', type=int, default=HANDLER_THREADS,
+                        help='Number of request handler threads')
+    parser.add_argument('--request-queue', action='store', type=int, default=REQUEST_QUEUE_SIZE,
+                        help='Connections waiting for a handler before new ones get a 503')
+    parser.add_argument('--ingest-queue', action='store', type=int, default=INGEST_QUEUE_SIZE,
+                        help='Result batches waiting for the writer before POSTs get a 503')
+    parser.add_argument('--rate', action='store', type=float, default=RATE,
+                        help='Sustained result POSTs per second allowed per host')
+    parser.add_argument('--burst', action='store', type=int, default=BURST,
+                        help='Result POSTs a host may make at once')
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+    args = parser.parse_args()
+    configure_logging()
+
+    os.makedirs(args.rules_dir, exist_ok=True)
+    server = Rastrea2rServer((args.bind, args.port), args.rules_dir, args.known_good_dir, args.db,
+                             threads=args.threads, max_pending=args.request_queue,
+                             ingest_queue_size=args.ingest_queue, rate=args.rate, burst=args.burst)
+    logger.info("Serving rules from %s and storing results in %s on %s:%d" % (args.rules_dir, args.db, args.bind,
+                                                                              args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,178 +9,166 @@ import os
 
 # import winreg
 import glob
-import hashlib
 import platform
-import psutil  # New multiplatform library
 import shutil
 import subprocess
 import sys
-import yara
-import zipfile
 from argparse import ArgumentParser
-from mimetypes import MimeTypes
-from requests import post
 from time import gmtime, strftime
-from requests.auth import HTTPBasicAuth
 import json
 import logging
-import traceback
 
-from utils.http_utils import http_get_request, http_post_request
-from rastrea2r import ENABLE_TRACE, AUTH_USER, AUTH_PASSWD, SERVER_PORT, CLIENT_VERSION, API_VERSION, WINDOWS_COMMANDS
+from rastrea2r import AUTH_USER, AUTH_PASSWD, SERVER_PORT, CLIENT_VERSION, API_VERSION, WINDOWS_COMMANDS, \
+    RULE_CACHE_DIR, REPORT_DIR, CHECKPOINT_DIR, \
+    configure_logging
 
 __version__ = CLIENT_VERSION
 
 """ Variables """
 logger = logging.getLogger(__name__)
-BLOCKSIZE = 65536
-mime = MimeTypes()
 
 
-def hashfile(file):
-    """ Hashes output files with SHA256 using buffers to reduce memory impact """
+def yaradisk(path, server, rule, silent, archive_depth=None, archive_member_size=None, archive_memory=None, report=None,
+             prometheus=None, slowest=None, governor=None, resume=False,
+             checkpoint_interval=None, prefilter=False,
+             strings=False):
+    """ Yara file/directory object scan module
+
+    Archive members are scanned only with an archive_depth. The other
+    archive_ limits, checkpoint_interval and slowest default to those of
+    archive_utils, checkpoint_utils and metrics_utils when None.
+    """
+
+    # Imported here so the modes that do not scan start without yara, psutil and requests
+    from utils import api_utils, archive_utils, checkpoint_utils, http_utils, metrics_utils, rule_utils, scan_utils, \
+        upload_utils
+
+    archive_depth = archive_depth or 0
+    archive_member_size = archive_utils.MAX_MEMBER_SIZE if archive_member_size is None else archive_member_size
+    archive_memory = archive_utils.MEMORY_CAP if archive_memory is None else archive_memory
+    if checkpoint_interval is None:
+        checkpoint_interval = checkpoint_utils.CHECKPOINT_INTERVAL
+    slowest = metrics_utils.SLOWEST if slowest is None else slowest
+    auth = http_utils.basic_auth(AUTH_USER, AUTH_PASSWD)
+
+    metrics = metrics_utils.RunMetrics('yaradisk', slowest)
+    if governor is not None:
+        governor.apply_priority()
+
+    # Several rule sets are compiled together, one namespace each, and matched in a single pass
+    rules = [rule] if isinstance(rule, str) else list(rule)
+    rule_urls = [(name, server + ":" + SERVER_PORT + API_VERSION + "/rule?rulename=" + name) for name in rules]
+    logger.debug("Rule_URL:" + ', '.join(rule_url for _, rule_url in rule_urls))
+    rule_bin = rule_utils.load_rule_sets(rule_urls, RULE_CACHE_DIR, auth=auth, metrics=metrics)
+    rule = rule_utils.rule_set_name(rules)
+    if rule_bin is None:
+        return
 
-    hasher = hashlib.sha256()
+    if not silent:
+        logger.debug('\nPulling ' + rule + ' from ' + server + '\n')
+        logger.debug('\nScanning ' + path + '\n')
 
-    with open(file, 'rb') as afile:
-        buf = afile.read(BLOCKSIZE)
-        hasher.update(buf)
+    # Archive members are matched in chunks overlapping by the longest rule string when it is bounded
+    overlap = rule_utils.rule_info(RULE_CACHE_DIR, rule).get('max_string_length') or scan_utils.WINDOW_OVERLAP
+    scanner = scan_utils.FileScanner(rule_bin, overlap=overlap, archive_depth=archive_depth,
+                                     archive_member_size=archive_member_size, archive_memory=archive_memory,
+                                     governor=governor, prefilter=prefilter, strings=strings)
+    checkpoint = checkpoint_utils.Checkpoint(checkpoint_utils.state_path(CHECKPOINT_DIR, path, rule),
+                                             scanner.fingerprint(), checkpoint_interval)
+    if not resume or not checkpoint.resume():
+        checkpoint.remove()
+
+    headers = {'module': 'yara-disk-scan',
+               'Content-Type': 'application/json'}
+    results_url = server + ":" + SERVER_PORT + API_VERSION + '/results'
+
+    with upload_utils.ResultUploader(results_url, headers=headers, auth=auth, metrics=metrics,
+                                     keep_unsent=True,
+                                     header={"hostname": os.environ['COMPUTERNAME'], "module": 'yaradisk',
+                                             "client_version": CLIENT_VERSION}) as uploader:
+        # Results whose upload failed before the scan was interrupted
+        for record in checkpoint.unsent:
+            uploader.add(json.loads(record))
+
+        # Checkpoints keep the results of finished files that could not be uploaded
+        for result in api_utils.scan_path(scanner, path, checkpoint=checkpoint, on_checkpoint=uploader.flush,
+                                          metrics=metrics):
+            if not silent:
+                logger.debug(result)
 
-    return (hasher.hexdigest())
+            uploader.add(result)
 
+    # Keep the results that could not be uploaded for the next --resume
+    if uploader.unsent:
+        checkpoint.save(uploader.unsent)
+    else:
+        checkpoint.remove()
 
-def yaradisk(path, server, rule, silent):
-    """ Yara file/directory object scan module """
+    if uploader.records == 0:
+        logger.info("No matches found!!!")
+    elif uploader.failed == 0:
+        logger.info("yara-disk Results pushed to server successfully")
+    else:
+        logger.error("Error uploading " + str(uploader.failed) + " of " + str(uploader.records) + " results")
 
-    results = []
-    rule_url = server + ":" + SERVER_PORT + API_VERSION + "/rule?rulename=" + rule
-    logger.debug("Rule_URL:"+rule_url)
-    rule_text = http_get_request(url=rule_url, auth=HTTPBasicAuth(AUTH_USER, AUTH_PASSWD))
+    metrics_utils.write_reports(metrics, report or os.path.join(REPORT_DIR, 'yaradisk.json'), prometheus)
 
-    if not silent:
-        logger.debug('\nPulling ' + rule + ' from ' + server + '\n')
-        #logger.info(str(rule_text) + '\n')
-        logger.debug('\nScanning ' + path + '\n')
 
-    rule_bin = yara.compile(sources={'namespace': rule_text})
-
-    for root, dirs, filenames in os.walk(path):
-        for name in filenames:
-            try:
-                file_path = os.path.join(root, name)
-
-                mime_type = mime.guess_type(file_path)
-                if "openxmlformats-officedocument" in mime_type[
-                        0]:  # If an OpenXML Office document (docx/xlsx/pptx,etc.)
-                    doc = zipfile.ZipFile(file_path)  # Unzip and scan in memory only
-                    for doclist in doc.namelist():
-                        matches = rule_bin.match(data=doc.read(doclist))
-                        if matches:
-                            break
-                else:
-                    matches = rule_bin.match(filepath=file_path)
-
-                if matches:
-                    result = {"rulename": str(matches[0]),
-                              "filename": file_path,
-                              "module": 'yaradisk',
-                              "hostname": os.environ['COMPUTERNAME']}
-                    if not silent:
-                        logger.debug(result)
-
-                    results.append(result)
-
-            except Exception as e:
-                logging.error(
-                    "Exception when executing yara-disk ERROR: {error}, TRACE: {stack_trace}".format(
-                        error=str(e), stack_trace=traceback.format_exc() if ENABLE_TRACE else ""))
-
-    if len(results) > 0:
-        logger.debug("Results is: " + str(results))
-        headers = {'module': 'yara-disk-scan',
-                   'Content-Type': 'application/json'}
-        results_url = server + ":" + SERVER_PORT + API_VERSION + '/results'
-        response = http_post_request(url=results_url, body=json.dumps(results),
-                                                auth=HTTPBasicAuth(AUTH_USER, AUTH_PASSWD),
-                                                headers=headers)
-
-        if response.status_code == 200:
-            logger.info("yara-disk Results pushed to server successfully")
-        else:
-            logger.error("Error uploading the results: " + response.text)
+def yaramem(server, rule, silent, workers=1, timeout=None, report=None, prometheus=None,
+            slowest=None, governor=None, strings=False):
+    """ Yara process memory scan module, timeout and slowest defaulting to those of mem_utils and metrics_utils """
 
-    else:
-        logger.info("No matches found!!!")
+    from utils import api_utils, http_utils, mem_utils, metrics_utils, rule_utils, upload_utils
 
+    slowest = metrics_utils.SLOWEST if slowest is None else slowest
+    auth = http_utils.basic_auth(AUTH_USER, AUTH_PASSWD)
 
-def yaramem(server, rule, silent):
-    """ Yara process memory scan module """
+    metrics = metrics_utils.RunMetrics('yaramem', slowest)
+    if governor is not None:
+        governor.apply_priority()
 
-    results = []
-    rule_url = server + ":" + SERVER_PORT + API_VERSION + "/rule?rulename=" + rule
-    rule_text = http_get_request(url=rule_url, auth=HTTPBasicAuth(AUTH_USER, AUTH_PASSWD))
+    rules = [rule] if isinstance(rule, str) else list(rule)
+    rule_urls = [(name, server + ":" + SERVER_PORT + API_VERSION + "/rule?rulename=" + name) for name in rules]
+    rule_bin = rule_utils.load_rule_sets(rule_urls, RULE_CACHE_DIR, auth=auth, metrics=metrics)
+    rule = rule_utils.rule_set_name(rules)
+    if rule_bin is None:
+        return
 
     if not silent:
         logger.debug('\nPulling ' + rule + ' from ' + server + '\n')
-        #logger.info(rule_text + '\n')
         logger.debug('\nScanning running processes in memory\n')
 
-    mypid = os.getpid()
-
-    rule_bin = yara.compile(source=rule_text)
-
-    for process in psutil.process_iter():
-        try:
-            pinfo = process.as_dict(attrs=['pid', 'name', 'exe', 'cmdline'])
-        except psutil.NoSuchProcess:
-            pass
-        else:
+    headers = {'module': 'yara-mem-scan',
+               'Content-Type': 'application/json'}
+    results_url = server + ":" + SERVER_PORT + API_VERSION + '/results'
+
+    summary = mem_utils.ScanSummary()
+    with upload_utils.ResultUploader(results_url, headers=headers, auth=auth, metrics=metrics,
+                                     header={"hostname": os.environ['COMPUTERNAME'], "module": 'yaramem',
+                                             "client_version": CLIENT_VERSION}) as uploader:
+        for result in api_utils.scan_memory(rule_bin, workers=workers, timeout=timeout,
+                                            attrs=['pid', 'name', 'exe', 'cmdline'], strings=strings,
+                                            summary=summary, metrics=metrics, governor=governor):
             if not silent:
-                print(pinfo)
-
-        client_pid = pinfo['pid']
-        client_pname = pinfo['name']
-        client_ppath = pinfo['exe']
-        client_pcmd = pinfo['cmdline']
-
-        if client_pid != mypid:
-            try:
-                matches = rule_bin.match(pid=client_pid)
-            except:
-                if not silent:
-                    logger.debug('Failed scanning process ID: %d' % client_pid)
-                continue
-
-            if matches:
-                result = {"rulename": str(matches),
-                          "processpath": client_ppath,
-                          "processpid": client_pid,
-                          "module": 'yaramem',
-                          "hostname": os.environ['COMPUTERNAME']}
-                if not silent:
-                    logger.debug(result)
-
-                results.append(result)
-
-    if len(results) > 0:
-        headers = {'module': 'yara-mem-scan',
-                   'Content-Type': 'application/json'}
-        results_url = server + ":" + SERVER_PORT + API_VERSION + '/results'
-        response = http_post_request(url=results_url, body=json.dumps(results),
-                                                auth=HTTPBasicAuth(AUTH_USER, AUTH_PASSWD),
-                                                headers=headers)
-
-        if response.status_code == 200:
-            logger.info("yara-mem Results pushed to server successfully")
-        else:
-            logger.error("Error uploading the results: " + response.text)
+                logger.debug(result)
 
-    else:
+            uploader.add(result)
+
+    summary.log()
+    if uploader.records == 0:
         logger.info("No matches found!!!")
+    elif uploader.failed == 0:
+        logger.info("yara-mem Results pushed to server successfully")
+    else:
+        logger.error("Error uploading " + str(uploader.failed) + " of " + str(uploader.records) + " results")
+
+    metrics_utils.write_reports(metrics, report or os.path.join(REPORT_DIR, 'yaramem.json'), prometheus)
 
 
-def memdump(tool_server, output_server, silent):
-    """ Memory acquisition module """
+def memdump(tool_server, output_server, silent, digests=None):
+    """ Memory acquisition module, the dump hashed with SHA256 and the optional digests as it is written """
+
+    from utils import output_utils
 
     smb_bin = tool_server + r'\tools'  # TOOLS Read-only share with third-party binary tools
 
@@ -199,22 +187,31 @@ def memdump(tool_server, output_server, silent):
 
     recivedt = strftime('%Y%m%d%H%M%S', gmtime())  # Timestamp in GMT
 
-    f = open(r'\\' + smb_data + r'\\' + recivedt + '-' + os.environ['COMPUTERNAME'] + '-' + commandname[0] + '.img',
-             'w')
+    hash_log = output_utils.HashLog(r'\\%s\\%s-%s-sha256-hashing.log' % (smb_data, recivedt, os.environ['COMPUTERNAME']))
 
     if not silent:
         print('\nDumping memory to ' + r'\\' + smb_data + r'\\' + recivedt + '-' + os.environ['COMPUTERNAME'] + '-'
               + commandname[0] + '.img\n')
 
-    pst = subprocess.call(r'\\' + smb_bin + r'\\' + tool, stdout=f)
+    image = r'\\%s\\%s-%s-%s.img' % (smb_data, recivedt, os.environ['COMPUTERNAME'], commandname[0])
+    with output_utils.ArtifactWriter(image, tuple(digests or ())) as f:
+        pst = output_utils.run_command(r'\\' + smb_bin + r'\\' + tool, f)
+
+    hash_log.add(f.name, f.digests())
+
 
-    with open(r'\\' + smb_data + r'\\' + recivedt + '-' + os.environ['COMPUTERNAME'] + '-' + 'sha256-hashing.log',
-              'a') as g:
-        g.write("%s - %s \n\n" % (f.name, hashfile(f.name)))
+def triage(tool_server, output_server, silent, digests=None, workers=None, timeout=None):
+    """ Triage collection module
 
+    The commands run concurrently, workers and timeout defaulting to those
+    of command_utils, and each output is hashed with SHA256 and the optional
+    digests as it is written.
+    """
 
-def triage(tool_server, output_server, silent):
-    """ Triage collection module """
+    from utils import command_utils, output_utils
+
+    workers = command_utils.WORKERS if workers is None else workers
+    timeout = command_utils.COMMAND_TIMEOUT if timeout is None else timeout
 
     createt = strftime('%Y%m%d%H%M%S', gmtime())  # Timestamp in GMT
     smb_bin = tool_server + r'\tools'  # TOOLS Read-only share with third-party binary tools
@@ -227,31 +224,25 @@ def triage(tool_server, output_server, silent):
     if not silent:
         logger.debug('\nSaving output to ' + r'\\' + smb_data)
 
-    with open(r'\\' + smb_data + r'\\' + createt + '-' + os.environ['COMPUTERNAME'] + '-' + 'sha256-hashing.log',
-              'a') as g:
-        for task in WINDOWS_COMMANDS:  # Iterates over the list of commands
+    hash_log = output_utils.HashLog(r'\\%s\\%s-%s-sha256-hashing.log' % (smb_data, createt, os.environ['COMPUTERNAME']))
+    commands = command_utils.parse_commands(WINDOWS_COMMANDS, prefix=r'\\' + smb_bin + r'\\')
 
-            fullcommand = str.replace(task, '\n', '')
-            commandname = fullcommand.split('.')
-            logger.debug("Command to be executed: " + fullcommand)
-            
-            if not silent:
-                logger.debug('\nSaving output of ' + task + ' to ' + r'\\' + smb_data + r'\\' + createt + '-' + os.environ[
-                    'COMPUTERNAME']
-                    + '-' + commandname[0] + '.log\n')
-
-            f = open(
-                r'\\' + smb_data + r'\\' + createt + '-' + os.environ['COMPUTERNAME'] + '-' + commandname[0] + '.log',
-                'w')
-
-            pst = subprocess.call(r'\\' + smb_bin + r'\\' + fullcommand, stdout=f)
+    def output(command):
+        output_path = r'\\%s\\%s-%s-%s.log' % (smb_data, createt, os.environ['COMPUTERNAME'], command.name)
+        if not silent:
+            logger.debug('\nSaving output of ' + command.args + ' to ' + output_path + '\n')
+        return output_utils.ArtifactWriter(output_path, tuple(digests or ()))
 
-            g.write("%s - %s \n\n" % (f.name, hashfile(f.name)))
+    for result in command_utils.run_commands(commands, output, workers, timeout, hash_log):
+        if result['returncode']:
+            logger.warning("Command " + result['name'] + " exited with status " + str(result['returncode']))
 
  
-def webhist(tool_server, output_server, histuser, silent):
+def webhist(tool_server, output_server, histuser, silent, digests=None):
     """ Web History collection module """
 
+    from utils import output_utils
+
     createt = strftime('%Y%m%d%H%M%S', gmtime())  # Timestamp in GMT
     smb_bin = tool_server + r'\tools'  # TOOLS Read-only share with third-party binary tools
 
@@ -268,6 +259,8 @@ def webhist(tool_server, output_server, histuser, silent):
     if not silent:
         print('\nSaving output to ' + smb_data)
 
+    hash_log = output_utils.HashLog(r'\\%s\\%s-%s-sha256-hashing.log' % (smb_data, createt, os.environ['COMPUTERNAME']))
+
     if histuser == 'all':
         user_dirs = next(os.walk('c:\\users\\'))[1]
     else:
@@ -330,61 +323,55 @@ def webhist(tool_server, output_server, histuser, silent):
         if not silent:
             print(bhv_command)
         subprocess.call(bhv_command, startupinfo=si)
-        # Hash output file
-        g = open(r'\\' + smb_data + r'\\' + createt + '-' + os.environ['COMPUTERNAME'] + '-' + 'sha256-hashing.log',
-                 'a')
-        g.write("%s - %s \n\n" % (webhist_output, hashfile(webhist_output)))
+        # Hash output file, written by browsinghistoryview so read once for all digests
+        hash_log.add(webhist_output, output_utils.file_digests(webhist_output, tuple(digests or ())))
         # Remove temp webcache folder for IE10+
         if os.path.exists(ie10_tmp_cache_dir):
             shutil.rmtree(ie10_tmp_cache_dir)
 
 
-def prefetch(tool_server, output_server, silent):
-    """ Prefetch collection module """
-    createt = strftime('%Y%m%d%H%M%S', gmtime())
-
-    try:
-        smb_bin = tool_server + r'\tools'
-
-        smb_data = output_server + r'\data' + r'\prefetch-' + os.environ['COMPUTERNAME'] + r'\\' + createt
-
-        if not os.path.exists(r'\\' + smb_data):
-            os.makedirs(r'\\' + smb_data)
-
-        if not silent:
-            print('\nSaving output to ' + r'\\' + smb_data)
+def prefetch(tool_server, output_server, silent, digests=None, workers=None, output_format='csv'):
+    """ Prefetch collection module
 
-        user_dirs = next(os.walk('c:\\windows\\prefetch\\'))[2]
-        b = True
-        for f in user_dirs:
-            if f.endswith(".pf"):
-                cmd = r'\\' + smb_bin + r'\winprefetchview\winprefetchview.exe'
-                cmd = cmd + r' /prefetchfile ' + r'c:\windows\prefetch\\' + f + r' /scomma ' + r'\\' + smb_data + '\\' + f + r'.csv'
+    The prefetch files, compressed or not, are parsed natively on workers
+    processes (default of prefetch_utils) into a single CSV or NDJSON file
+    hashed as it is written, instead of running winprefetchview once per
+    file, so tool_server is no longer used.
+    """
 
-                p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                p.communicate()
+    from utils import output_utils, prefetch_utils
 
-                if b:
-                    b = False
-                    smb_data2 = r'\\' + output_server + r'\data' + r'\prefetch-' + os.environ[
-                        'COMPUTERNAME'] + r'\\' + createt + r'\Main'
-                    if not os.path.exists(smb_data2):
-                        os.makedirs(smb_data2)
+    workers = prefetch_utils.WORKERS if workers is None else workers
+    createt = strftime('%Y%m%d%H%M%S', gmtime())  # Timestamp in GMT
 
-                    cmd_main = r'\\' + smb_bin + r'\winprefetchview\winprefetchview.exe'
-                    cmd_main = cmd_main + r' /scomma ' + smb_data2 + '\\' + r'Global-Prefetch' + r'.csv'
+    smb_data = output_server + r'\data' + r'\prefetch-' + os.environ['COMPUTERNAME'] + '\\' + createt
+    if not os.path.exists(r'\\' + smb_data):
+        os.makedirs(r'\\' + smb_data)
 
-                    p2 = subprocess.Popen(cmd_main, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    p2.communicate()
+    if not silent:
+        print('\nSaving output to ' + r'\\' + smb_data)
 
-    except:
-        print("Some PF files cannot be read")
-        pass
+    prefetch_dir = os.path.join(os.environ.get('SystemRoot', 'c:\\windows'), 'Prefetch')
+    output = r'\\' + smb_data + '\\' + createt + '-' + os.environ['COMPUTERNAME'] + '-prefetch.' + output_format
+    try:
+        with output_utils.ArtifactWriter(output, tuple(digests or ())) as writer:
+            count = prefetch_utils.write_records(prefetch_utils.parse_directory(prefetch_dir, workers), writer,
+                                                 output_format)
+    except OSError as e:
+        logger.error("Could not parse the prefetch files of " + prefetch_dir + ": " + str(e))
+        return
+
+    hash_log = output_utils.HashLog('\\\\%s\\%s-%s-sha256-hashing.log' % (smb_data, createt, os.environ['COMPUTERNAME']))
+    hash_log.add(output, writer.digests())
+    if not silent:
+        print('\n%d prefetch files parsed to %s' % (count, output))
 
 
-def collect(tool_server, output_server, silent):
+def collect(tool_server, output_server, silent, digests=None):
     """ Artifact Collection Module """
 
+    from utils import output_utils
+
     smb_bin=tool_server + r'\tools' # TOOLS Read-only share with third-party binary tools
 
     smb_data=output_server + r'\data' + r'\collection-' + os.environ['COMPUTERNAME'] # DATA Write-only share for output data
@@ -407,11 +394,17 @@ def collect(tool_server, output_server, silent):
 
     subprocess.call(r'\\'+smb_bin+r'\\'+tool)
 
-    with open(r'\\' + smb_data + r'\\' + recivedt + '-sha256-hashing.log', 'a') as g:
-        g.write("%s - %s \n\n" % (r'\\'+smb_data+r'\\'+ os.environ['COMPUTERNAME'] +'.zip', hashfile(r'\\'+smb_data+r'\\'+os.environ['COMPUTERNAME']+'.zip')))
+    # The archive is written by CyLR, so it is read once for all digests
+    archive = r'\\' + smb_data + r'\\' + os.environ['COMPUTERNAME'] + '.zip'
+    hash_log = output_utils.HashLog(r'\\' + smb_data + r'\\' + recivedt + '-sha256-hashing.log')
+    hash_log.add(archive, output_utils.file_digests(archive, tuple(digests or ())))
 
 
 def main():
+    # Worker processes of the one-file executable start by running it again
+    from multiprocessing import freeze_support
+    freeze_support()
+
     parser = ArgumentParser(description='::Rastrea2r RESTful remote Yara/Triage tool for Incident Responders ::')
 
     subparsers = parser.add_subparsers(dest="mode", help='modes of operation')
@@ -421,14 +414,64 @@ def main():
     list_parser = subparsers.add_parser('yara-disk', help='Yara scan for file/directory objects on disk')
     list_parser.add_argument('path', action='store', help='File or directory path to scan')
     list_parser.add_argument('server', action='store', help='rastrea2r REST server')
-    list_parser.add_argument('rule', action='store', help='Yara rule on REST server')
+    list_parser.add_argument('rule', action='store', nargs='+',
+                             help='Yara rules on REST server, matched in a single pass with one namespace each')
+    list_parser.add_argument('--resume', action='store_true',
+                             help='Continue an interrupted scan of the same path and rule from its last checkpoint')
+    list_parser.add_argument('--checkpoint-interval', action='store', type=float,
+                             help='Seconds between two checkpoints of the scan')
+    list_parser.add_argument('--prefilter', action='store_true',
+                             help='Skip files whose type or size no rule targets, going by the rule tags and metadata')
+    list_parser.add_argument('--archive-depth', action='store', type=int,
+                             help='Levels of nested archives to scan members of, archives are not opened by default')
+    list_parser.add_argument('--archive-member-size', action='store', type=int,
+                             help='Scan at most this many bytes of each archive member')
+    list_parser.add_argument('--archive-memory', action='store', type=int,
+                             help='Bytes of an archive member held in memory before spilling to disk')
+    list_parser.add_argument('--max-bytes-per-second', action='store', type=int,
+                             help='Cap the read bandwidth of the scan, shared by all workers')
+    list_parser.add_argument('--cpu-share', action='store', type=float,
+                             help='Fraction of one CPU (0-1) each worker may keep busy')
+    list_parser.add_argument('--nice', action='store', type=int, help='Run the scan at this nice level')
+    list_parser.add_argument('--ionice-idle', action='store_true', help='Run the scan in the idle I/O class')
+    list_parser.add_argument('--max-load', action='store', type=float,
+                             help='Pause while the 1 minute load average per CPU is above this')
+    list_parser.add_argument('--max-iowait', action='store', type=float,
+                             help='Pause while the CPU iowait percentage is above this (Linux)')
+    list_parser.add_argument('--strings', action='store_true',
+                             help='Report the identifiers and offsets of the matched strings')
+    list_parser.add_argument('--report', action='store',
+                             help='Write the JSON run report to this file instead of the report_dir default')
+    list_parser.add_argument('--prometheus', action='store', help='Write the run metrics to this Prometheus textfile')
+    list_parser.add_argument('--slowest', action='store', type=int,
+                             help='Number of slowest files listed in the run report')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     """Yara memory mode"""
 
     list_parser = subparsers.add_parser('yara-mem', help='Yara scan for running processes in memory')
     list_parser.add_argument('server', action='store', help='rastrea2r REST server')
-    list_parser.add_argument('rule', action='store', help='Yara rule on REST server')
+    list_parser.add_argument('rule', action='store', nargs='+',
+                             help='Yara rules on REST server, matched in a single pass with one namespace each')
+    list_parser.add_argument('-w', '--workers', action='store', type=int, default=1,
+                             help='Number of processes matched concurrently')
+    list_parser.add_argument('-t', '--timeout', action='store', type=int,
+                             help='Seconds to spend matching a single process before skipping it')
+    list_parser.add_argument('--cpu-share', action='store', type=float,
+                             help='Fraction of one CPU (0-1) the scan may keep busy')
+    list_parser.add_argument('--nice', action='store', type=int, help='Run the scan at this nice level')
+    list_parser.add_argument('--ionice-idle', action='store_true', help='Run the scan in the idle I/O class')
+    list_parser.add_argument('--max-load', action='store', type=float,
+                             help='Pause while the 1 minute load average per CPU is above this')
+    list_parser.add_argument('--max-iowait', action='store', type=float,
+                             help='Pause while the CPU iowait percentage is above this (Linux)')
+    list_parser.add_argument('--strings', action='store_true',
+                             help='Report the identifiers and offsets of the matched strings')
+    list_parser.add_argument('--report', action='store',
+                             help='Write the JSON run report to this file instead of the report_dir default')
+    list_parser.add_argument('--prometheus', action='store', help='Write the run metrics to this Prometheus textfile')
+    list_parser.add_argument('--slowest', action='store', type=int,
+                             help='Number of slowest processes listed in the run report')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     """Memory acquisition mode"""
@@ -436,6 +479,8 @@ def main():
     list_parser = subparsers.add_parser('memdump', help='Acquires a memory dump from the endpoint')
     list_parser.add_argument('TOOLS_server', action='store', help='Binary tool server (SMB share)')
     list_parser.add_argument('DATA_server', action='store', help='Data output server (SMB share)')
+    list_parser.add_argument('--digest', action='append', choices=['md5', 'sha1'],
+                             help='Also hash the outputs with this algorithm, may be repeated')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     """Triage mode"""
@@ -443,6 +488,12 @@ def main():
     list_parser = subparsers.add_parser('triage', help='Collects triage information from the endpoint')
     list_parser.add_argument('TOOLS_server', action='store', help='Binary tool server (SMB share)')
     list_parser.add_argument('DATA_server', action='store', help='Data output server (SMB share)')
+    list_parser.add_argument('-w', '--workers', action='store', type=int,
+                             help='Number of triage commands running at the same time')
+    list_parser.add_argument('-t', '--timeout', action='store', type=float,
+                             help='Seconds each triage command may run before it is killed')
+    list_parser.add_argument('--digest', action='append', choices=['md5', 'sha1'],
+                             help='Also hash the outputs with this algorithm, may be repeated')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     """Web History mode"""
@@ -452,6 +503,8 @@ def main():
     list_parser.add_argument('DATA_server', action='store', help='Data output server (SMB share)')
     list_parser.add_argument('-u', '--username', action='store', default='all',
                              help='User account to generate history for')
+    list_parser.add_argument('--digest', action='append', choices=['md5', 'sha1'],
+                             help='Also hash the outputs with this algorithm, may be repeated')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     """Prefetch View mode"""
@@ -459,6 +512,12 @@ def main():
     list_parser = subparsers.add_parser('prefetch', help='Generates prefetch view')
     list_parser.add_argument('TOOLS_server', action='store', help='Binary tool server (SMB share)')
     list_parser.add_argument('DATA_server', action='store', help='Data output server (SMB share)')
+    list_parser.add_argument('-f', '--format', action='store', choices=['csv', 'ndjson'], default='csv',
+                             help='Format of the prefetch records written')
+    list_parser.add_argument('-w', '--workers', action='store', type=int,
+                             help='Number of worker processes parsing prefetch files')
+    list_parser.add_argument('--digest', action='append', choices=['md5', 'sha1'],
+                             help='Also hash the output with this algorithm, may be repeated')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     """Artifact Collection mode"""
@@ -466,31 +525,44 @@ def main():
     list_parser = subparsers.add_parser('collect', help='Acquires artifacts from the endpoint')
     list_parser.add_argument('TOOLS_server', action='store', help='Binary tool server (SMB share)')
     list_parser.add_argument('DATA_server', action='store', help='Data output server (SMB share)')
+    list_parser.add_argument('--digest', action='append', choices=['md5', 'sha1'],
+                             help='Also hash the outputs with this algorithm, may be repeated')
     list_parser.add_argument('-s', '--silent', action='store_true', help='Suppresses standard output')
 
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
     args = parser.parse_args()
+    configure_logging()
+
+    governor = None
+    if args.mode in ('yara-disk', 'yara-mem'):
+        from utils import governor_utils
+
+        governor = governor_utils.Governor(getattr(args, 'max_bytes_per_second', None), args.cpu_share, args.nice,
+                                           args.ionice_idle, args.max_load, args.max_iowait)
 
     if args.mode == 'yara-disk':
-        yaradisk(args.path, args.server, args.rule, args.silent)
+        yaradisk(args.path, args.server, args.rule, args.silent, args.archive_depth, args.archive_member_size,
+                 args.archive_memory, args.report, args.prometheus, args.slowest, governor, args.resume,
+                 args.checkpoint_interval, args.prefilter, args.strings)
 
     elif args.mode == 'yara-mem':
-        yaramem(args.server, args.rule, args.silent)
+        yaramem(args.server, args.rule, args.silent, args.workers, args.timeout, args.report, args.prometheus,
+                args.slowest, governor, args.strings)
 
     elif args.mode == 'memdump':
-        memdump(args.TOOLS_server, args.DATA_server, args.silent)
+        memdump(args.TOOLS_server, args.DATA_server, args.silent, args.digest)
 
     elif args.mode == 'triage':
-        triage(args.TOOLS_server, args.DATA_server, args.silent)
+        triage(args.TOOLS_server, args.DATA_server, args.silent, args.digest, args.workers, args.timeout)
 
     elif args.mode == 'web-hist':
-        webhist(args.TOOLS_server, args.DATA_server, args.username, args.silent)
+        webhist(args.TOOLS_server, args.DATA_server, args.username, args.silent, args.digest)
 
     elif args.mode == 'prefetch':
-        prefetch(args.TOOLS_server, args.DATA_server, args.silent)
+        prefetch(args.TOOLS_server, args.DATA_server, args.silent, args.digest, args.workers, args.format)
 
     elif args.mode == 'collect':
-        collect(args.TOOLS_server, args.DATA_server, args.silent)
+        collect(args.TOOLS_server, args.DATA_server, args.silent, args.digest)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+'''
+Embeddable scanning API shared by the yara-disk and yara-mem clients
+
+scan_path() and scan_memory() take compiled yara rules and lazily yield the
+result records the clients upload, so an agent can drive scans in process,
+filter or pipeline the records and stop early by closing the generator.
+Neither fetches rules nor uploads anything.
+'''
+import logging
+
+from utils import scan_utils, walk_utils
+
+logger = logging.getLogger(__name__)
+
+
+def scan_path(rules, path, workers=1, excludes=None, one_file_system=False, max_size=None, index=None, full=False,
+              checkpoint=None, on_checkpoint=None, metrics=None, **options):
+    """ Yields a result record, {'filename', 'matches'}, for every file below path that matches rules
+
+    rules are compiled yara rules, matched by a scan_utils.FileScanner built
+    with options (e.g. strings=True, archive_depth=0), or a FileScanner built
+    by the caller, e.g. to key index or checkpoint with its fingerprint().
+    path, a file or a directory, is walked by walk_utils.walk_files with
+    excludes, one_file_system and max_size, and the files are matched on
+    workers processes by scan_utils.scan_files, skipping those unchanged in
+    index, a FileIndex, unless full. Files that cannot be scanned are logged
+    and skipped. Archive members are reported as archive!member paths.
+
+    With checkpoint, a checkpoint_utils.Checkpoint, the walk continues from
+    its position and, whenever it is due between two files, even files
+    served from the index, on_checkpoint is called, the index committed and
+    the checkpoint saved with the records on_checkpoint returns: those
+    yielded so far that the caller could not deliver, as JSON strings.
+    Removing or saving the checkpoint once the scan is over is up to the
+    caller.
+    """
+
+    scanner = rules if isinstance(rules, scan_utils.FileScanner) else scan_utils.FileScanner(rules, **options)
+    files = walk_utils.walk_files(path, excludes=excludes, one_file_system=one_file_system, max_size=max_size,
+                                  state=checkpoint.walk_state if checkpoint is not None else None)
+
+    def save_checkpoint():
+        unsent = on_checkpoint() if on_checkpoint is not None else []
+        if index is not None:
+            index.commit()
+        checkpoint.save(unsent)
+
+    for file_path, matches, error in scan_utils.scan_files(scanner, files, workers, index=index, full=full,
+                                                           metrics=metrics, checkpoint=checkpoint,
+                                                           on_due=save_checkpoint):
+        if error:
+            logger.error("Exception when executing yara-disk for {file_path}, ERROR: {error}".format(
+                file_path=file_path, error=error))
+            continue
+
+        if matches:
+            yield {"filename": file_path,
+                   "matches": matches}
+
+
+def scan_memory(rules, pids=None, workers=1, timeout=None, attrs=None, regions=False, region_perms=None,
+                overlap=None, strings=False, summary=None, metrics=None, governor=None):
+    """ Yields a result record, {'processpid', 'matches'}, for every running process whose memory matches rules
+
+    Processes, all but this one or those in the set pids, are matched on
+    workers threads for at most timeout seconds each (mem_utils.MATCH_TIMEOUT
+    if None) by mem_utils.scan_processes, which records those skipped in
+    summary, a ScanSummary. attrs are the psutil attributes read from every
+    process, records carrying the executable as processpath when they include
+    'exe'. With regions (Linux), the regions selected by region_perms are read
+    through /proc in chunks overlapping by overlap bytes, and every matching
+    region yields a record with its address range (region) and backing file
+    (mappedfile).
+    """
+
+    # psutil is only needed by memory scans
+    from utils import mem_utils
+
+    region_scanner = None
+    if regions:
+        region_scanner = mem_utils.RegionScanner(
+            rules, perms=mem_utils.REGION_PERMS if region_perms is None else region_perms,
+            overlap=mem_utils.REGION_OVERLAP if overlap is None else overlap, strings=strings)
+
+    for pinfo, matches, region in mem_utils.scan_processes(
+            rules, workers, mem_utils.MATCH_TIMEOUT if timeout is None else timeout,
+            attrs=mem_utils.PROCESS_ATTRS if attrs is None else attrs, summary=summary, pids=pids,
+            region_scanner=region_scanner, metrics=metrics, governor=governor, strings=strings):
+        if not matches:
+            continue
+
+        result = {"processpath": pinfo['exe']} if 'exe' in pinfo else {}
+        result["processpid"] = pinfo['pid']
+        result["matches"] = matches
+        if region is not None:
+            result["region"] = '%x-%x' % (region['start'], region['end'])
+            result["mappedfile"] = region['path']
+        yield result
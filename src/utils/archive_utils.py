@@ -0,0 +1,125 @@
+'''
+Streaming access to archive members for the yara-disk scans
+'''
+import bz2
+import gzip
+import logging
+import lzma
+import os
+import tarfile
+import tempfile
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Defaults for how deep and how much of an archive is scanned
+MAX_DEPTH = 2
+MAX_MEMBER_SIZE = 268435456
+MEMORY_CAP = 16777216
+
+HEADER_SIZE = 512
+
+# Separates an archive path from the path of a member inside it
+MEMBER_SEPARATOR = '!'
+
+_DECOMPRESSORS = {'gzip': lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode='rb'),
+                  'bzip2': lambda fileobj: bz2.BZ2File(fileobj, mode='rb'),
+                  'xz': lambda fileobj: lzma.LZMAFile(fileobj, mode='rb')}
+_SUFFIXES = {'gzip': '.gz', 'bzip2': '.bz2', 'xz': '.xz'}
+
+# Errors raised by corrupt, truncated or encrypted archives
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError, EOFError, OSError, RuntimeError,
+                  NotImplementedError)
+
+
+def archive_type(header):
+    """ Returns 'zip', 'tar', 'gzip', 'bzip2', 'xz' or None from the first HEADER_SIZE bytes of a file """
+
+    if header.startswith(b'PK\x03\x04'):
+        return 'zip'
+    if header[257:262] == b'ustar':
+        return 'tar'
+    if header.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if header.startswith(b'BZh'):
+        return 'bzip2'
+    if header.startswith(b'\xfd7zXZ\x00'):
+        return 'xz'
+    return None
+
+
+def _decompressed_name(name, kind):
+    if name.lower().endswith(_SUFFIXES[kind]):
+        return name[:-len(_SUFFIXES[kind])]
+    return name
+
+
+def _members(kind, fileobj, name):
+    """ Yields (member name, stream) for the members of an archive of the given kind """
+
+    if kind == 'zip':
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                try:
+                    with archive.open(info) as stream:
+                        yield info.filename, stream
+                except (RuntimeError, NotImplementedError) as e:
+                    # Encrypted members or unsupported compression methods
+                    logger.debug("Skipping " + info.filename + ": " + str(e))
+        return
+
+    if kind in _DECOMPRESSORS:
+        with _DECOMPRESSORS[kind](fileobj) as stream:
+            is_tar = archive_type(stream.read(HEADER_SIZE)) == 'tar'
+        fileobj.seek(0)
+        if not is_tar:
+            with _DECOMPRESSORS[kind](fileobj) as stream:
+                yield _decompressed_name(name, kind), stream
+            return
+
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for info in archive:
+            if info.isfile():
+                yield info.name, archive.extractfile(info)
+
+
+def iter_members(fileobj, path, max_depth=MAX_DEPTH, max_member_size=MAX_MEMBER_SIZE, memory_cap=MEMORY_CAP):
+    """ Yields (member path, seekable file) for the members of the archive in fileobj, recursively
+
+    fileobj must be seekable. Members are read as streams and copied, up to
+    max_member_size bytes, into spooled temporary files which stay in memory
+    up to memory_cap bytes and spill to disk beyond, so memory use does not
+    depend on the largest member. Each file is only valid until the next
+    member is yielded. Member paths join the archive path and member names
+    with MEMBER_SEPARATOR; archives nested max_depth levels deep are not opened.
+    """
+
+    if max_depth < 1:
+        return
+
+    fileobj.seek(0)
+    kind = archive_type(fileobj.read(HEADER_SIZE))
+    if kind is None:
+        return
+
+    fileobj.seek(0)
+    for name, stream in _members(kind, fileobj, os.path.basename(path)):
+        member_path = path + MEMBER_SEPARATOR + name
+        with tempfile.SpooledTemporaryFile(max_size=memory_cap) as spool:
+            remaining = max_member_size
+            while remaining > 0:
+                block = stream.read(min(remaining, 1048576))
+                if not block:
+                    break
+                spool.write(block)
+                remaining -= len(block)
+            if remaining <= 0:
+                logger.debug("Truncated " + member_path + " to " + str(max_member_size) + " bytes")
+
+            spool.seek(0)
+            yield member_path, spool
+
+            for nested in iter_members(spool, member_path, max_depth - 1, max_member_size, memory_cap):
+                yield nested
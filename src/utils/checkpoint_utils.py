@@ -0,0 +1,119 @@
+'''
+Checkpoints of long yara-disk scans, to resume them after an interruption
+'''
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+from utils import walk_utils
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two checkpoints of a running scan
+CHECKPOINT_INTERVAL = 60.0
+
+# Version of the state file layout, older state files are ignored
+STATE_VERSION = 1
+
+
+def state_path(checkpoint_dir, path, rule):
+    """ Returns the state file of the scans of path with rule """
+
+    key = hashlib.sha1(('%s\0%s' % (os.path.abspath(path), rule)).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(checkpoint_dir, key + '.json')
+
+
+class Checkpoint:
+    """ Position of a yara-disk scan, periodically saved to a local state file
+
+    The state holds the walker position (directories not listed yet and files
+    not handed to the scanner yet), the pending files (handed to the scanner
+    but whose results were not all yielded) and the records whose upload
+    failed. save() is called between results, once the uploader has been
+    flushed, so every file finished before a checkpoint has been reported and
+    resuming neither scans nor reports it again. Files finished after the last
+    checkpoint are scanned again on resume and their matches may be reported
+    twice.
+    """
+
+    def __init__(self, path, fingerprint, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self.walk_state = walk_utils.WalkState()
+        self.pending = OrderedDict()
+        self.unsent = []
+        self.saves = 0
+        self.next_save = time.monotonic() + interval
+
+    def resume(self):
+        """ Loads the saved state, returning whether the scan continues from it """
+
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            logger.info("No checkpoint to resume from, starting a new scan")
+            return False
+        except (OSError, ValueError) as e:
+            logger.error("Could not read the checkpoint " + self.path + ": " + str(e))
+            return False
+
+        if state.get('version') != STATE_VERSION or state.get('fingerprint') != self.fingerprint:
+            logger.warning("The rules changed since the checkpoint was saved, starting a new scan")
+            return False
+
+        # Pending files go first, they were walked before the files still queued by the walker
+        self.walk_state = walk_utils.WalkState(state['directories'], state['pending'] + state['files'])
+        self.unsent = state['unsent']
+        logger.info("Resuming the scan: %d directories and %d files left, %d results to upload" %
+                    (len(state['directories']), len(state['pending']) + len(state['files']), len(self.unsent)))
+        return True
+
+    def track(self, files):
+        """ Yields from the (path, stat result) pairs of files, recording each path as pending """
+
+        for file_path, st in files:
+            self.pending[file_path] = None
+            yield file_path, st
+
+    def done(self, file_path):
+        """ Records that every result of file_path has been yielded """
+
+        self.pending.pop(file_path, None)
+
+    def due(self):
+        return time.monotonic() >= self.next_save
+
+    def save(self, unsent=()):
+        """ Writes the state atomically, with the records whose upload failed """
+
+        state = {'version': STATE_VERSION,
+                 'fingerprint': self.fingerprint,
+                 'saved': time.time(),
+                 'pending': list(self.pending),
+                 'unsent': list(unsent)}
+        state.update(self.walk_state.snapshot())
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+        self.saves += 1
+        self.next_save = time.monotonic() + self.interval
+        logger.debug("Saved checkpoint " + self.path)
+
+    def remove(self):
+        """ Deletes the state once the scan has completed """
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
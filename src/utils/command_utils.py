@@ -0,0 +1,209 @@
+'''
+Concurrent runner of the triage commands of every platform client
+
+Commands run on a bounded number of threads, each with a timeout, and
+their standard output is streamed to an output sink (e.g. an
+output_utils.ArtifactWriter) as it is produced. Ordering constraints keep
+the commands that must not overlap apart: a command only starts once the
+commands it runs after have finished, never while another command holding
+the same lock runs, and ready commands start by decreasing priority.
+Triage then takes about as long as its slowest command rather than the sum
+of them all.
+'''
+import logging
+import subprocess
+import threading
+import time
+
+from utils import output_utils
+
+logger = logging.getLogger(__name__)
+
+# Commands running at the same time
+WORKERS = 4
+
+# Seconds a command may run before it is killed
+COMMAND_TIMEOUT = 600
+
+
+class Command:
+    """ A command line to run, with its ordering constraints
+
+    name identifies the command (its output file, the after lists of other
+    commands). args is the command line, a string or a list. The command
+    starts after every command named in after has finished, whatever its
+    outcome, never alongside another command with the same lock, and
+    before the ready commands of lower priority. timeout overrides the
+    timeout of the run.
+    """
+
+    def __init__(self, name, args, priority=0, after=(), lock=None, timeout=None):
+        self.name = name
+        self.args = args
+        self.priority = priority
+        self.after = tuple(after)
+        self.lock = lock
+        self.timeout = timeout
+
+    def __repr__(self):
+        return 'Command(%r, %r)' % (self.name, self.args)
+
+
+def parse_command(entry, prefix=''):
+    """ Returns the Command of a configured command line, or None for a blank entry
+
+    The line may start with options between braces, e.g.
+    '{priority=5 after=psinfo,pslist lock=handles timeout=120} handle.exe -a'.
+    The command is named by the name option or else after the file name of
+    its first word up to the first dot (C:\\tools\\handle.exe is named
+    handle), and prefix, e.g. the tools share, is prepended to the line.
+    """
+
+    entry = entry.strip()
+    if not entry:
+        return None
+
+    line = entry
+    options = {}
+    if entry.startswith('{'):
+        end = entry.find('}')
+        if end < 0:
+            raise ValueError("Unterminated options in command: " + entry)
+        for option in entry[1:end].split():
+            key, _, value = option.partition('=')
+            if key not in ('name', 'priority', 'after', 'lock', 'timeout') or not value:
+                raise ValueError("Unknown command option " + option + " in: " + entry)
+            options[key] = value
+        entry = entry[end + 1:].strip()
+        if not entry:
+            raise ValueError("No command line after the options of: " + line)
+
+    name = options.get('name') or entry.split()[0].replace('\\', '/').rsplit('/', 1)[-1].split('.')[0]
+    return Command(name, prefix + entry,
+                   priority=int(options.get('priority', 0)),
+                   after=[after for after in options.get('after', '').split(',') if after],
+                   lock=options.get('lock'),
+                   timeout=float(options['timeout']) if 'timeout' in options else None)
+
+
+def parse_commands(entries, prefix=''):
+    """ Returns the Commands of configured command lines, skipping blank entries """
+
+    return [command for command in (parse_command(entry, prefix) for entry in entries) if command is not None]
+
+
+def check_order(commands):
+    """ Raises ValueError if names repeat or the after constraints name unknown commands or form a cycle """
+
+    names = [command.name for command in commands]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError("Duplicate command names: " + ', '.join(duplicates))
+    for command in commands:
+        unknown = [name for name in command.after if name not in names]
+        if unknown:
+            raise ValueError("Command " + command.name + " runs after unknown commands: " + ', '.join(unknown))
+
+    # Kahn's algorithm, whatever cannot be ordered is part of a cycle
+    left = {command.name: set(command.after) for command in commands}
+    while left:
+        ready = [name for name, after in left.items() if not after]
+        if not ready:
+            raise ValueError("Commands run after each other in a cycle: " + ', '.join(sorted(left)))
+        for name in ready:
+            del left[name]
+        for after in left.values():
+            after.difference_update(ready)
+
+
+def run_commands(commands, sink, workers=WORKERS, timeout=COMMAND_TIMEOUT, hash_log=None, metrics=None, **kwargs):
+    """ Runs commands concurrently, streaming the output of each into sink(command), and returns their results
+
+    sink returns a writable binary file object, closed once the command has
+    finished; when it has digests() (an output_utils.ArtifactWriter), they
+    are recorded in the result and in hash_log, an output_utils.HashLog.
+    At most workers commands run at the same time, each killed after its
+    own timeout or timeout seconds. The results, in the order of commands,
+    are dicts with the name, returncode (None if the command could not be
+    run or timed out), seconds, output name and digests, plus timed_out or
+    error when it failed. With metrics, a RunMetrics, command times are
+    added as a phase and observed. kwargs are passed to subprocess.Popen.
+    """
+
+    commands = list(commands)
+    check_order(commands)
+
+    # Ready commands start by decreasing priority, then in the order given
+    pending = sorted(commands, key=lambda command: -command.priority)
+    finished = set()
+    locks = set()
+    results = {}
+    condition = threading.Condition()
+
+    def next_command():
+        for command in pending:
+            if finished.issuperset(command.after) and (command.lock is None or command.lock not in locks):
+                return command
+        return None
+
+    def worker():
+        while True:
+            with condition:
+                command = next_command()
+                while command is None:
+                    if not pending:
+                        return
+                    condition.wait()
+                    command = next_command()
+                pending.remove(command)
+                if command.lock is not None:
+                    locks.add(command.lock)
+
+            result = _run_command(command, sink, timeout, kwargs)
+
+            with condition:
+                results[command.name] = result
+                finished.add(command.name)
+                locks.discard(command.lock)
+                condition.notify_all()
+                if hash_log is not None and result.get('digests'):
+                    try:
+                        hash_log.add(result['output'], result['digests'])
+                    except OSError as e:
+                        logger.error("Could not write the hashing log " + hash_log.path + ": " + str(e))
+            if metrics is not None:
+                metrics.add_time('command', result['seconds'])
+                metrics.observe('command', command.name, result['seconds'])
+
+    threads = [threading.Thread(target=worker, name='command-%d' % i, daemon=True)
+               for i in range(max(1, min(workers, len(commands))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [results[command.name] for command in commands]
+
+
+def _run_command(command, sink, timeout, kwargs):
+    logger.debug("Running " + command.name + ": " + str(command.args))
+    result = {'name': command.name, 'returncode': None}
+    start = time.perf_counter()
+    output = None
+    try:
+        output = sink(command)
+        with output:
+            result['returncode'] = output_utils.run_command(
+                command.args, output, timeout=command.timeout if command.timeout is not None else timeout, **kwargs)
+    except subprocess.TimeoutExpired as e:
+        logger.error("Command " + command.name + " timed out after " + str(e.timeout) + "s")
+        result['timed_out'] = True
+    except Exception as e:
+        logger.error("Could not run " + command.name + ": " + str(e))
+        result['error'] = str(e)
+    result['seconds'] = round(time.perf_counter() - start, 6)
+
+    if output is not None:
+        result['output'] = getattr(output, 'name', None)
+        if hasattr(output, 'digests'):
+            result['digests'] = output.digests()
+    return result
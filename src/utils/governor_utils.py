@@ -0,0 +1,163 @@
+'''
+Resource governor bounding the impact of scans on busy hosts
+'''
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two checks of the system load and iowait
+CHECK_INTERVAL = 2.0
+
+# Seconds slept at a time while the system is overloaded
+BACKOFF = 5.0
+
+# Read bandwidth that may be used in a burst after an idle period, in seconds of budget
+BURST_SECONDS = 1.0
+
+
+class Governor:
+    """ Paces a scan to a read bandwidth, a CPU share and the system load
+
+    Scanning code calls pace() after every unit of work with the bytes it
+    read and the seconds it was busy. pace() sleeps as needed to keep the
+    caller under bytes_per_second and to a cpu_share (0-1) of one CPU, and
+    while the load average per CPU exceeds max_load or iowait exceeds
+    max_iowait percent, it waits for the system to calm down before
+    returning. nice and ionice_idle lower the priority of the processes
+    apply_priority() is called in.
+
+    A Governor may be shared by threads. Worker processes each get their own,
+    built from options(workers) with an equal share of the bandwidth.
+    """
+
+    def __init__(self, bytes_per_second=None, cpu_share=None, nice=None, ionice_idle=False, max_load=None,
+                 max_iowait=None, check_interval=CHECK_INTERVAL, backoff=BACKOFF):
+        self.bytes_per_second = bytes_per_second
+        self.cpu_share = cpu_share if cpu_share and cpu_share < 1 else None
+        self.nice = nice
+        self.ionice_idle = ionice_idle
+        self.max_load = max_load
+        self.max_iowait = max_iowait
+        self.check_interval = check_interval
+        self.backoff = backoff
+        self.throttled = 0.0
+        self.backed_off = 0.0
+        self.lock = threading.Lock()
+        self._allowance = 0.0
+        self._last_refill = time.monotonic()
+        self._next_check = 0.0
+        self._cpu_times = None
+
+    def options(self, workers=1):
+        """ Returns the picklable options of the governor of one of workers processes """
+
+        return {'bytes_per_second': self.bytes_per_second / workers if self.bytes_per_second else None,
+                'cpu_share': self.cpu_share,
+                'nice': self.nice,
+                'ionice_idle': self.ionice_idle,
+                'max_load': self.max_load,
+                'max_iowait': self.max_iowait,
+                'check_interval': self.check_interval,
+                'backoff': self.backoff}
+
+    def apply_priority(self):
+        """ Sets the configured CPU and I/O priority on the current process """
+
+        if self.nice is None and not self.ionice_idle:
+            return
+
+        import psutil
+
+        process = psutil.Process()
+        if self.nice is not None:
+            try:
+                if os.name == 'nt':
+                    process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS if self.nice < 19 else psutil.IDLE_PRIORITY_CLASS)
+                else:
+                    process.nice(max(process.nice(), self.nice))
+            except (psutil.Error, OSError) as e:
+                logger.warning("Could not lower the CPU priority: " + str(e))
+
+        if self.ionice_idle:
+            try:
+                if hasattr(psutil, 'IOPRIO_CLASS_IDLE'):
+                    process.ionice(psutil.IOPRIO_CLASS_IDLE)
+                else:
+                    # Windows: very low I/O priority
+                    process.ionice(0)
+            except (AttributeError, psutil.Error, OSError) as e:
+                logger.warning("Could not lower the I/O priority: " + str(e))
+
+    def pace(self, nbytes=0, busy=0.0):
+        """ Sleeps as needed after reading nbytes in busy seconds of work """
+
+        delay = 0.0
+        if self.bytes_per_second and nbytes:
+            with self.lock:
+                now = time.monotonic()
+                self._allowance = min(self.bytes_per_second * BURST_SECONDS,
+                                      self._allowance + (now - self._last_refill) * self.bytes_per_second)
+                self._last_refill = now
+                self._allowance -= nbytes
+                if self._allowance < 0:
+                    delay = -self._allowance / self.bytes_per_second
+
+        if self.cpu_share and busy:
+            delay = max(delay, busy * (1 - self.cpu_share) / self.cpu_share)
+
+        if delay:
+            with self.lock:
+                self.throttled += delay
+            time.sleep(delay)
+
+        if self.max_load or self.max_iowait:
+            self.wait_for_headroom()
+
+    def wait_for_headroom(self):
+        """ Blocks while the system load or iowait is above its threshold, checking every check_interval """
+
+        now = time.monotonic()
+        with self.lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+
+        reason = self._overloaded()
+        if reason is None:
+            return
+
+        logger.info("Backing off: " + reason)
+        start = time.monotonic()
+        while reason is not None:
+            time.sleep(self.backoff)
+            reason = self._overloaded()
+        waited = time.monotonic() - start
+        with self.lock:
+            self.backed_off += waited
+            self._next_check = time.monotonic() + self.check_interval
+        logger.info("Resuming after backing off for %.1fs" % waited)
+
+    def _overloaded(self):
+        """ Returns why the system is overloaded, or None """
+
+        if self.max_load and hasattr(os, 'getloadavg'):
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+            if load > self.max_load:
+                return "load average per CPU %.2f above %.2f" % (load, self.max_load)
+
+        if self.max_iowait:
+            import psutil
+
+            # iowait since the previous check, reported by Linux only
+            times = psutil.cpu_times()
+            previous, self._cpu_times = self._cpu_times, times
+            if previous is not None and hasattr(times, 'iowait'):
+                total = sum(times) - sum(previous)
+                iowait = 100.0 * (times.iowait - previous.iowait) / total if total > 0 else 0.0
+                if iowait > self.max_iowait:
+                    return "iowait %.1f%% above %.1f%%" % (iowait, self.max_iowait)
+
+        return None
@@ -0,0 +1,107 @@
+'''
+Known-good SHA256 sets searched in place through mmap
+'''
+import hashlib
+import json
+import logging
+import mmap
+import os
+
+from utils import http_utils
+
+logger = logging.getLogger(__name__)
+
+BLOCKSIZE = 65536
+DIGEST_SIZE = 32
+
+
+def file_sha256(file_path):
+    """ Returns the SHA256 digest of a file, hashed in BLOCKSIZE buffers """
+
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCKSIZE), b''):
+            hasher.update(block)
+    return hasher.digest()
+
+
+def write_hash_set(hex_digests, path):
+    """ Writes hex SHA256 digests as a sorted, deduplicated known-good set file """
+
+    digests = sorted({bytes.fromhex(hex_digest.strip()) for hex_digest in hex_digests if hex_digest.strip()})
+    with open(path, 'wb') as f:
+        for digest in digests:
+            if len(digest) != DIGEST_SIZE:
+                raise ValueError("Not a SHA256 digest: " + digest.hex())
+            f.write(digest)
+
+
+class KnownGoodSet:
+    """ Sorted file of raw 32-byte SHA256 digests, binary searched through mmap
+
+    Nothing is loaded into Python objects, so sets with tens of millions of
+    entries only cost the pages the lookups touch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % DIGEST_SIZE:
+            self.file.close()
+            raise ValueError(path + " is not a known-good set, size is not a multiple of " + str(DIGEST_SIZE))
+
+        self.count = size // DIGEST_SIZE
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, digest):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            value = self.map[middle * DIGEST_SIZE:(middle + 1) * DIGEST_SIZE]
+            if value < digest:
+                low = middle + 1
+            elif value > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+
+def fetch_hash_set(url, name, cache_dir, auth=None):
+    """ Downloads the known-good set name into cache_dir unless the cached copy is current
+
+    Returns the local path of the set, or None if it is neither on the server nor cached.
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, os.path.basename(name) + '.bin')
+    meta_path = path + '.json'
+
+    headers = {}
+    if os.path.exists(path):
+        try:
+            with open(meta_path, 'r') as f:
+                etag = json.load(f).get('etag')
+            if etag:
+                headers['If-None-Match'] = etag
+        except (OSError, ValueError):
+            pass
+
+    response = http_utils.http_download(url, path, headers=headers, auth=auth)
+
+    if response is not None and response.status_code == 200:
+        with open(meta_path, 'w') as f:
+            json.dump({'etag': response.headers.get('ETag')}, f)
+    elif response is None or response.status_code != 304:
+        logger.error("Could not fetch known-good set " + name + " from " + url)
+
+    return path if os.path.exists(path) else None
@@ -1,22 +1,99 @@
+import gzip
+import json
 import logging
-import requests
+import os
+import tempfile
+import threading
+import time
 import traceback
 
-import logging
-
 logger = logging.getLogger(__name__)
 
 enable_trace = True
 
+# Client defaults, can be overridden per request
+timeout = (10, 60)   # (connect, read) seconds
+retries = 3          # extra attempts on connection errors, 429 and 5xx responses
+backoff = 0.5        # seconds, doubled after every failed attempt
+max_retry_after = 60  # seconds, longest Retry-After of a 429 or 503 waited for
+pool_size = 10       # keep-alive connections kept per host
 
-def http_post_request(url, headers=None, body=None, auth=None):
-    headers = headers or {}
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """ Returns the shared keep-alive session used by all requests
+
+    requests is imported here, on the first request, as it takes longer to
+    import than many client runs need.
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def basic_auth(user, password):
+    """ Returns the requests HTTP basic authentication of user """
+
+    from requests.auth import HTTPBasicAuth
+
+    return HTTPBasicAuth(user, password)
+
+
+def _request(method, url, request_timeout=None, request_retries=None, **kwargs):
+    import requests
+
+    request_timeout = timeout if request_timeout is None else request_timeout
+    request_retries = retries if request_retries is None else request_retries
+
+    for attempt in range(request_retries + 1):
+        try:
+            result = get_session().request(method, url, timeout=request_timeout, verify=False, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == request_retries:
+                raise
+            logging.warning("{method} {url} failed: {error}, retrying".format(method=method, url=url, error=str(e)))
+        else:
+            if (result.status_code < 500 and result.status_code != 429) or attempt == request_retries:
+                return result
+            logging.warning("{method} {url} returned {status}, retrying".format(
+                method=method, url=url, status=result.status_code))
+            # Rate limited or busy servers say when to come back
+            retry_after = result.headers.get('Retry-After', '') if result.status_code in (429, 503) else ''
+            if retry_after.isdigit():
+                result.close()
+                time.sleep(min(int(retry_after), max_retry_after))
+                continue
+
+        time.sleep(backoff * 2 ** attempt)
+
+
+def http_post_request(url, headers=None, body=None, auth=None, compress=False, timeout=None, retries=None):
+    """ POSTs body once as JSON, a str body is taken as already encoded """
+
+    headers = dict(headers or {})
     body = body or ""
     try:
         logging.debug("POST URL------> " + url)
         logging.debug("POST Headers------> " + str(headers))
         #logging.debug("POST Data------> " + body)
-        result = requests.post(url, headers=headers, json=body, auth=auth, verify=False)
+        data = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        headers.setdefault('Content-Type', 'application/json')
+        if compress:
+            data = gzip.compress(data)
+            headers['Content-Encoding'] = 'gzip'
+        result = _request('POST', url, request_timeout=timeout, request_retries=retries,
+                          headers=headers, data=data, auth=auth)
         logging.debug("Status code --> " + str(result.status_code))
         #logging.debug("Result Body --> " + result.text)
         return result
@@ -24,15 +101,15 @@ def http_post_request(url, headers=None, body=None, auth=None):
         logging.error(
             "Exception when requesting POST {url},  with headers: {headers}, and body: {body}, AND ERROR: {error}, TRACE: {stack_trace}".format(
                 error=str(e), url=url, headers=headers, body=body,
-                stack_trace=traceback.format_exc()) if enable_trace else "")
+                stack_trace=traceback.format_exc() if enable_trace else ""))
 
 
-def http_get_request(url, headers=None, auth=None):
+def http_get_request(url, headers=None, auth=None, timeout=None, retries=None):
     headers = headers or {}
     try:
         logging.debug("GET URL------> " + url)
         logging.debug("GET Headers------> " + str(headers))
-        result = requests.get(url, headers=headers, auth=auth, verify=False)
+        result = _request('GET', url, request_timeout=timeout, request_retries=retries, headers=headers, auth=auth)
         logging.debug("Status code --> " + str(result.status_code))
         #logging.debug("Body ---------> " + str(result.text))
         return str(result.text)
@@ -42,12 +119,55 @@ def http_get_request(url, headers=None, auth=None):
                 error=str(e), url=url, headers=headers, stack_trace=traceback.format_exc() if enable_trace else ""))
 
 
-def http_delete_request(url, headers=None, auth=None):
+def http_get_response(url, headers=None, auth=None, timeout=None, retries=None):
+    headers = headers or {}
+    try:
+        logging.debug("GET URL------> " + url)
+        logging.debug("GET Headers------> " + str(headers))
+        result = _request('GET', url, request_timeout=timeout, request_retries=retries, headers=headers, auth=auth)
+        logging.debug("Status code --> " + str(result.status_code))
+        return result
+    except Exception as e:
+        logging.error(
+            "Exception when requesting GET {url},  with headers: {headers}, AND ERROR: {error}, TRACE: {stack_trace}".format(
+                error=str(e), url=url, headers=headers, stack_trace=traceback.format_exc() if enable_trace else ""))
+
+
+def http_download(url, path, headers=None, auth=None, timeout=None, retries=None):
+    """ Streams a 200 response body to path, replacing it atomically, and returns the response """
+
+    headers = headers or {}
+    try:
+        logging.debug("GET URL------> " + url)
+        logging.debug("GET Headers------> " + str(headers))
+        result = _request('GET', url, request_timeout=timeout, request_retries=retries, headers=headers, auth=auth,
+                          stream=True)
+        logging.debug("Status code --> " + str(result.status_code))
+        with result:
+            if result.status_code == 200:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        for chunk in result.iter_content(chunk_size=1048576):
+                            f.write(chunk)
+                    os.replace(tmp_path, path)
+                except Exception:
+                    os.remove(tmp_path)
+                    raise
+        return result
+    except Exception as e:
+        logging.error(
+            "Exception when downloading {url} to {path},  with headers: {headers}, AND ERROR: {error}, TRACE: {stack_trace}".format(
+                error=str(e), url=url, path=path, headers=headers,
+                stack_trace=traceback.format_exc() if enable_trace else ""))
+
+
+def http_delete_request(url, headers=None, auth=None, timeout=None, retries=None):
     try:
         headers = headers or {}
         logging.debug("DELETE URL------> " + url)
         logging.debug("DELETE Headers------> " + str(headers))
-        result = requests.delete(url, headers=headers, auth=auth, verify=False)
+        result = _request('DELETE', url, request_timeout=timeout, request_retries=retries, headers=headers, auth=auth)
         logging.debug("Status code --> " + str(result.status_code))
         #logging.debug("Body ---------> " + result.text.encode('utf-8').strip())
 
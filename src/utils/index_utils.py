@@ -0,0 +1,60 @@
+'''
+Persistent file-state index used to skip unchanged files in yara-disk scans
+'''
+import json
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Number of index updates grouped in a single sqlite transaction
+COMMIT_INTERVAL = 1000
+
+
+class FileIndex:
+    """ Maps (device, inode, size, mtime_ns, ctime_ns, rule-set hash) of a path to its last verdict """
+
+    def __init__(self, db_path, rules_hash):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.rules_hash = rules_hash
+        self.uncommitted = 0
+        self.db = sqlite3.connect(db_path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                        'path TEXT PRIMARY KEY, device INTEGER, inode INTEGER, size INTEGER, '
+                        'mtime_ns INTEGER, ctime_ns INTEGER, rules_hash TEXT, verdict TEXT)')
+
+    def lookup(self, path, st):
+        """ Returns the verdict last recorded for path, or None if it must be scanned again """
+
+        row = self.db.execute('SELECT device, inode, size, mtime_ns, ctime_ns, rules_hash, verdict '
+                              'FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+
+        if row[:6] != (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns, self.rules_hash):
+            return None
+
+        return json.loads(row[6])
+
+    def update(self, path, st, verdict):
+        """ Records the verdict for path as of the stat result st """
+
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns,
+                         self.rules_hash, json.dumps(verdict)))
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,259 @@
+'''
+Concurrent yara scanning of process memory for the yara-mem scans
+'''
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+import yara
+
+from utils.scan_utils import match_record, merge_matches
+
+logger = logging.getLogger(__name__)
+
+# Seconds yara may spend matching a single process
+MATCH_TIMEOUT = 60
+
+# libyara allows at most this many threads to scan with the same rules
+MAX_WORKERS = 32
+
+PROCESS_ATTRS = ['pid', 'name', 'cmdline']
+
+# Regions are read from /proc/<pid>/mem in chunks of this size, overlapping by REGION_OVERLAP
+REGION_CHUNK_SIZE = 16777216
+REGION_OVERLAP = 1048576
+
+# Region-selective scans read anonymous regions and regions with any of these permissions
+REGION_PERMS = 'wx'
+
+# Kernel provided mappings that cannot be read through /proc/<pid>/mem
+_UNREADABLE_REGIONS = ('[vvar]', '[vvar_vclock]', '[vsyscall]')
+
+
+def process_info(process, attrs=PROCESS_ATTRS):
+    """ Returns the attrs of a psutil process, read in a single oneshot() pass """
+
+    with process.oneshot():
+        return process.as_dict(attrs=attrs)
+
+
+class ScanSummary:
+    """ Counts of the processes a memory scan matched, skipped or gave up on """
+
+    def __init__(self):
+        self.scanned = 0
+        self.matched = 0
+        self.skipped = {}
+        self.timed_out = []
+
+    def log(self):
+        logger.info("Scanned {scanned} processes, {matched} matched, {skipped} skipped, {timed_out} timed out".format(
+            scanned=self.scanned, matched=self.matched, skipped=len(self.skipped), timed_out=len(self.timed_out)))
+        if self.timed_out:
+            logger.info("Timed out PIDs: " + ', '.join(str(pid) for pid in self.timed_out))
+        for pid, reason in sorted(self.skipped.items()):
+            logger.debug("Skipped PID " + str(pid) + ": " + reason)
+
+
+def parse_maps(pid):
+    """ Returns the memory regions of a Linux process as listed in /proc/<pid>/maps
+
+    Each region is a dict with the start and end addresses, permissions,
+    file offset, device, inode and backing path ('' for anonymous memory).
+    """
+
+    regions = []
+    with open('/proc/%d/maps' % pid, 'r') as f:
+        for line in f:
+            fields = line.split(None, 5)
+            if len(fields) < 5:
+                continue
+            start, end = fields[0].split('-')
+            regions.append({'start': int(start, 16),
+                            'end': int(end, 16),
+                            'perms': fields[1],
+                            'offset': int(fields[2], 16),
+                            'dev': fields[3],
+                            'inode': int(fields[4]),
+                            'path': fields[5].strip() if len(fields) > 5 else ''})
+    return regions
+
+
+class RegionScanner:
+    """ Matches the selected memory regions of Linux processes through /proc/<pid>/mem
+
+    Readable regions are scanned if they are anonymous (including [heap] and
+    [stack]) or have any of the permission letters in perms. Read-only and
+    executable file-backed regions hold the same pages in every process
+    mapping them, so each (device, inode, offset, size) is only scanned once
+    per scanner, whichever process maps it first. Regions are matched in
+    chunks of chunk_size bytes overlapping by overlap bytes, which must cover
+    the longest rule string.
+    """
+
+    def __init__(self, rules, perms=REGION_PERMS, chunk_size=REGION_CHUNK_SIZE, overlap=REGION_OVERLAP,
+                 strings=False):
+        self.rules = rules
+        self.strings = strings
+        self.perms = perms
+        self.overlap = min(overlap, chunk_size // 2)
+        self.chunk_size = chunk_size
+        self.seen = set()
+        self.seen_lock = threading.Lock()
+
+    def selected(self, region):
+        """ Returns True if the region is to be scanned """
+
+        perms = region['perms']
+        if perms[0] != 'r' or region['path'] in _UNREADABLE_REGIONS:
+            return False
+        anonymous = region['inode'] == 0
+        if not anonymous and not any(p in perms for p in self.perms):
+            return False
+
+        if not anonymous and 'w' not in perms:
+            key = (region['dev'], region['inode'], region['offset'], region['end'] - region['start'])
+            with self.seen_lock:
+                if key in self.seen:
+                    return False
+                self.seen.add(key)
+        return True
+
+    def scan(self, pid, timeout=MATCH_TIMEOUT):
+        """ Returns (match records, region) for every selected region of pid that matched
+
+        Raises yara.TimeoutError once timeout seconds are spent on the process.
+        """
+
+        deadline = time.monotonic() + timeout
+        results = []
+        with open('/proc/%d/mem' % pid, 'rb', buffering=0) as mem:
+            for region in parse_maps(pid):
+                if not self.selected(region):
+                    continue
+                try:
+                    matches = self._match_region(mem, region, deadline)
+                except OSError as e:
+                    # Regions unmapped since maps was read or not backed by readable pages
+                    logger.debug("Skipping region %x-%x of PID %d: %s" % (region['start'], region['end'], pid, e))
+                    continue
+                if matches:
+                    results.append((matches, region))
+        return results
+
+    def _match_region(self, mem, region, deadline):
+        """ Matches a region in chunks, string offsets being reported as addresses """
+
+        matches = []
+        carry = b''
+        address = region['start']
+        while address < region['end']:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise yara.TimeoutError("timed out")
+
+            mem.seek(address)
+            block = mem.read(min(self.chunk_size - len(carry), region['end'] - address))
+            if not block:
+                break
+            data = carry + block
+            merge_matches(matches, [match_record(match, self.strings, address - len(carry))
+                                    for match in self.rules.match(data=data, timeout=max(1, int(remaining)))])
+            address += len(block)
+            carry = data[-self.overlap:] if self.overlap else b''
+
+        return matches
+
+
+def _timed_scan_process(rules, process, attrs, timeout, region_scanner, strings):
+    start = time.perf_counter()
+    return _scan_process(rules, process, attrs, timeout, region_scanner, strings) + (time.perf_counter() - start,)
+
+
+def _scan_process(rules, process, attrs, timeout, region_scanner, strings):
+    """ Returns (process info, [(match records, region)], error, timed out) for a single process """
+
+    try:
+        pinfo = process_info(process, attrs)
+    except psutil.Error as e:
+        return {'pid': process.pid}, [], str(e) or type(e).__name__, False
+
+    try:
+        if region_scanner is not None:
+            return pinfo, region_scanner.scan(process.pid, timeout), None, False
+        matches = rules.match(pid=process.pid, timeout=timeout)
+    except yara.TimeoutError:
+        return pinfo, [], "timed out after " + str(timeout) + "s", True
+    except (yara.Error, OSError) as e:
+        return pinfo, [], str(e), False
+
+    records = [match_record(match, strings) for match in matches]
+    return pinfo, [(records, None)] if records else [], None, False
+
+
+def scan_processes(rules, workers=1, timeout=MATCH_TIMEOUT, attrs=PROCESS_ATTRS, summary=None, pids=None,
+                   region_scanner=None, metrics=None, governor=None, strings=False):
+    """ Matches the memory of every running process but this one, yielding (process info, match records, region)
+
+    Processes are matched on up to workers threads, yara releasing the GIL
+    while it reads process memory, and each match is abandoned after timeout
+    seconds. Processes that exit, cannot be read or time out are not yielded
+    but recorded in summary, a ScanSummary, if one is given. pids restricts
+    the scan to the given process IDs.
+
+    Without a region_scanner yara reads the whole process and region is None.
+    With a RegionScanner, a result is yielded for every matching region, as
+    parsed by parse_maps; processes without matches yield ([], None) either way.
+    With metrics, a RunMetrics, the time taken by each process is added to
+    the match phase and the slowest processes are kept. governor, a
+    governor_utils.Governor, is paced with the time taken by each process.
+    Matches are scan_utils.match_record() dicts, with the matched strings and
+    their offsets if strings is set (region scanners have their own option).
+    """
+
+    summary = summary if summary is not None else ScanSummary()
+    workers = max(1, min(workers, MAX_WORKERS))
+    mypid = os.getpid()
+    processes = (process for process in psutil.process_iter()
+                 if process.pid != mypid and (pids is None or process.pid in pids))
+
+    def results():
+        if workers == 1:
+            for process in processes:
+                yield _timed_scan_process(rules, process, attrs, timeout, region_scanner, strings)
+            return
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for process in processes:
+                pending.append(executor.submit(_timed_scan_process, rules, process, attrs, timeout, region_scanner,
+                                               strings))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    for pinfo, matches, error, timed_out, seconds in results():
+        if governor is not None:
+            governor.pace(busy=seconds)
+        if metrics is not None:
+            metrics.add_time('match', seconds)
+            metrics.observe('processes', '%d %s' % (pinfo['pid'], pinfo.get('name') or ''), seconds)
+            metrics.count('timed_out' if timed_out else 'skipped' if error else 'scanned')
+            if matches:
+                metrics.count('matches', len(matches))
+
+        if timed_out:
+            summary.timed_out.append(pinfo['pid'])
+        elif error:
+            summary.skipped[pinfo['pid']] = error
+        else:
+            summary.scanned += 1
+            if matches:
+                summary.matched += 1
+            for records, region in matches or [([], None)]:
+                yield pinfo, records, region
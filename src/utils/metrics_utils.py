@@ -0,0 +1,175 @@
+'''
+Per-phase timings, counters and slowest items of a scan run
+'''
+import heapq
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Number of slowest files or processes kept in a report
+SLOWEST = 10
+
+
+class RunMetrics:
+    """ Collects the metrics of one yara-disk or yara-mem run
+
+    Phases accumulate seconds and may overlap (e.g. match time summed over
+    worker processes exceeds the wall time of the run). Counters are plain
+    totals and observe() keeps the slowest items of each kind. All methods
+    are safe to call from the uploader and matching threads.
+    """
+
+    def __init__(self, module, slowest=SLOWEST):
+        self.module = module
+        self.hostname = socket.gethostname()
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.slowest = slowest
+        self.phases = {}
+        self.counters = {}
+        self.observed = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """ Times the enclosed block as part of phase name """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, kind, item, seconds):
+        """ Records how long item took, keeping the slowest of each kind """
+
+        with self.lock:
+            heap = self.observed.setdefault(kind, [])
+            entry = (seconds, str(item))
+            if len(heap) < self.slowest:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    def timed(self, name, iterable):
+        """ Yields from iterable, adding the time spent producing each item to phase name """
+
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def finish(self):
+        """ Ends the run, fixing its wall time """
+
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.start
+
+    def report(self):
+        """ Returns the metrics as a JSON serializable dict """
+
+        with self.lock:
+            return {'module': self.module,
+                    'hostname': self.hostname,
+                    'started': self.started,
+                    'seconds': round(self.seconds if self.seconds is not None else time.perf_counter() - self.start,
+                                     6),
+                    'phases': {name: round(seconds, 6) for name, seconds in sorted(self.phases.items())},
+                    'counters': dict(sorted(self.counters.items())),
+                    'slowest': {kind: [{'item': item, 'seconds': round(seconds, 6)}
+                                       for seconds, item in sorted(heap, reverse=True)]
+                                for kind, heap in sorted(self.observed.items())}}
+
+    def summary(self):
+        """ Returns a one-line summary of the run for the log """
+
+        report = self.report()
+        return "{module} finished in {seconds:.2f}s: {phases}; {counters}".format(
+            module=self.module, seconds=report['seconds'],
+            phases=', '.join('%s %.2fs' % item for item in report['phases'].items()),
+            counters=', '.join('%s %d' % item for item in report['counters'].items()))
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.report(), indent=2) + '\n')
+
+    def write_prometheus(self, path):
+        """ Writes the metrics in the Prometheus text format, for the node_exporter textfile collector """
+
+        report = self.report()
+        labels = 'module="%s",hostname="%s"' % (_escape(self.module), _escape(self.hostname))
+        lines = ['# HELP rastrea2r_run_seconds Wall time of the last run',
+                 '# TYPE rastrea2r_run_seconds gauge',
+                 'rastrea2r_run_seconds{%s} %f' % (labels, report['seconds']),
+                 '# HELP rastrea2r_run_timestamp_seconds Start time of the last run',
+                 '# TYPE rastrea2r_run_timestamp_seconds gauge',
+                 'rastrea2r_run_timestamp_seconds{%s} %f' % (labels, report['started']),
+                 '# HELP rastrea2r_phase_seconds Seconds spent in each phase of the last run',
+                 '# TYPE rastrea2r_phase_seconds gauge']
+        lines.extend('rastrea2r_phase_seconds{%s,phase="%s"} %f' % (labels, _escape(name), seconds)
+                     for name, seconds in report['phases'].items())
+        lines.extend(['# HELP rastrea2r_items Items counted in the last run',
+                      '# TYPE rastrea2r_items gauge'])
+        lines.extend('rastrea2r_items{%s,counter="%s"} %d' % (labels, _escape(name), value)
+                     for name, value in report['counters'].items())
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    # mkstemp files are private, node_exporter reads them as another user
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def phase(metrics, name):
+    """ Times the enclosed block as phase name of metrics, a RunMetrics or None """
+
+    if metrics is None:
+        yield
+    else:
+        with metrics.phase(name):
+            yield
+
+
+def write_reports(metrics, report_path=None, prometheus_path=None):
+    """ Finishes a run and writes its JSON report and Prometheus textfile, logging any failure """
+
+    metrics.finish()
+    logger.info(metrics.summary())
+    for path, write in ((report_path, metrics.write_json), (prometheus_path, metrics.write_prometheus)):
+        if path:
+            try:
+                write(path)
+            except OSError as e:
+                logger.error("Could not write metrics to " + path + ": " + str(e))
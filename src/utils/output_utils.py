@@ -0,0 +1,202 @@
+'''
+Artifact output files hashed while they are written
+
+ArtifactWriter computes the SHA256, and optionally the MD5 and SHA1, of the
+bytes written through it, so collected artifacts are never read back to be
+hashed. run_command() streams the output of a collection tool through a
+writer. HashLog records the digests of the artifacts of a collection and
+rewrites the hashing log atomically after each one, so it is never seen
+half written.
+'''
+import hashlib
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+
+# Digests computed by default, SHA256 always comes first in the hashing log
+DEFAULT_ALGORITHMS = ('sha256',)
+
+# Bytes copied from a command's output or read from a file at a time
+CHUNK_SIZE = 1048576
+
+
+def _algorithms(algorithms):
+    return DEFAULT_ALGORITHMS + tuple(name for name in algorithms if name not in DEFAULT_ALGORITHMS)
+
+
+def _hashers(algorithms):
+    return {name: hashlib.new(name) for name in _algorithms(algorithms)}
+
+
+def digests(data, algorithms=DEFAULT_ALGORITHMS):
+    """ Returns the hex digests of data, by algorithm name """
+
+    return {name: hashlib.new(name, data).hexdigest() for name in _algorithms(algorithms)}
+
+
+def file_digests(path, algorithms=DEFAULT_ALGORITHMS):
+    """ Returns the hex digests of a whole file, read once for all algorithms
+
+    Only for artifacts written by an external tool, those written through an
+    ArtifactWriter are already hashed.
+    """
+
+    hashers = _hashers(algorithms)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            for hasher in hashers.values():
+                hasher.update(block)
+    return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+
+class ArtifactWriter:
+    """ Binary output file hashing everything written to it
+
+    The file is opened at path, unless fileobj, an already open binary file
+    (e.g. from tempfile.mkstemp), is given, path then only naming it. The
+    writer can be handed to anything expecting a writable file object, such
+    as tarfile or gzip. SHA256 is always computed, algorithms may add 'md5'
+    and 'sha1'.
+    """
+
+    def __init__(self, path, algorithms=DEFAULT_ALGORITHMS, fileobj=None):
+        self.name = path
+        self.file = fileobj if fileobj is not None else open(path, 'wb')
+        self.hashers = _hashers(algorithms)
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def write(self, data):
+        self.file.write(data)
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def digests(self):
+        """ Returns the hex digests of the bytes written so far, by algorithm name """
+
+        return {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+
+
+def run_command(command, writer, chunk_size=CHUNK_SIZE, timeout=None, **kwargs):
+    """ Runs a command, streaming its standard output into writer, and returns its exit status
+
+    A command still running after timeout seconds is killed, with the
+    processes it started as they may hold its output open (e.g. the tools
+    run by a .cmd script), and subprocess.TimeoutExpired raised, what it
+    wrote until then is kept. kwargs are passed to subprocess.Popen (e.g.
+    startupinfo).
+    """
+
+    if os.name == 'posix':
+        # The command leads its own process group, killed whole on timeout
+        kwargs.setdefault('start_new_session', True)
+    with subprocess.Popen(command, stdout=subprocess.PIPE, **kwargs) as process:
+        expired = threading.Event()
+
+        def expire():
+            if process.poll() is None:
+                expired.set()
+                _kill_tree(process)
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+        try:
+            for chunk in iter(lambda: process.stdout.read(chunk_size), b''):
+                writer.write(chunk)
+        finally:
+            if timer is not None:
+                timer.cancel()
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(command, timeout)
+    return process.returncode
+
+
+def _kill_tree(process):
+    """ Kills a process and the processes it started """
+
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+        return
+
+    import psutil
+
+    try:
+        children = psutil.Process(process.pid).children(recursive=True)
+    except psutil.Error:
+        children = []
+    process.kill()
+    for child in children:
+        try:
+            child.kill()
+        except psutil.Error:
+            pass
+
+
+class HashLog:
+    """ sha256-hashing.log of a collection, '<artifact> - <sha256> \\n\\n' per artifact
+
+    Other digests follow the SHA256 as ' <algorithm>:<hex digest>'. Entries
+    are added to the log found at path, if it can be read (output shares
+    may be write-only), and the whole log is rewritten through a temporary
+    file renamed over it after every entry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.text = f.read()
+        except OSError:
+            self.text = ''
+
+    def add(self, name, hex_digests):
+        """ Records the digests, as returned by ArtifactWriter.digests(), of the artifact name """
+
+        line = "%s - %s" % (name, hex_digests['sha256'])
+        line += ''.join(' %s:%s' % (algorithm, hex_digest) for algorithm, hex_digest in hex_digests.items()
+                        if algorithm != 'sha256')
+        self.text += line + " \n\n"
+        write_atomic(self.path, self.text.encode('utf-8'))
+
+
+def write_atomic(path, data):
+    """ Writes data to path through a temporary file in the same directory renamed over it """
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
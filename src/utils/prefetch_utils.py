@@ -0,0 +1,380 @@
+'''
+Native parser of Windows prefetch files
+
+Reads the SCCA format of the prefetch files of Windows XP to 11 (versions
+17, 23, 26, 30 and 31), including the MAM compressed files of Windows 10
+and later, which are decompressed by a pure Python LZXPRESS Huffman
+decoder. Only the bytes of the files are needed, so prefetch directories
+collected from endpoints can be parsed on any platform. parse_directory()
+parses the .pf files of a directory on a pool of worker processes and
+write_records() writes their records to a single CSV or NDJSON file.
+'''
+import csv
+import json
+import logging
+import os
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+from multiprocessing import Pool
+
+logger = logging.getLogger(__name__)
+
+# Worker processes parsing prefetch files
+WORKERS = 4
+
+# Number of prefetch files handed to a worker process per task
+CHUNK_SIZE = 16
+
+# Output formats of write_records()
+FORMATS = ('csv', 'ndjson')
+
+# Columns of the CSV output, lists are joined with '; '
+CSV_FIELDS = ['filename', 'executable', 'prefetch_hash', 'version', 'compressed', 'run_count', 'last_run',
+              'last_run_times', 'process_path', 'volumes', 'file_count', 'files', 'error']
+
+# Signatures of the uncompressed SCCA and of the compressed MAM formats
+SCCA_SIGNATURE = b'SCCA'
+MAM_SIGNATURE = b'MAM'
+
+# Compression format of MAM files, COMPRESSION_FORMAT_XPRESS_HUFF
+XPRESS_HUFF = 4
+
+# Prefetch files larger than this are not parsed (real ones are a few hundred KB at most)
+MAX_FILE_SIZE = 16777216
+
+# Decompressed bytes of each LZXPRESS Huffman block, which starts with its own code table
+HUFFMAN_BLOCK_SIZE = 65536
+
+# Bits of the longest Huffman code, the decoding table has an entry per value of that many bits
+HUFFMAN_BITS = 15
+
+# Offsets of the last run times and run count in the file information of each version,
+# with the size of its file metrics and volume information entries
+LAYOUTS = {17: {'last_run': 120, 'run_times': 1, 'run_count': 144, 'metrics_entry': 20, 'volume_entry': 40},
+           23: {'last_run': 128, 'run_times': 1, 'run_count': 152, 'metrics_entry': 32, 'volume_entry': 104},
+           26: {'last_run': 128, 'run_times': 8, 'run_count': 208, 'metrics_entry': 32, 'volume_entry': 104},
+           30: {'last_run': 128, 'run_times': 8, 'run_count': 208, 'metrics_entry': 32, 'volume_entry': 96},
+           31: {'last_run': 128, 'run_times': 8, 'run_count': 208, 'metrics_entry': 32, 'volume_entry': 96}}
+
+# Windows 10 files whose file metrics start at this offset have an 8 bytes shorter file information
+SHORT_METRICS_OFFSET = 0x128
+
+_FILETIME_EPOCH = datetime(1601, 1, 1, tzinfo=timezone.utc)
+
+
+class PrefetchError(ValueError):
+    """ Raised for data that is not a prefetch file or is corrupt """
+
+
+def decompress_mam(data):
+    """ Returns the SCCA data of a MAM compressed prefetch file
+
+    The header is 'MAM', the compression format byte, whose high bit flags
+    a CRC32 following the size, and the decompressed size.
+    """
+
+    if len(data) < 8 or data[:3] != MAM_SIGNATURE:
+        raise PrefetchError("Not a MAM compressed file")
+    compression = data[3] & 0x7f
+    if compression != XPRESS_HUFF:
+        raise PrefetchError("Unsupported MAM compression format %d" % compression)
+    size = struct.unpack_from('<I', data, 4)[0]
+    start = 12 if data[3] & 0x80 else 8
+    return xpress_huffman_decompress(data[start:], size)
+
+
+def _decoding_table(lengths):
+    """ Returns the canonical Huffman decoding table of the 512 code lengths of a block """
+
+    table = []
+    for length in range(1, HUFFMAN_BITS + 1):
+        entries = 1 << (HUFFMAN_BITS - length)
+        for symbol, symbol_length in enumerate(lengths):
+            if symbol_length == length:
+                table.extend([symbol] * entries)
+        if len(table) > 1 << HUFFMAN_BITS:
+            break
+    if len(table) != 1 << HUFFMAN_BITS:
+        raise PrefetchError("Invalid Huffman code table")
+    return table
+
+
+def xpress_huffman_decompress(data, size):
+    """ Returns the size bytes decompressed from LZXPRESS Huffman data (MS-XCA 2.2)
+
+    Every block of up to HUFFMAN_BLOCK_SIZE decompressed bytes starts with
+    the 4 bit code lengths of its 512 symbols: 256 literals and 256 matches,
+    whose low nibble is the length and high nibble the bit count of the
+    offset. The codes follow as 16 bit little-endian words read most
+    significant bit first, the extra match length bytes being read from
+    between them.
+    """
+
+    # Reads just past the end return zero bits, a truncated stream fails on the checks below
+    data = bytes(data) + b'\x00' * 8
+    end = len(data) - 8
+    out = bytearray()
+    position = 0
+    try:
+        while len(out) < size:
+            if position + 260 > end:
+                raise PrefetchError("Compressed data truncated at %d of %d bytes" % (len(out), size))
+            lengths = []
+            for byte in data[position:position + 256]:
+                lengths.append(byte & 0x0f)
+                lengths.append(byte >> 4)
+            table = _decoding_table(lengths)
+
+            position += 256
+            bits = (data[position] | data[position + 1] << 8) << 16 | data[position + 2] | data[position + 3] << 8
+            position += 4
+            extra = 16
+            block_end = min(len(out) + HUFFMAN_BLOCK_SIZE, size)
+            while len(out) < block_end:
+                symbol = table[bits >> (32 - HUFFMAN_BITS)]
+                length = lengths[symbol]
+                bits = (bits << length) & 0xffffffff
+                extra -= length
+                if extra < 0:
+                    bits |= (data[position] | data[position + 1] << 8) << -extra
+                    extra += 16
+                    position += 2
+
+                if symbol < 256:
+                    out.append(symbol)
+                    continue
+
+                symbol -= 256
+                match_length = symbol & 0x0f
+                offset_bits = symbol >> 4
+                if match_length == 15:
+                    match_length = data[position]
+                    position += 1
+                    if match_length == 255:
+                        match_length = data[position] | data[position + 1] << 8
+                        position += 2
+                        if match_length == 0:
+                            match_length = struct.unpack_from('<I', data, position)[0]
+                            position += 4
+                        if match_length < 15:
+                            raise PrefetchError("Invalid match length in compressed data")
+                        match_length -= 15
+                    match_length += 15
+                match_length += 3
+
+                offset = ((bits >> (32 - offset_bits)) if offset_bits else 0) + (1 << offset_bits)
+                bits = (bits << offset_bits) & 0xffffffff
+                extra -= offset_bits
+                if extra < 0:
+                    bits |= (data[position] | data[position + 1] << 8) << -extra
+                    extra += 16
+                    position += 2
+
+                start = len(out) - offset
+                if start < 0:
+                    raise PrefetchError("Match offset before the start of the decompressed data")
+                if offset >= match_length:
+                    out += out[start:start + match_length]
+                else:
+                    for i in range(match_length):
+                        out.append(out[start + i])
+            if position > end:
+                raise PrefetchError("Compressed data truncated at %d of %d bytes" % (len(out), size))
+
+    except IndexError:
+        raise PrefetchError("Corrupt compressed data at %d of %d bytes" % (len(out), size))
+
+    return bytes(out[:size])
+
+
+def filetime(value):
+    """ Returns the ISO 8601 UTC time of a FILETIME, None when it is not set """
+
+    if not value:
+        return None
+    try:
+        return (_FILETIME_EPOCH + timedelta(microseconds=value // 10)).isoformat()
+    except OverflowError:
+        return None
+
+
+def _utf16(data, offset, size):
+    return data[offset:offset + size].decode('utf-16-le', 'replace').split('\x00', 1)[0]
+
+
+def parse_prefetch(data):
+    """ Returns the record of the bytes of a prefetch file, compressed or not
+
+    The record holds the executable name, prefetch hash, format version,
+    run count, last run times (most recent first), the files and
+    directories loaded by the executable, its path among them and the
+    volumes they are on. Raises PrefetchError if data is not a prefetch
+    file or is corrupt.
+    """
+
+    compressed = data[:3] == MAM_SIGNATURE
+    if compressed:
+        data = decompress_mam(data)
+    if len(data) < 84 or data[4:8] != SCCA_SIGNATURE:
+        raise PrefetchError("Not a prefetch file")
+
+    version = struct.unpack_from('<I', data, 0)[0]
+    layout = LAYOUTS.get(version)
+    if layout is None:
+        raise PrefetchError("Unsupported prefetch format version %d" % version)
+
+    try:
+        (metrics_offset, metrics_count, _, _, strings_offset, strings_size, volumes_offset, volumes_count,
+         _) = struct.unpack_from('<9I', data, 84)
+        run_count_offset = layout['run_count']
+        if version >= 30 and metrics_offset == SHORT_METRICS_OFFSET:
+            run_count_offset -= 8
+        run_times = struct.unpack_from('<%dQ' % layout['run_times'], data, layout['last_run'])
+        run_count = struct.unpack_from('<I', data, run_count_offset)[0]
+
+        if max(strings_offset + strings_size, metrics_offset, volumes_offset) > len(data):
+            raise PrefetchError("Sections beyond the end of the prefetch data")
+
+        # File metrics point at the names of the loaded files in the filename strings
+        files = []
+        name_field = 8 if version == 17 else 12
+        for i in range(metrics_count):
+            entry = metrics_offset + i * layout['metrics_entry']
+            name_offset, name_length = struct.unpack_from('<2I', data, entry + name_field)
+            files.append(_utf16(data, strings_offset + name_offset, name_length * 2))
+
+        volumes = []
+        directories = []
+        for i in range(volumes_count):
+            entry = volumes_offset + i * layout['volume_entry']
+            (path_offset, path_length, created, serial, _, _, directories_offset,
+             directories_count) = struct.unpack_from('<2IQ5I', data, entry)
+            volumes.append({'device_path': _utf16(data, volumes_offset + path_offset, path_length * 2),
+                            'serial': '%08X' % serial,
+                            'created': filetime(created)})
+            # Directory strings are a 16 bit length in characters followed by the string and its terminator
+            offset = volumes_offset + directories_offset
+            for _ in range(directories_count):
+                length = struct.unpack_from('<H', data, offset)[0]
+                directories.append(_utf16(data, offset + 2, length * 2))
+                offset += 2 + (length + 1) * 2
+    except struct.error:
+        raise PrefetchError("Prefetch data truncated")
+
+    executable = _utf16(data, 16, 60)
+    suffix = '\\' + executable.upper()
+    last_run_times = [filetime(value) for value in run_times if value]
+    return {'executable': executable,
+            'prefetch_hash': '%08X' % struct.unpack_from('<I', data, 76)[0],
+            'version': version,
+            'compressed': compressed,
+            'run_count': run_count,
+            'last_run': last_run_times[0] if last_run_times else None,
+            'last_run_times': last_run_times,
+            'process_path': next((name for name in files if name.upper().endswith(suffix)), None),
+            'volumes': volumes,
+            'file_count': len(files),
+            'files': files,
+            'directories': directories}
+
+
+def parse_file(path):
+    """ Returns the record of a prefetch file, with the error instead of the parsed fields if it cannot be read """
+
+    record = {'filename': path}
+    try:
+        if os.path.getsize(path) > MAX_FILE_SIZE:
+            raise PrefetchError("Larger than %d bytes" % MAX_FILE_SIZE)
+        with open(path, 'rb') as f:
+            record.update(parse_prefetch(f.read()))
+    except (OSError, PrefetchError) as e:
+        record['error'] = str(e)
+    return record
+
+
+def _timed_parse(path):
+    start = time.perf_counter()
+    record = parse_file(path)
+    return record, time.perf_counter() - start
+
+
+def prefetch_files(directory):
+    """ Returns the paths of the .pf files of a directory, sorted by name """
+
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith('.pf') and os.path.isfile(os.path.join(directory, name)))
+
+
+def parse_directory(directory, workers=WORKERS, metrics=None):
+    """ Parses the .pf files of a directory on workers processes, yielding their records in name order
+
+    A file that cannot be parsed yields a record with its filename and
+    error only. With metrics, a RunMetrics, the time taken by each file is
+    added to the parse phase and observed, and files and errors are counted.
+    """
+
+    paths = prefetch_files(directory)
+
+    def record(timed_record):
+        parsed, seconds = timed_record
+        if metrics is not None:
+            metrics.add_time('parse', seconds)
+            metrics.observe('files', parsed['filename'], seconds)
+            metrics.count('files')
+            if 'error' in parsed:
+                metrics.count('errors')
+        if 'error' in parsed:
+            logger.warning("Could not parse " + parsed['filename'] + ": " + parsed['error'])
+        return parsed
+
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield record(_timed_parse(path))
+        return
+
+    with Pool(processes=min(workers, len(paths))) as pool:
+        for timed_record in pool.imap(_timed_parse, paths, CHUNK_SIZE):
+            yield record(timed_record)
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return '; '.join(_csv_value(item) for item in value)
+    if isinstance(value, dict):
+        return '%s (serial %s, created %s)' % (value['device_path'], value['serial'], value['created'])
+    return '' if value is None else str(value)
+
+
+class _Encoder:
+    """ Text file object writing UTF-8 to a binary one, which it leaves open """
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, text):
+        return self.output.write(text.encode('utf-8'))
+
+
+def write_records(records, output, output_format='csv'):
+    """ Writes records, as returned by parse_file(), to output, a binary file object, and returns their count
+
+    csv writes a row of CSV_FIELDS per record, ndjson a JSON object per line.
+    """
+
+    if output_format not in FORMATS:
+        raise ValueError("Unknown prefetch output format " + output_format)
+
+    count = 0
+    text = _Encoder(output)
+    if output_format == 'csv':
+        writer = csv.DictWriter(text, CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow({field: _csv_value(record.get(field)) for field in CSV_FIELDS})
+            count += 1
+    else:
+        for record in records:
+            text.write(json.dumps(record, sort_keys=True) + '\n')
+            count += 1
+    return count
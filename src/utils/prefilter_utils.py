@@ -0,0 +1,158 @@
+'''
+Header-based prefilter skipping files the rules cannot apply to
+'''
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the start of a file to classify it
+HEADER_SIZE = 4096
+
+# File types rules may declare with a tag or a filetype meta (e.g. filetype = "pe, elf")
+FILE_TYPES = ('pe', 'elf', 'macho', 'script', 'document', 'archive', 'media', 'text', 'data')
+
+# Meta keys declaring the file types and the largest file a rule applies to
+TYPE_META = ('filetype', 'file_type')
+SIZE_META = ('max_filesize', 'max_file_size')
+
+# (offset, magic bytes, file type) checked against the header
+MAGIC = ((0, b'MZ', 'pe'),
+         (0, b'\x7fELF', 'elf'),
+         (0, b'\xfe\xed\xfa\xce', 'macho'),
+         (0, b'\xfe\xed\xfa\xcf', 'macho'),
+         (0, b'\xce\xfa\xed\xfe', 'macho'),
+         (0, b'\xcf\xfa\xed\xfe', 'macho'),
+         (0, b'\xca\xfe\xba\xbe', 'macho'),
+         (0, b'#!', 'script'),
+         (0, b'<?php', 'script'),
+         (0, b'%PDF', 'document'),
+         (0, b'{\\rtf', 'document'),
+         (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'document'),
+         (0, b'PK\x03\x04', 'archive'),
+         (0, b'\x1f\x8b', 'archive'),
+         (0, b'BZh', 'archive'),
+         (0, b'\xfd7zXZ\x00', 'archive'),
+         (0, b'7z\xbc\xaf\x27\x1c', 'archive'),
+         (0, b'Rar!\x1a\x07', 'archive'),
+         (257, b'ustar', 'archive'),
+         (0, b'\xff\xd8\xff', 'media'),
+         (0, b'\x89PNG\r\n\x1a\n', 'media'),
+         (0, b'GIF8', 'media'),
+         (0, b'ID3', 'media'),
+         (4, b'ftyp', 'media'),
+         (0, b'RIFF', 'media'),
+         (0, b'OggS', 'media'),
+         (0, b'fLaC', 'media'),
+         (0, b'\x1a\x45\xdf\xa3', 'media'))
+
+# Extensions adding a file type to the one found from the header, e.g. docx files are archives and documents
+EXTENSIONS = {'.ps1': 'script', '.psm1': 'script', '.vbs': 'script', '.vbe': 'script', '.js': 'script',
+              '.jse': 'script', '.wsf': 'script', '.hta': 'script', '.bat': 'script', '.cmd': 'script',
+              '.sh': 'script', '.py': 'script', '.pl': 'script', '.php': 'script', '.rb': 'script',
+              '.jsp': 'script', '.asp': 'script', '.aspx': 'script',
+              '.exe': 'pe', '.dll': 'pe', '.sys': 'pe', '.scr': 'pe', '.cpl': 'pe', '.ocx': 'pe',
+              '.so': 'elf', '.dylib': 'macho',
+              '.doc': 'document', '.docx': 'document', '.docm': 'document', '.xls': 'document',
+              '.xlsx': 'document', '.xlsm': 'document', '.ppt': 'document', '.pptx': 'document',
+              '.pptm': 'document', '.pdf': 'document', '.rtf': 'document', '.one': 'document',
+              '.jpg': 'media', '.jpeg': 'media', '.png': 'media', '.gif': 'media', '.mp3': 'media',
+              '.mp4': 'media', '.mov': 'media', '.avi': 'media', '.mkv': 'media', '.wav': 'media',
+              '.flac': 'media', '.ogg': 'media',
+              '.txt': 'text', '.log': 'text', '.csv': 'text', '.json': 'text', '.xml': 'text'}
+
+
+def classify(header, path=''):
+    """ Returns the set of file types of a file from its first bytes and its extension
+
+    Files with neither a known magic nor a known extension are text if their
+    header has no NUL byte, data otherwise.
+    """
+
+    types = {file_type for offset, magic, file_type in MAGIC if header.startswith(magic, offset)}
+    extension = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if extension:
+        types.add(extension)
+    if not types:
+        types.add('data' if b'\0' in header else 'text')
+    return types
+
+
+def rule_constraint(rule):
+    """ Returns the (file types, max file size) a compiled rule declares, None for either if undeclared
+
+    Only the FILE_TYPES names count, a rule declaring none of them (e.g.
+    filetype = "exe") may match files of any type.
+    """
+
+    types = {tag.lower() for tag in rule.tags if tag.lower() in FILE_TYPES}
+    for key in TYPE_META:
+        value = rule.meta.get(key)
+        if isinstance(value, str):
+            names = {name.strip().lower() for name in value.replace(',', ' ').split()}
+            unknown = names.difference(FILE_TYPES)
+            if unknown:
+                logger.warning("Rule %s declares unknown file types %s, known ones are %s"
+                               % (rule.identifier, ', '.join(sorted(unknown)), ', '.join(FILE_TYPES)))
+            types.update(names.intersection(FILE_TYPES))
+
+    max_size = None
+    for key in SIZE_META:
+        value = rule.meta.get(key)
+        if (isinstance(value, int) and not isinstance(value, bool)) or (isinstance(value, str) and value.isdigit()):
+            max_size = int(value)
+
+    return frozenset(types) or None, max_size
+
+
+class Prefilter:
+    """ Decides from its size and first HEADER_SIZE bytes whether a file can match any rule
+
+    Each rule may declare the file types it targets, with tags or a filetype
+    meta, and the largest file it applies to, with a max_filesize meta. A file
+    is skipped when no rule admits both its type and its size. With archives,
+    archive files are always kept so their members can be matched.
+    """
+
+    def __init__(self, constraints, archives=False):
+        self.constraints = constraints
+        self.archives = archives
+
+    @classmethod
+    def from_rules(cls, rules, archives=False):
+        """ Returns the prefilter of compiled rules, None if any rule may match every file """
+
+        try:
+            constraints = {rule_constraint(rule) for rule in rules if not rule.is_private}
+        except TypeError:
+            logger.warning("This yara-python does not list compiled rules, prefiltering is disabled")
+            return None
+
+        if not constraints or (None, None) in constraints:
+            return None
+        return cls(list(constraints), archives)
+
+    def wanted(self, file_path, size):
+        """ Returns whether a file of size bytes must be matched, reading its header only if a rule needs it """
+
+        types = None
+        if self.archives:
+            types = self._classify(file_path)
+            if 'archive' in types:
+                return True
+
+        for rule_types, max_size in self.constraints:
+            if max_size is not None and size > max_size:
+                continue
+            if rule_types is None:
+                return True
+            if types is None:
+                types = self._classify(file_path)
+            if types & rule_types:
+                return True
+
+        return False
+
+    def _classify(self, file_path):
+        with open(file_path, 'rb') as f:
+            return classify(f.read(HEADER_SIZE), file_path)
@@ -0,0 +1,307 @@
+'''
+Rule fetching with an on-disk cache of compiled yara rules
+'''
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+
+import yara
+
+from utils import http_utils, metrics_utils
+
+logger = logging.getLogger(__name__)
+
+# Content-Type used by the server for precompiled rule bundles
+COMPILED_RULES_TYPE = 'application/x-yara-compiled'
+
+# Header carrying max_string_length() of a precompiled bundle's source
+MAX_STRING_LENGTH_HEADER = 'X-Max-String-Length'
+
+
+# Comments are stripped, leaving text strings intact, before estimating string lengths
+_COMMENTS = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.S)
+_TEXT_STRING = re.compile(r'"((?:\\.|[^"\\])*)"')
+_HEX_STRING = re.compile(r'=\s*\{([^}]*)\}')
+_REGEX_STRING = re.compile(r'\$\w*\s*=\s*/')
+_HEX_JUMP = re.compile(r'\[\s*(\d*)\s*(-\s*(\d*)\s*)?\]')
+_HEX_BYTE = re.compile(r'[0-9A-Fa-f?]{2}')
+
+
+def max_string_length(source):
+    """ Returns an upper bound of the bytes a string of the rule source can match, None if unbounded
+
+    Text strings count double to cover the wide modifier. Regular expressions
+    and open-ended hex jumps have no bound.
+    """
+
+    source = _COMMENTS.sub(lambda m: m.group(1) or '', source)
+    if _REGEX_STRING.search(source):
+        return None
+
+    longest = 0
+    for text in _TEXT_STRING.findall(source):
+        longest = max(longest, 2 * len(text))
+
+    for hex_string in _HEX_STRING.findall(source):
+        length = len(_HEX_BYTE.findall(_HEX_JUMP.sub('', hex_string)))
+        for jump in _HEX_JUMP.finditer(hex_string):
+            low, is_range, high = jump.groups()
+            if is_range and not high:
+                return None
+            length += int(high if is_range else low)
+        longest = max(longest, length)
+
+    return longest
+
+
+def _safe_name(rule):
+    return re.sub(r'[^A-Za-z0-9_.+-]', '_', rule)
+
+
+def rule_set_name(rules):
+    """ Returns the name under which the rule sets rules, compiled together, are cached """
+
+    return '+'.join(rules)
+
+
+def _index_path(cache_dir, rule):
+    return os.path.join(cache_dir, _safe_name(rule) + '.json')
+
+
+def _compiled_path(cache_dir, rule, digest):
+    return os.path.join(cache_dir, _safe_name(rule) + '-' + digest + '.yarc')
+
+
+def _source_path(cache_dir, rule, digest):
+    return os.path.join(cache_dir, _safe_name(rule) + '-' + digest + '.yar')
+
+
+def _read_index(cache_dir, rule):
+    try:
+        with open(_index_path(cache_dir, rule), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def rule_info(cache_dir, rule):
+    """ Returns the cache entry of rule: its etag, sha256 and max_string_length (None if unbounded) """
+
+    return _read_index(cache_dir, rule)
+
+
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _save_atomic(rules, path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    os.close(fd)
+    rules.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _remove_stale(cache_dir, rule, keep, suffix='.yarc'):
+    # Only <name>-<sha256><suffix>, the files of rules whose names start with '<name>-' are left alone
+    stale = re.compile(re.escape(_safe_name(rule)) + '-[0-9a-f]{64}' + re.escape(suffix) + '$')
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        if stale.match(name) and path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _response_max_string_length(response, bundle):
+    if not bundle:
+        return max_string_length(response.text)
+    header = response.headers.get(MAX_STRING_LENGTH_HEADER, '')
+    return int(header) if header.isdigit() else None
+
+
+def load_rules(rule_url, rule, cache_dir, auth=None, metrics=None):
+    """ Returns compiled rules for rule, revalidating the on-disk cache with the server
+
+    The server copy is requested with If-None-Match so an unchanged rule costs a
+    304 and a yara.load() of the cached binary. Changed rules are compiled once and
+    cached by rule name and content hash. Servers may answer with a precompiled
+    bundle (COMPILED_RULES_TYPE) which is cached as is. A bundle this yara
+    version cannot load is replaced by the source, which alone is asked for
+    from then on. Sources are compiled in a namespace named after the rule.
+    Returns None if the rule can neither be fetched nor found in the cache.
+    With metrics, a RunMetrics, requests are timed as the rule_fetch phase
+    and compiling or loading as rule_compile.
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = _read_index(cache_dir, rule)
+    cached = _compiled_path(cache_dir, rule, entry['sha256']) if 'sha256' in entry else None
+    # Entries of older clients were compiled in a namespace not named after the rule
+    if cached and (not os.path.exists(cached) or entry.get('namespace') != rule):
+        cached = None
+
+    # Bundles already rejected by this yara version are not asked for again
+    rejected = entry.get('bundle_rejected') if entry.get('bundle_rejected') == yara.__version__ else None
+    headers = {'Accept': 'text/plain' if rejected else COMPILED_RULES_TYPE + ', text/plain'}
+    if cached and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+
+    with metrics_utils.phase(metrics, 'rule_fetch'):
+        response = http_utils.http_get_response(url=rule_url, headers=headers, auth=auth)
+
+    if response is not None and response.status_code == 304 and cached:
+        logger.debug("Rule " + rule + " unchanged, loading " + cached)
+        with metrics_utils.phase(metrics, 'rule_compile'):
+            return yara.load(cached)
+
+    if response is None or response.status_code != 200:
+        if cached:
+            logger.warning("Could not fetch rule " + rule + ", using cached copy " + cached)
+            with metrics_utils.phase(metrics, 'rule_compile'):
+                return yara.load(cached)
+        logger.error("Could not fetch rule " + rule + " from " + rule_url)
+        return None
+
+    digest = hashlib.sha256(response.content).hexdigest()
+    compiled = _compiled_path(cache_dir, rule, digest)
+
+    bundle = response.headers.get('Content-Type', '').startswith(COMPILED_RULES_TYPE)
+
+    if os.path.exists(compiled) and entry.get('namespace') == rule:
+        with metrics_utils.phase(metrics, 'rule_compile'):
+            rules = yara.load(compiled)
+        if entry.get('sha256') == digest:
+            longest = entry.get('max_string_length')
+        else:
+            longest = _response_max_string_length(response, bundle)
+
+    elif bundle:
+        try:
+            with metrics_utils.phase(metrics, 'rule_compile'):
+                rules = yara.load(file=io.BytesIO(response.content))
+        except yara.Error as e:
+            # Bundle built by an incompatible yara version, ask for the source instead
+            logger.warning("Could not load precompiled bundle for " + rule + ": " + str(e))
+            rejected = yara.__version__
+            with metrics_utils.phase(metrics, 'rule_fetch'):
+                response = http_utils.http_get_response(url=rule_url, headers={'Accept': 'text/plain'}, auth=auth)
+            if response is None or response.status_code != 200:
+                logger.error("Could not fetch rule " + rule + " from " + rule_url)
+                return None
+            digest = hashlib.sha256(response.content).hexdigest()
+            compiled = _compiled_path(cache_dir, rule, digest)
+            with metrics_utils.phase(metrics, 'rule_compile'):
+                rules = yara.compile(sources={rule: response.text})
+            longest = max_string_length(response.text)
+            _save_atomic(rules, compiled)
+        else:
+            longest = _response_max_string_length(response, bundle)
+            _write_atomic(compiled, response.content)
+
+    else:
+        with metrics_utils.phase(metrics, 'rule_compile'):
+            rules = yara.compile(sources={rule: response.text})
+        longest = max_string_length(response.text)
+        _save_atomic(rules, compiled)
+
+    entry = {'etag': response.headers.get('ETag'), 'sha256': digest, 'namespace': rule, 'max_string_length': longest}
+    if rejected:
+        entry['bundle_rejected'] = rejected
+    _write_atomic(_index_path(cache_dir, rule), json.dumps(entry).encode('utf-8'))
+    _remove_stale(cache_dir, rule, compiled)
+
+    return rules
+
+
+def _load_source(rule_url, rule, cache_dir, auth, metrics):
+    """ Returns the source of rule, revalidating its cached copy with the server, or None """
+
+    key = rule + '.source'
+    entry = _read_index(cache_dir, key)
+    cached = _source_path(cache_dir, rule, entry['sha256']) if 'sha256' in entry else None
+    if cached and not os.path.exists(cached):
+        cached = None
+
+    headers = {'Accept': 'text/plain'}
+    if cached and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+
+    with metrics_utils.phase(metrics, 'rule_fetch'):
+        response = http_utils.http_get_response(url=rule_url, headers=headers, auth=auth)
+
+    if response is None or response.status_code not in (200, 304) or (response.status_code == 304 and not cached):
+        if cached:
+            logger.warning("Could not fetch rule " + rule + ", using cached copy " + cached)
+        else:
+            logger.error("Could not fetch rule " + rule + " from " + rule_url)
+            return None
+
+    if response is not None and response.status_code == 200:
+        digest = hashlib.sha256(response.content).hexdigest()
+        path = _source_path(cache_dir, rule, digest)
+        _write_atomic(path, response.content)
+        _write_atomic(_index_path(cache_dir, key),
+                      json.dumps({'etag': response.headers.get('ETag'), 'sha256': digest}).encode('utf-8'))
+        _remove_stale(cache_dir, rule, path, suffix='.yar')
+        return response.text
+
+    if response is not None and response.status_code == 304:
+        logger.debug("Rule " + rule + " unchanged, using " + cached)
+    with open(cached, 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+def load_rule_sets(rule_urls, cache_dir, auth=None, metrics=None):
+    """ Returns the rule sets of rule_urls, (rule, url) pairs, compiled together with one namespace per rule
+
+    A single rule is loaded with load_rules. Several rules are fetched as
+    sources, each revalidated with its own ETag, and compiled into a single
+    yara.Rules so one read of a file serves every rule set. The compiled set is
+    cached under rule_set_name() and only recompiled when a source changes.
+    rule_info() of that name gives the max_string_length of the whole set.
+    Returns None if any of the rules can neither be fetched nor found in the
+    cache.
+    """
+
+    if len(rule_urls) == 1:
+        rule, rule_url = rule_urls[0]
+        return load_rules(rule_url, rule, cache_dir, auth=auth, metrics=metrics)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    sources = {}
+    for rule, rule_url in rule_urls:
+        source = _load_source(rule_url, rule, cache_dir, auth, metrics)
+        if source is None:
+            return None
+        sources[rule] = source
+
+    name = rule_set_name([rule for rule, _ in rule_urls])
+    digest = hashlib.sha256(json.dumps(sorted(sources.items())).encode('utf-8')).hexdigest()
+    compiled = _compiled_path(cache_dir, name, digest)
+    if os.path.exists(compiled):
+        with metrics_utils.phase(metrics, 'rule_compile'):
+            return yara.load(compiled)
+
+    with metrics_utils.phase(metrics, 'rule_compile'):
+        rules = yara.compile(sources=sources)
+    _save_atomic(rules, compiled)
+
+    lengths = [max_string_length(source) for source in sources.values()]
+    _write_atomic(_index_path(cache_dir, name),
+                  json.dumps({'sha256': digest, 'namespace': None,
+                              'max_string_length': None if None in lengths else max(lengths)}).encode('utf-8'))
+    _remove_stale(cache_dir, name, compiled)
+
+    return rules
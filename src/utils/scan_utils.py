@@ -0,0 +1,520 @@
+'''
+Shared yara scanning helpers for the rastrea2r clients
+'''
+import hashlib
+import io
+import logging
+import mmap
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+import yara
+
+from utils import archive_utils
+from utils.governor_utils import Governor
+from utils.hash_utils import BLOCKSIZE, KnownGoodSet
+from utils.prefilter_utils import HEADER_SIZE, Prefilter
+
+logger = logging.getLogger(__name__)
+
+# Number of file paths handed to a worker process per task
+CHUNK_SIZE = 64
+
+# Files up to this size are read once, hashed and matched from memory
+MAX_INLINE_SIZE = 16777216
+
+# Defaults for matching large files in overlapping windows
+WINDOW_SIZE = 67108864
+WINDOW_OVERLAP = 1048576
+
+# Offsets kept per string identifier of a match record
+MAX_STRING_OFFSETS = 16
+
+# FileScanner built once per worker process by _init_worker
+_worker_scanner = None
+
+
+def match_record(match, strings=False, base=0):
+    """ Returns a yara match as a JSON serializable record of its rule, namespace and tags
+
+    With strings, the record maps the identifier of each matched string to
+    the offsets, plus base, of its first MAX_STRING_OFFSETS occurrences.
+    """
+
+    record = {'rule': match.rule, 'namespace': match.namespace}
+    if match.tags:
+        record['tags'] = list(match.tags)
+    if strings:
+        found = {}
+        for string in match.strings:
+            if hasattr(string, 'instances'):
+                # yara-python >= 4.3
+                identifier, offsets = string.identifier, [instance.offset for instance in string.instances]
+            else:
+                identifier, offsets = string[1], [string[0]]
+            kept = found.setdefault(identifier, [])
+            kept.extend(base + offset for offset in offsets[:MAX_STRING_OFFSETS - len(kept)])
+        record['strings'] = found
+    return record
+
+
+def merge_matches(matches, records):
+    """ Adds match records to the list matches, merging the string offsets of rules matched already """
+
+    for record in records:
+        for existing in matches:
+            if existing['rule'] == record['rule'] and existing['namespace'] == record['namespace']:
+                for identifier, offsets in record.get('strings', {}).items():
+                    kept = existing.setdefault('strings', {}).setdefault(identifier, [])
+                    kept[:] = sorted(set(kept).union(offsets))[:MAX_STRING_OFFSETS]
+                break
+        else:
+            matches.append(record)
+    return matches
+
+
+def match_name(record):
+    """ Returns the rule name of a match record qualified by its namespace, i.e. its rule set """
+
+    return record['namespace'] + ':' + record['rule']
+
+
+def rules_to_bytes(rules):
+    """ Serializes compiled yara rules so they can be shipped to worker processes """
+
+    buf = io.BytesIO()
+    rules.save(file=buf)
+    return buf.getvalue()
+
+
+def rules_from_bytes(blob):
+    """ Loads compiled yara rules serialized with rules_to_bytes """
+
+    return yara.load(file=io.BytesIO(blob))
+
+
+def rules_hash(rules):
+    """ Returns a SHA256 identifying a compiled rule set """
+
+    return hashlib.sha256(rules_to_bytes(rules)).hexdigest()
+
+
+class FileScanner:
+    """ Matches single files with compiled rules and the per-file scan options
+
+    known_good is an optional KnownGoodSet. Files whose SHA256 is in it are
+    reported without matches and never handed to yara.
+
+    Files larger than large_file_size are matched in memory-mapped windows of
+    window_size bytes overlapping by overlap bytes, which must cover the
+    longest rule string. A window_size under twice the overlap is enlarged. Windows are matched on window_workers threads and
+    only the first byte_budget bytes of a file are scanned. Conditions using
+    offsets, filesize or modules see each window as a file of its own.
+
+    With archive_depth > 0, members of zip, tar and gzip/bzip2/xz files are
+    matched too, archive_depth levels deep, reading at most
+    archive_member_size bytes per member and holding at most archive_memory
+    bytes of a member in memory (larger members are matched in overlapping
+    chunks of that size).
+
+    governor is an optional governor_utils.Governor paced with the bytes
+    read after every file, including those skipped as known-good or
+    prefiltered, after every window of large files and after every chunk of
+    archive members.
+
+    Matches are reported as match_record() dicts, with the offsets of the
+    matched strings if strings is set.
+
+    With prefilter, files no rule can apply to, going by the file types and
+    sizes the rules declare in their tags and metadata, are reported without
+    matches after reading their first few KB (see prefilter_utils.Prefilter).
+    """
+
+    def __init__(self, rules, known_good=None, large_file_size=None, window_size=WINDOW_SIZE, overlap=WINDOW_OVERLAP,
+                 window_workers=1, byte_budget=None, archive_depth=0,
+                 archive_member_size=archive_utils.MAX_MEMBER_SIZE, archive_memory=archive_utils.MEMORY_CAP,
+                 governor=None, prefilter=False, strings=False):
+        self.rules = rules
+        self.strings = strings
+        self.known_good = known_good
+        self.large_file_size = large_file_size
+        if window_size < 2 * overlap:
+            # Shrinking the overlap instead would miss the longest strings across window boundaries
+            enlarged = overlap + -(-overlap // mmap.ALLOCATIONGRANULARITY) * mmap.ALLOCATIONGRANULARITY
+            logger.warning("Window size %d is less than twice the %d bytes overlap the rule strings need, using %d"
+                           % (window_size, overlap, enlarged))
+            window_size = enlarged
+        self.overlap = overlap
+        # Window starts are kept on the mmap allocation granularity
+        self.step = max(mmap.ALLOCATIONGRANULARITY,
+                        (window_size - self.overlap) // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY)
+        self.window_size = self.step + self.overlap
+        self.window_workers = window_workers
+        self.byte_budget = byte_budget
+        self.archive_depth = archive_depth
+        self.archive_member_size = archive_member_size
+        self.archive_memory = max(archive_memory, 2 * self.overlap)
+        self.governor = governor
+        self.prefilter = Prefilter.from_rules(rules, archives=archive_depth > 0) if prefilter else None
+        self.known_good_hits = 0
+        self.prefiltered = 0
+        self._window_pool = None
+
+    def options(self, workers=1):
+        """ Returns the picklable options needed to rebuild this scanner in one of workers processes """
+
+        return {'known_good': self.known_good.path if self.known_good is not None else None,
+                'large_file_size': self.large_file_size,
+                'window_size': self.window_size,
+                'overlap': self.overlap,
+                'window_workers': self.window_workers,
+                'byte_budget': self.byte_budget,
+                'archive_depth': self.archive_depth,
+                'archive_member_size': self.archive_member_size,
+                'archive_memory': self.archive_memory,
+                'governor': self.governor.options(workers) if self.governor is not None else None,
+                'prefilter': self.prefilter is not None,
+                'strings': self.strings}
+
+    def fingerprint(self):
+        """ Identifies the rules and options verdicts are produced with, for the file-state index """
+
+        parts = [rules_hash(self.rules)]
+        if self.known_good is not None:
+            st = os.stat(self.known_good.path)
+            parts.append('%s:%d:%d' % (self.known_good.path, st.st_size, st.st_mtime_ns))
+        if self.large_file_size:
+            parts.append('%d:%d:%d:%s' % (self.large_file_size, self.window_size, self.overlap, self.byte_budget))
+        parts.append('archives:%d:%d' % (self.archive_depth, self.archive_member_size))
+        if self.prefilter is not None:
+            parts.append('prefilter')
+        parts.append('records:%d' % self.strings)
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_options(cls, rules, options):
+        options = dict(options)
+        if options['known_good']:
+            options['known_good'] = KnownGoodSet(options['known_good'])
+        if options['governor']:
+            options['governor'] = Governor(**options['governor'])
+        return cls(rules, **options)
+
+    def scan(self, file_path):
+        """ Matches a single file, returns a list of (path, match records, error) tuples
+
+        The first tuple is for the file itself, the others for archive members
+        that matched or could not be read, with member paths as built by
+        archive_utils.iter_members.
+        """
+
+        start = time.perf_counter()
+        read = 0
+        try:
+            if self.large_file_size or self.governor is not None or self.prefilter is not None or \
+                    self.known_good is not None:
+                size = os.stat(file_path).st_size
+            else:
+                size = None
+            large = bool(self.large_file_size) and size > self.large_file_size
+
+            if self.prefilter is not None and not self.prefilter.wanted(file_path, size):
+                self.prefiltered += 1
+                # At most the header was read to classify the file
+                self._pace(min(size, HEADER_SIZE), start)
+                return [(file_path, [], None)]
+
+            if self.known_good is None:
+                data = None
+            else:
+                known, data = self._check_known_good(file_path, inline=not large)
+                if known:
+                    self.known_good_hits += 1
+                    self._pace(size, start)
+                    return [(file_path, [], None)]
+                if large:
+                    # The windows pace themselves, the whole file was read once more to hash it
+                    self._pace(size, start)
+                elif data is None:
+                    read += size
+
+            if large:
+                matches = self._match_windows(file_path, size)
+            elif data is not None:
+                matches = self._records(self.rules.match(data=data))
+            else:
+                matches = self._records(self.rules.match(filepath=file_path))
+        except Exception as e:
+            return [(file_path, [], str(e))]
+
+        if self.governor is not None and not large:
+            self._pace(read + size, start)
+        results = [(file_path, matches, None)]
+        if self.archive_depth:
+            results.extend(self._scan_members(file_path))
+        return results
+
+    def _pace(self, nbytes, start):
+        if self.governor is not None:
+            self.governor.pace(nbytes, time.perf_counter() - start)
+
+    def _scan_members(self, file_path):
+        results = []
+        member_path = file_path
+        try:
+            with open(file_path, 'rb') as f:
+                for member_path, member in archive_utils.iter_members(f, file_path, self.archive_depth,
+                                                                      self.archive_member_size,
+                                                                      self.archive_memory):
+                    matches = self._match_stream(member)
+                    if matches:
+                        results.append((member_path, matches, None))
+        except archive_utils.ARCHIVE_ERRORS as e:
+            results.append((member_path, [], str(e)))
+
+        return results
+
+    def _match_stream(self, stream):
+        """ Matches a stream in chunks of archive_memory bytes overlapping by overlap bytes """
+
+        matches = []
+        carry = b''
+        consumed = 0
+        while True:
+            start = time.perf_counter()
+            block = stream.read(self.archive_memory - len(carry))
+            if not block:
+                break
+            data = carry + block
+            merge_matches(matches, self._records(self.rules.match(data=data), consumed - len(carry)))
+            consumed += len(block)
+            self._pace(len(block), start)
+            carry = data[-self.overlap:] if self.overlap else b''
+
+        return matches
+
+    def _records(self, matches, base=0):
+        return [match_record(match, self.strings, base) for match in matches]
+
+    def _check_known_good(self, file_path, inline=True):
+        """ Hashes file_path, returns (in known-good set, contents if small enough to match from memory) """
+
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            data = f.read(MAX_INLINE_SIZE + 1) if inline else b''
+            hasher.update(data)
+            if not inline or len(data) > MAX_INLINE_SIZE:
+                data = None
+                for block in iter(lambda: f.read(BLOCKSIZE), b''):
+                    hasher.update(block)
+
+        return hasher.digest() in self.known_good, data
+
+    def _match_windows(self, file_path, size):
+        end = min(size, self.byte_budget) if self.byte_budget else size
+        if end < size:
+            logger.debug("Scanning the first " + str(end) + " of " + str(size) + " bytes of " + file_path)
+
+        with open(file_path, 'rb') as f:
+            def match_window(offset):
+                start = time.perf_counter()
+                length = min(self.window_size, end - offset)
+                with mmap.mmap(f.fileno(), length, offset=offset, access=mmap.ACCESS_READ) as window:
+                    found = self._records(self.rules.match(data=window), offset)
+                if self.governor is not None:
+                    self.governor.pace(length, time.perf_counter() - start)
+                return found
+
+            offsets = range(0, end, self.step)
+            if self.window_workers > 1:
+                if self._window_pool is None:
+                    self._window_pool = ThreadPoolExecutor(max_workers=self.window_workers)
+                window_matches = self._window_pool.map(match_window, offsets)
+            else:
+                window_matches = map(match_window, offsets)
+
+            matches = []
+            for found in window_matches:
+                merge_matches(matches, found)
+
+        return matches
+
+
+def _init_worker(rules_blob, options):
+    global _worker_scanner
+    _worker_scanner = FileScanner.from_options(rules_from_bytes(rules_blob), options)
+    if _worker_scanner.governor is not None:
+        _worker_scanner.governor.apply_priority()
+
+
+def _timed_scan(scanner, file_path):
+    """ Returns (scan results, seconds taken, why it was skipped) for a single file
+
+    The reason is 'known_good' or 'prefiltered' for files that were not matched, None otherwise.
+    """
+
+    hits, prefiltered = scanner.known_good_hits, scanner.prefiltered
+    start = time.perf_counter()
+    results = scanner.scan(file_path)
+    if scanner.known_good_hits != hits:
+        skipped = 'known_good'
+    elif scanner.prefiltered != prefiltered:
+        skipped = 'prefiltered'
+    else:
+        skipped = None
+    return results, time.perf_counter() - start, skipped
+
+
+def _scan_chunk(file_paths):
+    return [_timed_scan(_worker_scanner, file_path) for file_path in file_paths]
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def match_files(scanner, file_paths, workers=1, queue_size=None, metrics=None):
+    """ Scans files with a FileScanner, yielding its list of results for each file in input order
+
+    With workers > 1 the compiled rules are serialized once and loaded by each
+    process of a worker pool. At most queue_size chunks are in flight, so the walker feeding
+    file_paths never runs far ahead of the matching. With metrics, a RunMetrics,
+    the time taken by each file is added to the match phase and the slowest files are kept.
+    """
+
+    def record(timed_results):
+        results, seconds, skipped = timed_results
+        if metrics is not None:
+            metrics.add_time('match', seconds)
+            metrics.observe('files', results[0][0], seconds)
+            metrics.count('scanned')
+            if skipped:
+                metrics.count(skipped)
+        return results
+
+    if workers <= 1:
+        for file_path in file_paths:
+            yield record(_timed_scan(scanner, file_path))
+        return
+
+    queue_size = queue_size or workers * 4
+    pending = deque()
+
+    initargs = (rules_to_bytes(scanner.rules), scanner.options(workers))
+    with Pool(processes=workers, initializer=_init_worker, initargs=initargs) as pool:
+        for chunk in _chunks(file_paths, CHUNK_SIZE):
+            pending.append(pool.apply_async(_scan_chunk, (chunk,)))
+            if len(pending) >= queue_size:
+                for timed_results in pending.popleft().get():
+                    yield record(timed_results)
+
+        while pending:
+            for timed_results in pending.popleft().get():
+                yield record(timed_results)
+
+
+def _counted(files, metrics):
+    for file_path, st in metrics.timed('walk', files):
+        metrics.count('files')
+        metrics.count('bytes', st.st_size)
+        yield file_path, st
+
+
+def scan_files(scanner, files, workers=1, index=None, full=False, metrics=None, checkpoint=None, on_due=None):
+    """ Scans the (file_path, stat result) pairs of files, as yielded by walk_utils.walk_files
+
+    Yields (path, match records, error) for every file and for the archive
+    members that matched or failed. With an index, files unchanged since the last scan
+    are not read again. Their previous verdict is yielded if it had matches
+    and dropped otherwise. full=True rescans everything while still refreshing
+    the index. With metrics, a RunMetrics, the walk and match phases are timed
+    and files, bytes, cached verdicts, errors and matches are counted. With
+    checkpoint, a checkpoint_utils.Checkpoint, every file taken from files is
+    tracked as pending until all its results have been yielded, and on_due is
+    called between files whenever the checkpoint is due, even while files
+    served from the index yield nothing.
+    """
+
+    if checkpoint is not None:
+        files = checkpoint.track(files)
+
+    if metrics is None:
+        for result in _scan_files(scanner, files, workers, index, full, None, checkpoint, on_due):
+            yield result
+        return
+
+    for result in _scan_files(scanner, _counted(files, metrics), workers, index, full, metrics, checkpoint, on_due):
+        if result[2]:
+            metrics.count('errors')
+        elif result[1]:
+            metrics.count('matches')
+        yield result
+
+
+def _scan_files(scanner, files, workers, index, full, metrics, checkpoint, on_due):
+    def done(file_path):
+        if checkpoint is not None:
+            checkpoint.done(file_path)
+            if on_due is not None and checkpoint.due():
+                on_due()
+
+    if index is None:
+        for results in match_files(scanner, (file_path for file_path, st in files), workers, metrics=metrics):
+            for result in results:
+                yield result
+            done(results[0][0])
+        return
+
+    cached = deque()
+    stats = {}
+
+    def changed_files():
+        for file_path, st in files:
+            key = os.path.abspath(file_path)
+            verdict = None if full else index.lookup(key, st)
+            if verdict is None:
+                stats[file_path] = (key, st)
+                yield file_path
+                continue
+
+            if metrics is not None:
+                metrics.count('cached')
+            if verdict:
+                # Verdicts hold [path suffix, match records] pairs, the suffix locating archive members
+                cached.append((file_path, [(file_path + suffix, matches, None) for suffix, matches in verdict]))
+            else:
+                # Nothing to yield, the file is done as soon as it is found unchanged
+                done(file_path)
+
+    def flush_cached():
+        while cached:
+            file_path, results = cached.popleft()
+            for result in results:
+                yield result
+            done(file_path)
+
+    for results in match_files(scanner, changed_files(), workers, metrics=metrics):
+        for result in flush_cached():
+            yield result
+
+        file_path = results[0][0]
+        key, st = stats.pop(file_path, (None, None))
+        if st is not None and not any(error for _, _, error in results):
+            index.update(key, st, [[path[len(file_path):], matches] for path, matches, _ in results if matches])
+
+        for result in results:
+            yield result
+        done(file_path)
+
+    for result in flush_cached():
+        yield result
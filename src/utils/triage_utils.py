@@ -0,0 +1,503 @@
+'''
+Native triage collection for the Linux and macOS clients
+
+Artifacts (processes, network sockets, users, scheduled tasks, kernel
+modules and recent logs) are read from /proc and plain files, falling back
+to a command only where the platform offers nothing else (e.g. kextstat).
+Collectors run concurrently on threads and every entry they produce is
+streamed into a single tar.gz bundle as soon as it is ready, the bundle
+ending with a manifest.json of the SHA256, size and collection time of
+each entry.
+'''
+import glob
+import io
+import json
+import logging
+import os
+import platform
+import queue
+import socket
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import output_utils
+
+logger = logging.getLogger(__name__)
+
+# Threads running the collectors
+WORKERS = 8
+
+# Bytes kept from the end of each log file
+LOG_TAIL = 4 * 1048576
+
+# Files larger than this are truncated to their first MAX_FILE_SIZE bytes
+MAX_FILE_SIZE = 16 * 1048576
+
+# Seconds a fallback command may run
+COMMAND_TIMEOUT = 30
+
+# Entries collected but not written to the bundle yet
+QUEUE_SIZE = 64
+
+# gzip level of the bundle, favouring speed over size
+COMPRESS_LEVEL = 6
+
+# Version of the manifest layout
+MANIFEST_VERSION = 1
+
+# States of /proc/net/tcp sockets, by hex code
+TCP_STATES = {'01': 'ESTABLISHED', '02': 'SYN_SENT', '03': 'SYN_RECV', '04': 'FIN_WAIT1', '05': 'FIN_WAIT2',
+              '06': 'TIME_WAIT', '07': 'CLOSE', '08': 'CLOSE_WAIT', '09': 'LAST_ACK', '0A': 'LISTEN',
+              '0B': 'CLOSING', '0C': 'NEW_SYN_RECV'}
+
+# Files copied whole, by collector
+LINUX_SYSTEM_FILES = ['/etc/hostname', '/etc/os-release', '/etc/hosts', '/etc/resolv.conf', '/proc/version',
+                      '/proc/uptime', '/proc/loadavg', '/proc/mounts', '/proc/cmdline']
+LINUX_NETWORK_FILES = ['/proc/net/unix', '/proc/net/route', '/proc/net/arp', '/proc/net/dev']
+LINUX_USER_FILES = ['/etc/passwd', '/etc/group', '/etc/sudoers', '/etc/sudoers.d/*']
+LINUX_SCHEDULED_FILES = ['/etc/crontab', '/etc/anacrontab', '/etc/cron.d/*', '/etc/cron.hourly/*',
+                         '/etc/cron.daily/*', '/etc/cron.weekly/*', '/etc/cron.monthly/*', '/var/spool/cron/*',
+                         '/var/spool/cron/crontabs/*', '/etc/rc.local', '/etc/systemd/system/*.service',
+                         '/etc/systemd/system/*.timer', '/etc/systemd/system/*.wants/*']
+LINUX_MODULE_FILES = ['/proc/modules']
+DARWIN_SYSTEM_FILES = ['/System/Library/CoreServices/SystemVersion.plist', '/etc/hosts', '/etc/resolv.conf']
+DARWIN_USER_FILES = ['/etc/passwd', '/etc/group', '/etc/sudoers', '/etc/sudoers.d/*']
+DARWIN_SCHEDULED_FILES = ['/etc/crontab', '/usr/lib/cron/tabs/*', '/Library/LaunchAgents/*',
+                          '/Library/LaunchDaemons/*', '/Users/*/Library/LaunchAgents/*']
+
+# Log files whose tail is collected
+LINUX_LOGS = ['/var/log/syslog', '/var/log/messages', '/var/log/auth.log', '/var/log/secure', '/var/log/kern.log',
+              '/var/log/audit/audit.log', '/var/log/dpkg.log', '/var/log/yum.log', '/var/log/dnf.log']
+DARWIN_LOGS = ['/var/log/system.log', '/var/log/install.log', '/var/log/wifi.log']
+
+# Shell histories and keys collected from every home directory
+HOME_FILES = ['.ssh/authorized_keys', '.bash_history', '.zsh_history', '.sh_history']
+
+_DONE = object()
+
+
+def collect(artifacts, bundle_path, workers=WORKERS, metrics=None, hash_log=None,
+            algorithms=output_utils.DEFAULT_ALGORITHMS):
+    """ Runs the collectors of artifacts and streams what they read into the tar.gz bundle_path
+
+    artifacts maps artifact names to collectors, callables yielding (entry
+    name, bytes) pairs, which run on workers threads while this thread
+    writes each entry to the bundle as it arrives. A collector failing only
+    loses the entries it had not yielded yet. The bundle is written to a
+    temporary file renamed once complete, and ends with manifest.json, which
+    is also returned: the digests (SHA256 and those in algorithms), size and
+    seconds spent reading each entry and the seconds, entry count and error
+    of each artifact. The bundle is hashed as it is written and its digests
+    added to hash_log, an output_utils.HashLog. With metrics, a RunMetrics,
+    collection times are added as phases and observed.
+    """
+
+    manifest = {'version': MANIFEST_VERSION,
+                'hostname': socket.gethostname(),
+                'platform': platform.platform(),
+                'started': time.time(),
+                'artifacts': {},
+                'entries': []}
+    start = time.perf_counter()
+    entries = queue.Queue(QUEUE_SIZE)
+    stop = threading.Event()
+
+    directory = os.path.dirname(os.path.abspath(bundle_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with output_utils.ArtifactWriter(bundle_path, algorithms, fileobj=os.fdopen(fd, 'wb')) as bundle, \
+                tarfile.open(fileobj=bundle, mode='w:gz', compresslevel=COMPRESS_LEVEL) as tar, \
+                ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for name, collector in artifacts.items():
+                executor.submit(_run_collector, name, collector, entries, stop)
+
+            remaining = len(artifacts)
+            try:
+                while remaining:
+                    artifact, entry, data, seconds = entries.get()
+                    if entry is _DONE:
+                        remaining -= 1
+                        manifest['artifacts'][artifact] = data
+                        if metrics is not None:
+                            metrics.add_time('collect', data['seconds'])
+                            metrics.observe('artifact', artifact, data['seconds'])
+                        continue
+
+                    _add_entry(tar, entry, data)
+                    record = {'name': entry,
+                              'artifact': artifact,
+                              'size': len(data),
+                              'seconds': round(seconds, 6)}
+                    record.update(output_utils.digests(data, algorithms))
+                    manifest['entries'].append(record)
+                    if metrics is not None:
+                        metrics.count('entries')
+                        metrics.count('bytes', len(data))
+            finally:
+                # Unblock the collectors if the bundle could not be written
+                stop.set()
+                while remaining:
+                    if entries.get()[1] is _DONE:
+                        remaining -= 1
+
+            manifest['seconds'] = round(time.perf_counter() - start, 6)
+            _add_entry(tar, 'manifest.json', json.dumps(manifest, indent=2).encode('utf-8'))
+        os.replace(tmp_path, bundle_path)
+        if hash_log is not None:
+            hash_log.add(bundle_path, bundle.digests())
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return manifest
+
+
+def _run_collector(name, collector, entries, stop):
+    start = time.perf_counter()
+    summary = {'entries': 0, 'bytes': 0}
+    try:
+        produced = iter(collector())
+        while not stop.is_set():
+            entry_start = time.perf_counter()
+            try:
+                entry, data = next(produced)
+            except StopIteration:
+                break
+            summary['entries'] += 1
+            summary['bytes'] += len(data)
+            entries.put((name, name + '/' + entry, data, time.perf_counter() - entry_start))
+    except Exception as e:
+        logger.error("Could not collect " + name + ": " + str(e))
+        summary['error'] = str(e)
+    summary['seconds'] = round(time.perf_counter() - start, 6)
+    entries.put((name, _DONE, summary, 0))
+
+
+def _add_entry(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o600
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _json(value):
+    return json.dumps(value, indent=2, sort_keys=True).encode('utf-8')
+
+
+def read_file(path, size=MAX_FILE_SIZE, tail=False):
+    """ Returns the first (or with tail, the last) size bytes of a file
+
+    Files under /proc report a size of 0, so they are read up to size
+    whatever their stat says.
+    """
+
+    with open(path, 'rb') as f:
+        if tail:
+            end = f.seek(0, os.SEEK_END)
+            f.seek(max(0, end - size))
+        return f.read(size)
+
+
+def read_files(patterns, size=MAX_FILE_SIZE, tail=False):
+    """ Yields ('files' + path, contents) for the regular files matching the glob patterns, once each
+
+    Missing and unreadable files are skipped, most patterns only match on
+    some distributions or with root privileges.
+    """
+
+    seen = set()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if path in seen or not os.path.isfile(path):
+                continue
+            seen.add(path)
+            try:
+                data = read_file(path, size, tail)
+            except OSError as e:
+                logger.debug("Skipped " + path + ": " + str(e))
+                continue
+            yield 'files' + os.path.abspath(path), data
+
+
+def run_command(args, timeout=COMMAND_TIMEOUT):
+    """ Returns the standard output of a command, for artifacts no file holds """
+
+    return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=timeout,
+                          check=True).stdout
+
+
+def parse_passwd(path='/etc/passwd'):
+    """ Returns the accounts of a passwd file as dicts, skipping malformed lines """
+
+    accounts = []
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            fields = line.rstrip('\n').split(':')
+            if len(fields) != 7 or line.startswith('#'):
+                continue
+            accounts.append({'name': fields[0], 'uid': int(fields[2]) if fields[2].isdigit() else None,
+                             'gid': int(fields[3]) if fields[3].isdigit() else None, 'gecos': fields[4],
+                             'home': fields[5], 'shell': fields[6]})
+    return accounts
+
+
+def _home_files():
+    try:
+        homes = sorted({account['home'] for account in parse_passwd() if account['home'] not in ('', '/')})
+    except OSError:
+        homes = []
+    return read_files([os.path.join(home, name) for home in homes for name in HOME_FILES], tail=True)
+
+
+def _system_info():
+    uname = platform.uname()
+    return {'hostname': socket.gethostname(), 'system': uname.system, 'release': uname.release,
+            'version': uname.version, 'machine': uname.machine, 'collected': time.time()}
+
+
+def _sessions():
+    # psutil reads utmp natively on both platforms
+    import psutil
+
+    return [dict(session._asdict()) for session in psutil.users()]
+
+
+def _pids():
+    return sorted(int(name) for name in os.listdir('/proc') if name.isdigit())
+
+
+def proc_process(pid, usernames=None, boot_time=None, ticks=None):
+    """ Returns the metadata of a Linux process read from /proc/<pid>, or None if it exited
+
+    usernames maps uids to account names. The start time is converted to epoch
+    seconds given boot_time and the clock ticks per second.
+    """
+
+    base = '/proc/%d/' % pid
+    try:
+        with open(base + 'stat', 'rb') as f:
+            stat = f.read().decode('utf-8', 'replace')
+        with open(base + 'status', 'rb') as f:
+            status = f.read().decode('utf-8', 'replace')
+        with open(base + 'cmdline', 'rb') as f:
+            cmdline = f.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    # The command name may hold spaces and parentheses, the fields follow the last ')'
+    comm = stat[stat.find('(') + 1:stat.rfind(')')]
+    fields = stat[stat.rfind(')') + 2:].split()
+    uids = next((line.split()[1:] for line in status.splitlines() if line.startswith('Uid:')), [None])
+    uid = int(uids[0]) if uids[0] is not None else None
+
+    process = {'pid': pid,
+               'ppid': int(fields[1]),
+               'name': comm,
+               'state': fields[0],
+               'uid': uid,
+               'username': (usernames or {}).get(uid),
+               'cmdline': [arg.decode('utf-8', 'replace') for arg in cmdline.split(b'\0')[:-1]],
+               'threads': int(fields[17]),
+               'rss': int(fields[21]) * os.sysconf('SC_PAGE_SIZE'),
+               'create_time': boot_time + int(fields[19]) / ticks if boot_time and ticks else None}
+    for link in ('exe', 'cwd'):
+        try:
+            process[link] = os.readlink(base + link)
+        except OSError:
+            process[link] = None
+    return process
+
+
+def _boot_time():
+    with open('/proc/stat', 'r') as f:
+        for line in f:
+            if line.startswith('btime'):
+                return int(line.split()[1])
+    return None
+
+
+def linux_processes():
+    """ Yields processes.json, the processes read from /proc """
+
+    try:
+        usernames = {account['uid']: account['name'] for account in parse_passwd()}
+    except OSError:
+        usernames = {}
+    boot_time = _boot_time()
+    ticks = os.sysconf('SC_CLK_TCK')
+    processes = [process for process in (proc_process(pid, usernames, boot_time, ticks) for pid in _pids()) if process]
+    yield 'processes.json', _json(processes)
+
+
+def _socket_owners():
+    owners = {}
+    for pid in _pids():
+        try:
+            fds = os.listdir('/proc/%d/fd' % pid)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink('/proc/%d/fd/%s' % (pid, fd))
+            except OSError:
+                continue
+            if target.startswith('socket:['):
+                owners.setdefault(int(target[8:-1]), pid)
+    return owners
+
+
+def proc_address(address):
+    """ Returns the (ip, port) of a hex address of /proc/net/tcp, tcp6, udp or udp6 """
+
+    host, port = address.split(':')
+    packed = bytes.fromhex(host)
+    if len(packed) == 4:
+        ip = socket.inet_ntop(socket.AF_INET, packed[::-1])
+    else:
+        # Four 32-bit words in host (little endian) order
+        ip = socket.inet_ntop(socket.AF_INET6, b''.join(packed[i:i + 4][::-1] for i in range(0, 16, 4)))
+    return ip, int(port, 16)
+
+
+def parse_proc_net(path, owners=None):
+    """ Returns the sockets listed in a /proc/net/tcp, tcp6, udp or udp6 file, with the pid owning them """
+
+    protocol = os.path.basename(path)
+    sockets = []
+    with open(path, 'r') as f:
+        next(f, None)
+        for line in f:
+            fields = line.split()
+            if len(fields) < 10:
+                continue
+            laddr, lport = proc_address(fields[1])
+            raddr, rport = proc_address(fields[2])
+            inode = int(fields[9])
+            sockets.append({'protocol': protocol, 'laddr': laddr, 'lport': lport, 'raddr': raddr, 'rport': rport,
+                            'state': TCP_STATES.get(fields[3], fields[3]) if protocol.startswith('tcp') else None,
+                            'uid': int(fields[7]), 'inode': inode, 'pid': (owners or {}).get(inode)})
+    return sockets
+
+
+def linux_network():
+    """ Yields sockets.json, the sockets of /proc/net with their owning pids, and the raw /proc/net tables """
+
+    owners = _socket_owners()
+    sockets = []
+    for protocol in ('tcp', 'tcp6', 'udp', 'udp6'):
+        try:
+            sockets.extend(parse_proc_net('/proc/net/' + protocol, owners))
+        except OSError as e:
+            logger.debug("Skipped /proc/net/" + protocol + ": " + str(e))
+    yield 'sockets.json', _json(sockets)
+    yield from read_files(LINUX_NETWORK_FILES)
+
+
+def linux_modules():
+    """ Yields the loaded kernel modules """
+
+    yield from read_files(LINUX_MODULE_FILES)
+
+
+def darwin_processes():
+    """ Yields processes.json, the processes read through psutil (sysctl) """
+
+    import psutil
+
+    attrs = ['pid', 'ppid', 'name', 'exe', 'cmdline', 'username', 'create_time', 'status', 'cwd', 'num_threads']
+    yield 'processes.json', _json([process.info for process in psutil.process_iter(attrs=attrs, ad_value=None)])
+
+
+def darwin_network():
+    """ Yields sockets.json, the inet sockets read through psutil """
+
+    import psutil
+
+    try:
+        connections = [(connection, connection.pid) for connection in psutil.net_connections(kind='inet')]
+    except psutil.AccessDenied:
+        # Without root, only the sockets of this user's processes can be listed
+        connections = []
+        for process in psutil.process_iter():
+            try:
+                process_connections = getattr(process, 'net_connections', None) or process.connections
+                connections.extend((connection, process.pid) for connection in process_connections(kind='inet'))
+            except (psutil.AccessDenied, psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue
+
+    sockets = []
+    for connection, pid in connections:
+        sockets.append({'protocol': {socket.SOCK_STREAM: 'tcp', socket.SOCK_DGRAM: 'udp'}.get(connection.type),
+                        'family': 6 if connection.family == socket.AF_INET6 else 4,
+                        'laddr': connection.laddr[0] if connection.laddr else None,
+                        'lport': connection.laddr[1] if connection.laddr else None,
+                        'raddr': connection.raddr[0] if connection.raddr else None,
+                        'rport': connection.raddr[1] if connection.raddr else None,
+                        'state': connection.status, 'pid': pid})
+    yield 'sockets.json', _json(sockets)
+
+
+def darwin_modules():
+    """ Yields kextstat.txt, the loaded kernel extensions, which no file lists """
+
+    yield 'kextstat.txt', run_command(['kextstat', '-l'])
+
+
+def system_collector(files):
+    """ Returns a collector of system.json and the system files """
+
+    def collector():
+        yield 'system.json', _json(_system_info())
+        yield from read_files(files)
+    return collector
+
+
+def users_collector(files):
+    """ Returns a collector of the logged in sessions, the account files and each user's keys and histories """
+
+    def collector():
+        yield 'sessions.json', _json(_sessions())
+        yield from read_files(files)
+        yield from _home_files()
+    return collector
+
+
+def files_collector(patterns, size=MAX_FILE_SIZE, tail=False):
+    """ Returns a collector of the files matching the glob patterns """
+
+    def collector():
+        return read_files(patterns, size, tail)
+    return collector
+
+
+# Artifacts of each platform, collected concurrently
+LINUX_ARTIFACTS = {'system': system_collector(LINUX_SYSTEM_FILES),
+                   'processes': linux_processes,
+                   'network': linux_network,
+                   'users': users_collector(LINUX_USER_FILES),
+                   'scheduled': files_collector(LINUX_SCHEDULED_FILES),
+                   'modules': linux_modules,
+                   'logs': files_collector(LINUX_LOGS, LOG_TAIL, tail=True)}
+DARWIN_ARTIFACTS = {'system': system_collector(DARWIN_SYSTEM_FILES),
+                    'processes': darwin_processes,
+                    'network': darwin_network,
+                    'users': users_collector(DARWIN_USER_FILES),
+                    'scheduled': files_collector(DARWIN_SCHEDULED_FILES),
+                    'modules': darwin_modules,
+                    'logs': files_collector(DARWIN_LOGS, LOG_TAIL, tail=True)}
+
+
+def bundle_name(hostname=None, created=None):
+    """ Returns the file name of a triage bundle, triage-<hostname>-<GMT timestamp>.tar.gz """
+
+    return 'triage-%s-%s.tar.gz' % (hostname or socket.gethostname(),
+                                    time.strftime('%Y%m%d%H%M%S', time.gmtime(created)))
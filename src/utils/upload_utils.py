@@ -0,0 +1,158 @@
+'''
+Background upload of scan results to the rastrea2r server
+'''
+import json
+import logging
+import queue
+import threading
+import time
+
+from utils import http_utils, metrics_utils
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the size/time bounds of a single POST to /results
+BATCH_SIZE = 500
+BATCH_BYTES = 1048576
+BATCH_INTERVAL = 5.0
+
+# Records waiting for the uploader before add() blocks the scan
+QUEUE_SIZE = 2000
+
+# Content-Type of batches sent as a header line followed by one record per line
+NDJSON_TYPE = 'application/x-ndjson'
+
+_STOP = object()
+_FLUSH = object()
+
+
+class ResultUploader:
+    """ Streams result records to the server in batches while a scan runs
+
+    Records are posted once a batch reaches batch_size records, batch_bytes of
+    JSON or has waited interval seconds. The queue between the scan and the
+    uploader thread is bounded, so a slow server throttles the scan instead of
+    letting results pile up in memory. With metrics, a RunMetrics, POSTs are
+    timed as the upload phase. With keep_unsent, the records of failed POSTs
+    are kept in unsent, as JSON strings, instead of being dropped.
+
+    Records are encoded as compact JSON. Batches are posted as a JSON array,
+    or, with header, a dict of the fields shared by every record (e.g.
+    hostname and module), as NDJSON: the header on the first line and one
+    record per line after it.
+    """
+
+    def __init__(self, url, headers=None, auth=None, batch_size=BATCH_SIZE, batch_bytes=BATCH_BYTES,
+                 interval=BATCH_INTERVAL, queue_size=QUEUE_SIZE, metrics=None, keep_unsent=False, header=None):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.header = _dumps(header) if header is not None else None
+        if header is not None:
+            self.headers['Content-Type'] = NDJSON_TYPE
+        self.auth = auth
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.interval = interval
+        self.metrics = metrics
+        self.keep_unsent = keep_unsent
+        self.unsent = []
+        self.flushed = threading.Event()
+        self.records = 0
+        self.sent = 0
+        self.failed = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, name='rastrea2r-uploader', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def add(self, result):
+        """ Queues a result record, blocking while the uploader is behind """
+
+        record = _dumps(result)
+        self.records += 1
+        self.queue.put(record)
+
+    def flush(self):
+        """ Blocks until every record added so far has been posted, returns unsent """
+
+        if self.thread.is_alive():
+            self.flushed.clear()
+            self.queue.put(_FLUSH)
+            self.flushed.wait()
+        return self.unsent
+
+    def close(self):
+        """ Uploads any queued records and stops the uploader thread """
+
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+
+    def _run(self):
+        batch = []
+        batch_bytes = 0
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                if batch:
+                    self._post(batch)
+                return
+
+            if item is _FLUSH:
+                if batch:
+                    self._post(batch)
+                    batch = []
+                    batch_bytes = 0
+                    deadline = None
+                self.flushed.set()
+                continue
+
+            if item is not None:
+                batch.append(item)
+                batch_bytes += len(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+
+            if batch and (item is None or len(batch) >= self.batch_size or batch_bytes >= self.batch_bytes):
+                self._post(batch)
+                batch = []
+                batch_bytes = 0
+                deadline = None
+
+    def _post(self, batch):
+        with metrics_utils.phase(self.metrics, 'upload'):
+            if self.header is not None:
+                body = self.header + '\n' + '\n'.join(batch) + '\n'
+            else:
+                body = '[' + ','.join(batch) + ']'
+            response = http_utils.http_post_request(url=self.url, body=body, auth=self.auth, headers=self.headers,
+                                                    compress=True)
+
+        if response is not None and response.status_code == 200:
+            self.sent += len(batch)
+            if self.metrics is not None:
+                self.metrics.count('uploaded', len(batch))
+            logger.debug("Uploaded a batch of " + str(len(batch)) + " results")
+        else:
+            self.failed += len(batch)
+            if self.keep_unsent:
+                self.unsent.extend(batch)
+            if self.metrics is not None:
+                self.metrics.count('upload_failed', len(batch))
+            logger.error("Error uploading the results: " + (response.text if response is not None else "no response"))
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'))
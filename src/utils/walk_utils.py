@@ -0,0 +1,127 @@
+'''
+Directory walker used by the yara-disk scans
+'''
+import fnmatch
+import logging
+import os
+import re
+import stat
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def _exclude_matcher(excludes):
+    """ Returns a predicate for the exclude globs, or None if there are none
+
+    Globs containing a path separator are matched against the full path, the
+    others against the entry name only (e.g. '/proc' vs '*.iso').
+    """
+
+    path_globs = [fnmatch.translate(g) for g in excludes or () if os.sep in g or '/' in g]
+    name_globs = [fnmatch.translate(g) for g in excludes or () if not (os.sep in g or '/' in g)]
+    if not path_globs and not name_globs:
+        return None
+
+    path_re = re.compile('|'.join(path_globs)).match if path_globs else None
+    name_re = re.compile('|'.join(name_globs)).match if name_globs else None
+
+    def excluded(entry):
+        return bool((path_re and path_re(entry.path)) or (name_re and name_re(entry.name)))
+
+    return excluded
+
+
+class WalkState:
+    """ Directories and files a walk_files walk has still to visit
+
+    Passed to walk_files, it is updated as the walk goes, so snapshot() taken
+    between two files gives the position to continue from. A WalkState built
+    from a snapshot resumes the walk there instead of starting over.
+    """
+
+    def __init__(self, directories=None, files=None):
+        self.directories = list(directories) if directories is not None else None
+        self.files = deque(files or ())
+
+    def snapshot(self):
+        """ Returns the remaining directories and files as JSON serializable lists """
+
+        return {'directories': list(self.directories or ()),
+                'files': [item if isinstance(item, str) else item.path for item in self.files]}
+
+
+def walk_files(path, excludes=None, one_file_system=False, max_size=None, state=None):
+    """ Yields (path, stat result) for every regular file below path
+
+    Built on os.scandir so directory entries are classified from the cached
+    d_type without a stat call. Symlinks, sockets, FIFOs and devices are
+    skipped, as are excluded entries, files larger than max_size and, with
+    one_file_system, directories on another device than path. With state, a
+    WalkState, the walk continues from its position and keeps it up to date.
+    """
+
+    excluded = _exclude_matcher(excludes)
+
+    try:
+        root_st = os.stat(path)
+    except OSError as e:
+        logger.error("Cannot access " + path + ": " + str(e))
+        return
+
+    if state is None:
+        state = WalkState()
+
+    if state.directories is None:
+        if stat.S_ISREG(root_st.st_mode):
+            state.directories = []
+            if not max_size or root_st.st_size <= max_size:
+                yield path, root_st
+            return
+        state.directories = [path]
+
+    root_dev = root_st.st_dev
+
+    while True:
+        # Files of the listed directories first, each directory being read in full before its files are yielded
+        while state.files:
+            item = state.files.popleft()
+            try:
+                if isinstance(item, str):
+                    # Resumed from a snapshot
+                    file_path, st = item, os.stat(item, follow_symlinks=False)
+                    if not stat.S_ISREG(st.st_mode):
+                        continue
+                else:
+                    file_path, st = item.path, item.stat(follow_symlinks=False)
+            except OSError as e:
+                logger.debug("Skipping file: " + str(e))
+                continue
+
+            if not max_size or st.st_size <= max_size:
+                yield file_path, st
+
+        if not state.directories:
+            return
+
+        try:
+            entries = os.scandir(state.directories.pop())
+        except OSError as e:
+            logger.debug("Skipping directory: " + str(e))
+            continue
+
+        with entries:
+            for entry in entries:
+                try:
+                    if excluded and excluded(entry):
+                        continue
+
+                    if entry.is_dir(follow_symlinks=False):
+                        if not one_file_system or entry.stat(follow_symlinks=False).st_dev == root_dev:
+                            state.directories.append(entry.path)
+
+                    elif entry.is_file(follow_symlinks=False):
+                        state.files.append(entry)
+
+                except OSError as e:
+                    logger.debug("Skipping " + entry.path + ": " + str(e))
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import yara
+from utils import api_utils, checkpoint_utils, index_utils, scan_utils
+
+RULE = 'rule marker { strings: $a = "rastrea2r-marker" condition: $a }'
+
+# Match record of RULE compiled without a namespace
+MARKER = {'rule': 'marker', 'namespace': 'default'}
+
+# Builds the marker at runtime so it is only found in the child's heap
+CHILD = "import sys; marker = '-'.join(['rastrea2r', 'marker']); print(flush=True); sys.stdin.read()"
+
+
+class ApiUtilsTestCase(unittest.TestCase):
+    ''' Embeddable scanning API test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tree = os.path.join(self.tmpdir.name, 'tree')
+        os.makedirs(self.tree)
+        for i in range(30):
+            with open(os.path.join(self.tree, '%02d.txt' % i), 'w') as f:
+                f.write('rastrea2r-marker' if i % 3 == 0 else 'benign')
+        self.rules = yara.compile(source=RULE)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_scan_path_records(self):
+        ''' check a path scan yields a record for every matching file '''
+        records = list(api_utils.scan_path(self.rules, self.tree, workers=2))
+        self.assertEqual(sorted(os.path.basename(record['filename']) for record in records),
+                         ['%02d.txt' % i for i in range(0, 30, 3)])
+        self.assertTrue(all(record['matches'] == [MARKER] for record in records))
+
+    def test_scan_path_early_stop(self):
+        ''' check a path scan can be stopped after its first record '''
+        scan = api_utils.scan_path(self.rules, self.tree, workers=2)
+        first = next(scan)
+        scan.close()
+        self.assertEqual(first['matches'], [MARKER])
+        self.assertRaises(StopIteration, next, scan)
+
+    def test_scan_path_options(self):
+        ''' check scanner options are passed to the FileScanner '''
+        records = list(api_utils.scan_path(self.rules, os.path.join(self.tree, '00.txt'), strings=True))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['matches'][0]['strings'], {'$a': [0]})
+
+    def test_scan_path_checkpoint(self):
+        ''' check a due checkpoint is saved with the records the caller could not deliver '''
+        state_path = os.path.join(self.tmpdir.name, 'checkpoint.json')
+        checkpoint = checkpoint_utils.Checkpoint(state_path, 'fingerprint', interval=0)
+        calls = []
+
+        def on_checkpoint():
+            calls.append(None)
+            return ['{"filename": "unsent"}']
+
+        records = list(api_utils.scan_path(self.rules, self.tree, checkpoint=checkpoint, on_checkpoint=on_checkpoint))
+        self.assertEqual(len(records), 10)
+        self.assertTrue(calls)
+        self.assertEqual(checkpoint.saves, len(calls))
+
+        resumed = checkpoint_utils.Checkpoint(state_path, 'fingerprint')
+        self.assertTrue(resumed.resume())
+        self.assertEqual(resumed.unsent, ['{"filename": "unsent"}'])
+
+    def test_unchanged_tree_checkpoint(self):
+        ''' check files served from the index are not held pending and a checkpoint is still saved '''
+        for i in range(300):
+            with open(os.path.join(self.tree, 'benign-%03d.txt' % i), 'w') as f:
+                f.write('benign')
+        db_path = os.path.join(self.tmpdir.name, 'index.db')
+        index = index_utils.FileIndex(db_path, scan_utils.rules_hash(self.rules))
+        self.assertEqual(len(list(api_utils.scan_path(self.rules, self.tree, index=index))), 10)
+        index.close()
+
+        checkpoint = checkpoint_utils.Checkpoint(os.path.join(self.tmpdir.name, 'checkpoint.json'), 'fingerprint',
+                                                 interval=0)
+        peak = []
+        track = checkpoint.track
+
+        def tracked(files):
+            for item in track(files):
+                peak.append(len(checkpoint.pending))
+                yield item
+
+        checkpoint.track = tracked
+        index = index_utils.FileIndex(db_path, scan_utils.rules_hash(self.rules))
+        records = list(api_utils.scan_path(self.rules, self.tree, index=index, checkpoint=checkpoint))
+        index.close()
+
+        # Only the cached verdicts with matches wait to be yielded
+        self.assertEqual(len(records), 10)
+        self.assertLessEqual(max(peak), 11)
+        self.assertGreaterEqual(checkpoint.saves, 300)
+
+    def test_scan_memory(self):
+        ''' check a memory scan yields a record for the matching process only '''
+        child = subprocess.Popen([sys.executable, '-c', CHILD], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            child.stdout.readline()
+            try:
+                self.rules.match(pid=child.pid)
+            except yara.Error as e:
+                self.skipTest("Cannot read process memory: " + str(e))
+
+            records = list(api_utils.scan_memory(self.rules, pids={child.pid, os.getpid()}, timeout=30,
+                                                 attrs=['pid', 'name', 'exe']))
+        finally:
+            child.stdin.close()
+            child.wait()
+            child.stdout.close()
+
+        self.assertEqual([record['processpid'] for record in records], [child.pid])
+        self.assertEqual(records[0]['matches'], [MARKER])
+        self.assertIn('processpath', records[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import yara
+from utils import checkpoint_utils, index_utils, scan_utils, walk_utils
+
+RULE = 'rule marker { strings: $a = "rastrea2r-marker" condition: $a }'
+
+
+class CheckpointUtilsTestCase(unittest.TestCase):
+    ''' Scan checkpoint and resume test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tree = os.path.join(self.tmpdir.name, 'tree')
+        self.paths = []
+        for d in range(4):
+            directory = os.path.join(self.tree, 'd%d' % d, 'sub')
+            os.makedirs(directory)
+            for i in range(5):
+                path = os.path.join(directory if i % 2 else os.path.dirname(directory), '%d.txt' % i)
+                with open(path, 'w') as f:
+                    f.write('rastrea2r-marker' if i == 0 else 'benign')
+                self.paths.append(path)
+        self.scanner = scan_utils.FileScanner(yara.compile(source=RULE))
+        self.state_path = checkpoint_utils.state_path(os.path.join(self.tmpdir.name, 'checkpoints'), self.tree, 'marker')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_walk_resume(self):
+        ''' check a walk resumed from a snapshot yields every remaining file once '''
+        state = walk_utils.WalkState()
+        walk = walk_utils.walk_files(self.tree, state=state)
+        first = [path for path, st in (next(walk) for _ in range(7))]
+        snapshot = state.snapshot()
+
+        resumed = walk_utils.WalkState(snapshot['directories'], snapshot['files'])
+        rest = [path for path, st in walk_utils.walk_files(self.tree, state=resumed)]
+        self.assertEqual(sorted(first + rest), sorted(self.paths))
+
+    def run_scan(self, resume, stop_after=None, index=None):
+        checkpoint = checkpoint_utils.Checkpoint(self.state_path, self.scanner.fingerprint())
+        if resume:
+            self.assertTrue(checkpoint.resume())
+        files = walk_utils.walk_files(self.tree, state=checkpoint.walk_state)
+        handled = []
+        for file_path, matches, error in scan_utils.scan_files(self.scanner, files, index=index,
+                                                               checkpoint=checkpoint):
+            if len(handled) == stop_after:
+                checkpoint.save(['{"rulename": "marker"}'])
+                return handled
+            handled.append(file_path)
+        checkpoint.remove()
+        return handled
+
+    def test_scan_resume(self):
+        ''' check a resumed scan neither rescans nor reports the files finished before the checkpoint '''
+        first = self.run_scan(False, stop_after=9)
+        rest = self.run_scan(True)
+        self.assertEqual(sorted(first + rest), sorted(self.paths))
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_resume_unsent(self):
+        ''' check failed uploads are restored and a checkpoint of other rules is ignored '''
+        index = index_utils.FileIndex(os.path.join(self.tmpdir.name, 'index.db'), self.scanner.fingerprint())
+        self.run_scan(False, stop_after=3, index=index)
+        index.close()
+        checkpoint = checkpoint_utils.Checkpoint(self.state_path, self.scanner.fingerprint())
+        self.assertTrue(checkpoint.resume())
+        self.assertEqual(checkpoint.unsent, ['{"rulename": "marker"}'])
+        self.assertFalse(checkpoint_utils.Checkpoint(self.state_path, 'other-rules').resume())
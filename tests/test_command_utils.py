@@ -0,0 +1,134 @@
+import configparser
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import rastrea2r
+from utils import command_utils, output_utils
+
+# Sleeps for argv[1] seconds, then prints argv[2]
+SLEEP = "import sys, time; time.sleep(float(sys.argv[1])); print(sys.argv[2])"
+
+
+def _sleep(name, seconds, **options):
+    return command_utils.Command(name, [sys.executable, '-c', SLEEP, str(seconds), name], **options)
+
+
+class CommandUtilsTestCase(unittest.TestCase):
+    ''' Concurrent triage command runner test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.started = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def sink(self, command):
+        with self.lock:
+            self.started.append((command.name, time.monotonic()))
+        return output_utils.ArtifactWriter(os.path.join(self.tmpdir.name, command.name + '.log'), ('md5',))
+
+    def output(self, name):
+        with open(os.path.join(self.tmpdir.name, name + '.log'), 'rb') as f:
+            return f.read()
+
+    def test_parse_commands(self):
+        ''' check configured lines are named and their options parsed '''
+        commands = command_utils.parse_commands(['psinfo.exe /accepteula', '\n  ',
+                                                 '\n {priority=5 after=psinfo lock=procs timeout=30} handle.exe -a',
+                                                 '{name=listening} /usr/bin/ss -tln'], prefix='\\\\tools\\')
+
+        self.assertEqual([command.name for command in commands], ['psinfo', 'handle', 'listening'])
+        self.assertEqual(commands[0].args, '\\\\tools\\psinfo.exe /accepteula')
+        self.assertEqual((commands[1].args, commands[1].priority, commands[1].after, commands[1].lock,
+                          commands[1].timeout), ('\\\\tools\\handle.exe -a', 5, ('psinfo',), 'procs', 30.0))
+        self.assertEqual(command_utils.parse_command('/usr/bin/last -F').name, 'last')
+        self.assertRaises(ValueError, command_utils.parse_command, '{priority=1 colour=red} ps')
+
+    def test_configured_commands(self):
+        ''' check commands read from the configuration keep the commas of their after option '''
+        config = configparser.ConfigParser()
+        config.read_string('[rastrea2r]\nenable_trace = 0\nusername = u\npassword = p\nserver_port = 8080\n'
+                           'version = 1\napi_version = v1\n'
+                           'windows_commands = {after=psinfo,pslist} handle.exe -a,\n  psinfo.exe, pslist.exe,\n'
+                           'triage_commands = /usr/bin/ss -tln, {after=ss,w name=late} /usr/bin/last\n')
+        settings = rastrea2r._read_settings(config)
+
+        commands = command_utils.parse_commands(settings['WINDOWS_COMMANDS'])
+        self.assertEqual([command.name for command in commands], ['handle', 'psinfo', 'pslist'])
+        self.assertEqual(commands[0].after, ('psinfo', 'pslist'))
+        commands = command_utils.parse_commands(settings['TRIAGE_COMMANDS'])
+        self.assertEqual([(command.name, command.after) for command in commands],
+                         [('ss', ()), ('late', ('ss', 'w'))])
+
+    def test_invalid_order(self):
+        ''' check duplicate names, unknown dependencies and cycles are refused before running anything '''
+        for commands in ([_sleep('a', 0), _sleep('a', 0)],
+                         [_sleep('a', 0, after=['missing'])],
+                         [_sleep('a', 0, after=['b']), _sleep('b', 0, after=['a'])]):
+            self.assertRaises(ValueError, command_utils.run_commands, commands, self.sink)
+        self.assertEqual(self.started, [])
+
+    def test_concurrent_runs(self):
+        ''' check commands overlap and their outputs are streamed and hashed '''
+        hash_log = output_utils.HashLog(os.path.join(self.tmpdir.name, 'sha256-hashing.log'))
+        start = time.monotonic()
+        results = command_utils.run_commands([_sleep('one', 0.5), _sleep('two', 0.5), _sleep('three', 0.5)],
+                                             self.sink, workers=3, hash_log=hash_log)
+
+        self.assertLess(time.monotonic() - start, 1.4)
+        self.assertEqual([result['name'] for result in results], ['one', 'two', 'three'])
+        for result in results:
+            output = self.output(result['name'])
+            self.assertEqual(output.strip(), result['name'].encode('ascii'))
+            self.assertEqual(result['returncode'], 0)
+            self.assertEqual(result['digests'], {'sha256': hashlib.sha256(output).hexdigest(),
+                                                 'md5': hashlib.md5(output).hexdigest()})
+        with open(hash_log.path) as f:
+            self.assertEqual(f.read().count(' md5:'), 3)
+
+    def test_ordering(self):
+        ''' check dependencies, locks and priorities order the commands '''
+        commands = [_sleep('first', 0.3),
+                    _sleep('after_first', 0, after=['first']),
+                    _sleep('locked_a', 0.3, lock='disk'),
+                    _sleep('locked_b', 0.3, lock='disk')]
+        results = command_utils.run_commands(commands, self.sink, workers=4)
+
+        # Commands that must not overlap start at least the 0.3s sleep of the other apart
+        started = dict(self.started)
+        self.assertGreaterEqual(started['after_first'] - started['first'], 0.3)
+        self.assertGreaterEqual(abs(started['locked_b'] - started['locked_a']), 0.3)
+        self.assertTrue(all(result['returncode'] == 0 for result in results))
+
+        # The ready command of highest priority goes first
+        del self.started[:]
+        command_utils.run_commands([_sleep('low', 0), _sleep('urgent', 0, priority=10),
+                                    _sleep('blocked', 0, priority=20, after=['low'])], self.sink, workers=1)
+        self.assertEqual([name for name, _ in self.started], ['urgent', 'low', 'blocked'])
+
+    def test_timeout_and_failure(self):
+        ''' check a command is killed on timeout and a missing one fails without stopping the others '''
+        commands = [_sleep('slow', 30, timeout=0.5),
+                    command_utils.Command('missing', [os.path.join(self.tmpdir.name, 'no-such-tool')]),
+                    _sleep('fine', 0, after=['slow', 'missing'])]
+        start = time.monotonic()
+        slow, missing, fine = command_utils.run_commands(commands, self.sink, workers=2, timeout=60)
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(slow['timed_out'])
+        self.assertIsNone(slow['returncode'])
+        self.assertIn('error', missing)
+        self.assertEqual(fine['returncode'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
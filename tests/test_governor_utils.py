@@ -0,0 +1,102 @@
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import yara
+from utils import governor_utils, hash_utils, scan_utils, walk_utils
+
+RULE = 'rule marker { strings: $a = "rastrea2r-marker" condition: $a }'
+
+
+class CountingGovernor(governor_utils.Governor):
+    ''' Governor recording the bytes it is paced with instead of sleeping '''
+
+    def __init__(self):
+        super().__init__()
+        self.paced = 0
+
+    def pace(self, nbytes=0, busy=0.0):
+        self.paced += nbytes
+
+
+class GovernorUtilsTestCase(unittest.TestCase):
+    ''' Resource governor test cases '''
+
+    def test_bandwidth(self):
+        ''' check reads beyond the burst are paced to the configured bandwidth '''
+        governor = governor_utils.Governor(bytes_per_second=100000)
+        start = time.monotonic()
+        for _ in range(5):
+            governor.pace(nbytes=50000)
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 2.2)
+        self.assertLess(elapsed, 4.0)
+        self.assertGreater(governor.throttled, 2.0)
+
+    def test_cpu_share(self):
+        ''' check busy time is followed by a proportional sleep '''
+        governor = governor_utils.Governor(cpu_share=0.25)
+        start = time.monotonic()
+        governor.pace(busy=0.1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.29)
+        self.assertIsNone(governor_utils.Governor(cpu_share=1).cpu_share)
+
+    def test_worker_options(self):
+        ''' check worker processes get an equal share of the bandwidth '''
+        governor = governor_utils.Governor(bytes_per_second=1000, nice=10, max_load=2.0)
+        options = governor.options(workers=4)
+        self.assertEqual(options['bytes_per_second'], 250)
+        self.assertEqual(options['nice'], 10)
+        self.assertEqual(governor_utils.Governor(**options).max_load, 2.0)
+
+    def test_every_read_paced(self):
+        ''' check known-good, prefiltered and archive member reads are paced too '''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            good = os.path.join(tmpdir, 'good.bin')
+            with open(good, 'wb') as f:
+                f.write(b'\x01' * 300000)
+            set_path = os.path.join(tmpdir, 'known.bin')
+            hash_utils.write_hash_set([hash_utils.file_sha256(good).hex()], set_path)
+            known_good = hash_utils.KnownGoodSet(set_path)
+            governor = CountingGovernor()
+            scanner = scan_utils.FileScanner(yara.compile(source=RULE), known_good=known_good, governor=governor)
+            self.assertEqual(scanner.scan(good), [(good, [], None)])
+            self.assertEqual(scanner.known_good_hits, 1)
+            self.assertEqual(governor.paced, 300000)
+            known_good.close()
+
+            governor = CountingGovernor()
+            rules = yara.compile(source='rule pe { meta: filetype = "pe" strings: $a = "x" condition: $a }')
+            scanner = scan_utils.FileScanner(rules, governor=governor, prefilter=True)
+            self.assertEqual(scanner.scan(good), [(good, [], None)])
+            self.assertEqual(scanner.prefiltered, 1)
+            self.assertGreater(governor.paced, 0)
+
+            archive = os.path.join(tmpdir, 'members.zip')
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr('inner.txt', b'\0' * 200000 + b'rastrea2r-marker')
+            with open(archive, 'wb') as f:
+                f.write(buffer.getvalue())
+            governor = CountingGovernor()
+            scanner = scan_utils.FileScanner(yara.compile(source=RULE), governor=governor, archive_depth=1)
+            self.assertEqual(len(scanner.scan(archive)), 2)
+            self.assertEqual(governor.paced, os.path.getsize(archive) + 200000 + len('rastrea2r-marker'))
+
+    def test_governed_scan(self):
+        ''' check a governed scan in worker processes finds the same matches '''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for i in range(10):
+                with open(os.path.join(tmpdir, '%d.txt' % i), 'w') as f:
+                    f.write('rastrea2r-marker' if i % 2 else 'benign')
+            governor = governor_utils.Governor(bytes_per_second=10 ** 6, cpu_share=0.5)
+            scanner = scan_utils.FileScanner(yara.compile(source=RULE), governor=governor)
+            matched = [path for path, names, error in
+                       scan_utils.scan_files(scanner, walk_utils.walk_files(tmpdir), workers=2) if names]
+        self.assertEqual(len(matched), 5)
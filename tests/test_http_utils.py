@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import http_utils
+
+
+class LimitedHandler(BaseHTTPRequestHandler):
+    ''' Rate limits the first request with a 429 and Retry-After '''
+
+    requests_seen = 0
+
+    def do_POST(self):
+        LimitedHandler.requests_seen += 1
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(429 if LimitedHandler.requests_seen == 1 else 200)
+        self.send_header('Retry-After', '1')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    ''' Fails the first two requests with a 503 '''
+
+    requests_seen = 0
+    bodies = []
+
+    def do_POST(self):
+        FlakyHandler.requests_seen += 1
+        FlakyHandler.bodies.append(self.rfile.read(int(self.headers['Content-Length'])))
+        self.send_response(503 if FlakyHandler.requests_seen <= 2 else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpUtilsTestCase(unittest.TestCase):
+    ''' Pooled HTTP client test cases '''
+
+    def setUp(self):
+        FlakyHandler.requests_seen = 0
+        FlakyHandler.bodies = []
+        self.server = HTTPServer(('127.0.0.1', 0), FlakyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/results' % self.server.server_port
+        self.backoff, http_utils.backoff = http_utils.backoff, 0.01
+
+    def tearDown(self):
+        http_utils.backoff = self.backoff
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retries_server_errors(self):
+        ''' check 5xx responses are retried and the body is JSON encoded once '''
+        response = http_utils.http_post_request(self.url, body=[{'rulename': 'marker'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(FlakyHandler.requests_seen, 3)
+        self.assertEqual(FlakyHandler.bodies[-1], b'[{"rulename": "marker"}]')
+
+    def test_gives_up(self):
+        ''' check the last 5xx response is returned once retries are exhausted '''
+        response = http_utils.http_post_request(self.url, body='[]', retries=1)
+        self.assertEqual(response.status_code, 503)
+
+    def test_retries_rate_limited(self):
+        ''' check a 429 is retried once its Retry-After has passed '''
+        LimitedHandler.requests_seen = 0
+        server = HTTPServer(('127.0.0.1', 0), LimitedHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            start = time.monotonic()
+            response = http_utils.http_post_request('http://127.0.0.1:%d/results' % server.server_port, body='[]')
+            self.assertEqual(response.status_code, 200)
+            self.assertGreaterEqual(time.monotonic() - start, 1)
+            self.assertEqual(LimitedHandler.requests_seen, 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import psutil
+import yara
+from utils import mem_utils
+
+RULE = 'rule marker { strings: $a = "rastrea2r-memory-marker" condition: $a }'
+
+# Match record of RULE compiled without a namespace
+MARKER = {'rule': 'marker', 'namespace': 'default'}
+
+# Builds the marker at runtime so it is only found in the child's heap
+CHILD = "import sys; marker = '-'.join(['rastrea2r', 'memory', 'marker']); print(flush=True); sys.stdin.read()"
+
+
+class MemUtilsTestCase(unittest.TestCase):
+    ''' Concurrent process memory scan test cases '''
+
+    def setUp(self):
+        self.rules = yara.compile(source=RULE)
+        self.child = subprocess.Popen([sys.executable, '-c', CHILD], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.child.stdout.readline()
+        try:
+            self.rules.match(pid=self.child.pid)
+        except yara.Error as e:
+            self.tearDown()
+            self.skipTest("Cannot read process memory: " + str(e))
+
+    def tearDown(self):
+        self.child.stdin.close()
+        self.child.wait()
+        self.child.stdout.close()
+
+    def test_process_info(self):
+        ''' check process metadata is collected in one pass '''
+        pinfo = mem_utils.process_info(psutil.Process(self.child.pid))
+        self.assertEqual(pinfo['pid'], self.child.pid)
+        self.assertEqual(pinfo['cmdline'][:2], [sys.executable, '-c'])
+
+    def test_concurrent_scan(self):
+        ''' check a concurrent scan finds the child and skips this process '''
+        summary = mem_utils.ScanSummary()
+        pids = {self.child.pid, os.getpid(), os.getppid()}
+        results = list(mem_utils.scan_processes(self.rules, workers=4, timeout=30, summary=summary, pids=pids))
+        matched = [pinfo['pid'] for pinfo, names, region in results if names == [MARKER]]
+
+        self.assertEqual(matched, [self.child.pid])
+        self.assertNotIn(os.getpid(), [pinfo['pid'] for pinfo, names, region in results])
+        self.assertEqual(summary.scanned, len(results))
+        self.assertEqual(summary.matched, len([names for pinfo, names, region in results if names]))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "requires /proc/<pid>/maps")
+    def test_region_scan(self):
+        ''' check a region scan reports the anonymous region holding the marker '''
+        scanner = mem_utils.RegionScanner(self.rules, chunk_size=65536, overlap=64)
+        results = list(mem_utils.scan_processes(self.rules, timeout=30, pids={self.child.pid},
+                                                region_scanner=scanner))
+
+        regions = [region for pinfo, names, region in results if names == [MARKER]]
+        self.assertTrue(regions)
+        for region in regions:
+            self.assertEqual(region['inode'], 0)
+            self.assertLessEqual(region['start'], region['end'])
+
+    def test_region_selection(self):
+        ''' check shared read-only file-backed regions are only selected once '''
+        scanner = mem_utils.RegionScanner(self.rules, perms='x')
+        code = {'start': 0x1000, 'end': 0x3000, 'perms': 'r-xp', 'offset': 0, 'dev': 'fe:00', 'inode': 42,
+                'path': '/usr/lib/libc.so.6'}
+        data = dict(code, perms='rw-p')
+        rodata = dict(code, perms='r--p')
+        heap = dict(code, perms='rw-p', inode=0, path='[heap]')
+
+        self.assertTrue(scanner.selected(code))
+        self.assertFalse(scanner.selected(dict(code, start=0x7000, end=0x9000)))
+        self.assertFalse(scanner.selected(rodata))
+        self.assertFalse(scanner.selected(data))
+        self.assertTrue(scanner.selected(heap))
+        self.assertTrue(scanner.selected(heap))
+        self.assertFalse(scanner.selected(dict(heap, perms='---p')))
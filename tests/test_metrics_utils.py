@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import yara
+from utils import index_utils, metrics_utils, scan_utils, walk_utils
+
+RULE = 'rule marker { strings: $a = "rastrea2r-marker" condition: $a }'
+
+
+class MetricsUtilsTestCase(unittest.TestCase):
+    ''' Run metrics test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tree = os.path.join(self.tmpdir.name, 'tree')
+        os.makedirs(self.tree)
+        for i in range(20):
+            with open(os.path.join(self.tree, '%02d.txt' % i), 'w') as f:
+                f.write('rastrea2r-marker' if i % 5 == 0 else 'benign')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_slowest(self):
+        ''' check only the slowest items are kept, slowest first '''
+        metrics = metrics_utils.RunMetrics('yaradisk', slowest=3)
+        for i in range(10):
+            metrics.observe('files', '/tmp/%d' % i, i / 10.0)
+        slowest = metrics.report()['slowest']['files']
+        self.assertEqual([entry['item'] for entry in slowest], ['/tmp/9', '/tmp/8', '/tmp/7'])
+
+    def test_scan_counters(self):
+        ''' check a scan counts files, matches and cached verdicts and times its phases '''
+        scanner = scan_utils.FileScanner(yara.compile(source=RULE))
+        index = index_utils.FileIndex(os.path.join(self.tmpdir.name, 'index.db'), scanner.fingerprint())
+
+        metrics = metrics_utils.RunMetrics('yaradisk')
+        list(scan_utils.scan_files(scanner, walk_utils.walk_files(self.tree), index=index, metrics=metrics))
+        report = metrics.report()
+        self.assertEqual(report['counters']['files'], 20)
+        self.assertEqual(report['counters']['scanned'], 20)
+        self.assertEqual(report['counters']['matches'], 4)
+        self.assertEqual(report['counters']['bytes'], 4 * 16 + 16 * 6)
+        self.assertIn('walk', report['phases'])
+        self.assertIn('match', report['phases'])
+        self.assertEqual(len(report['slowest']['files']), metrics_utils.SLOWEST)
+
+        metrics = metrics_utils.RunMetrics('yaradisk')
+        list(scan_utils.scan_files(scanner, walk_utils.walk_files(self.tree), workers=2, index=index,
+                                   metrics=metrics))
+        index.close()
+        self.assertEqual(metrics.report()['counters']['cached'], 20)
+        self.assertNotIn('scanned', metrics.report()['counters'])
+
+    def test_write_reports(self):
+        ''' check the JSON report and a Prometheus textfile readable by other users are written '''
+        metrics = metrics_utils.RunMetrics('yaramem')
+        with metrics.phase('match'):
+            metrics.count('scanned', 3)
+        report_path = os.path.join(self.tmpdir.name, 'reports', 'yaramem.json')
+        prometheus_path = os.path.join(self.tmpdir.name, 'rastrea2r.prom')
+        metrics_utils.write_reports(metrics, report_path, prometheus_path)
+
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(report['module'], 'yaramem')
+        self.assertEqual(report['counters'], {'scanned': 3})
+
+        with open(prometheus_path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE rastrea2r_phase_seconds gauge', lines)
+        self.assertTrue(any(line.startswith('rastrea2r_items{module="yaramem",') and line.endswith('"scanned"} 3')
+                            for line in lines))
+        if os.name == 'posix':
+            self.assertEqual(os.stat(prometheus_path).st_mode & 0o777, 0o644)
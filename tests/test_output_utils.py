@@ -0,0 +1,97 @@
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import output_utils
+
+# Prints 3 MB in several writes, more than a block and a chunk
+CHILD = "import sys\nfor i in range(3):\n    sys.stdout.buffer.write(bytes([65 + i]) * 1048576)"
+
+# Starts a child sharing its standard output, then both sleep
+PARENT = ("import subprocess, sys, time\n"
+          "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+          "print('started', flush=True)\ntime.sleep(30)")
+
+
+class OutputUtilsTestCase(unittest.TestCase):
+    ''' Hash-while-writing artifact output test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(300000)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_writer_digests(self):
+        ''' check the digests of a writer match those of the whole file written '''
+        path = os.path.join(self.tmpdir.name, 'artifact.bin')
+        with output_utils.ArtifactWriter(path, ('md5', 'sha1')) as writer:
+            for offset in range(0, len(self.data), 65536):
+                writer.write(self.data[offset:offset + 65536])
+
+        with open(path, 'rb') as f:
+            written = f.read()
+        self.assertEqual(written, self.data)
+        self.assertEqual(writer.size, len(self.data))
+        self.assertEqual(writer.digests(), {'sha256': hashlib.sha256(self.data).hexdigest(),
+                                            'md5': hashlib.md5(self.data).hexdigest(),
+                                            'sha1': hashlib.sha1(self.data).hexdigest()})
+        self.assertEqual(list(writer.digests()), ['sha256', 'md5', 'sha1'])
+
+    def test_file_digests(self):
+        ''' check a file is hashed whole, beyond its first block '''
+        path = os.path.join(self.tmpdir.name, 'tool-output.zip')
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+        self.assertEqual(output_utils.file_digests(path), {'sha256': hashlib.sha256(self.data).hexdigest()})
+        self.assertEqual(output_utils.file_digests(path, ['sha1'])['sha1'], hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(output_utils.digests(self.data, ['md5']), output_utils.file_digests(path, ['md5']))
+
+    def test_run_command(self):
+        ''' check the output of a command is streamed into the writer and hashed '''
+        path = os.path.join(self.tmpdir.name, 'command.log')
+        with output_utils.ArtifactWriter(path) as writer:
+            status = output_utils.run_command([sys.executable, '-c', CHILD], writer, chunk_size=65536)
+
+        expected = b'A' * 1048576 + b'B' * 1048576 + b'C' * 1048576
+        self.assertEqual(status, 0)
+        self.assertEqual(writer.digests()['sha256'], hashlib.sha256(expected).hexdigest())
+        self.assertEqual(os.path.getsize(path), len(expected))
+
+    def test_run_command_timeout(self):
+        ''' check a timed out command is killed with the child holding its output open '''
+        path = os.path.join(self.tmpdir.name, 'command.log')
+        start = time.monotonic()
+        with output_utils.ArtifactWriter(path) as writer:
+            self.assertRaises(subprocess.TimeoutExpired, output_utils.run_command,
+                              [sys.executable, '-c', PARENT], writer, timeout=1)
+
+        self.assertLess(time.monotonic() - start, 10)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read().split(), [b'started'])
+
+    def test_hash_log(self):
+        ''' check the hashing log keeps its entries and is rewritten without leftovers '''
+        path = os.path.join(self.tmpdir.name, 'sha256-hashing.log')
+        with open(path, 'w') as f:
+            f.write("earlier.log - 00 \n\n")
+
+        hash_log = output_utils.HashLog(path)
+        hash_log.add('one.log', {'sha256': 'aa'})
+        hash_log.add('two.log', {'sha256': 'bb', 'md5': 'cc'})
+
+        with open(path) as f:
+            self.assertEqual(f.read(), "earlier.log - 00 \n\none.log - aa \n\ntwo.log - bb md5:cc \n\n")
+        self.assertEqual(os.listdir(self.tmpdir.name), ['sha256-hashing.log'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import csv
+import io
+import json
+import os
+import random
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import prefetch_utils
+
+# FILETIMEs of 2020-01-01 and 2021-06-15 12:30 UTC
+FILETIME_2020 = 132223104000000000
+FILETIME_2021 = 132682338000000000
+
+# Offset of the file metrics of each fixture version, just after its file information
+METRICS_OFFSETS = {17: 152, 23: 240, 26: 304, 30: 304, 31: 304}
+
+FILES = ['\\VOLUME{01d5a1b2c3d4e5f6-12345678}\\WINDOWS\\SYSTEM32\\NTDLL.DLL',
+         '\\VOLUME{01d5a1b2c3d4e5f6-12345678}\\WINDOWS\\SYSTEM32\\KERNEL32.DLL',
+         '\\VOLUME{01d5a1b2c3d4e5f6-12345678}\\WINDOWS\\SYSTEM32\\CMD.EXE']
+DIRECTORIES = ['\\VOLUME{01d5a1b2c3d4e5f6-12345678}\\WINDOWS',
+               '\\VOLUME{01d5a1b2c3d4e5f6-12345678}\\WINDOWS\\SYSTEM32']
+DEVICE_PATH = '\\VOLUME{01d5a1b2c3d4e5f6-12345678}'
+
+
+def _utf16(text):
+    return text.encode('utf-16-le')
+
+
+def build_prefetch(version, executable='CMD.EXE', prefetch_hash=0x4A81B7E1, run_count=42, run_times=(),
+                   short=False):
+    """ Returns an uncompressed prefetch file of the given format version listing FILES and DIRECTORIES """
+
+    layout = prefetch_utils.LAYOUTS[version]
+    metrics_offset = prefetch_utils.SHORT_METRICS_OFFSET if short else METRICS_OFFSETS[version]
+    metrics_entry = layout['metrics_entry']
+
+    strings = b''
+    metrics = b''
+    for name in FILES:
+        if version == 17:
+            metrics += struct.pack('<5I', 0, 0, len(strings), len(name), 0)
+        else:
+            metrics += struct.pack('<6IQ', 0, 0, 0, len(strings), len(name), 0, 0)
+        strings += _utf16(name) + b'\x00\x00'
+    strings_offset = metrics_offset + len(FILES) * metrics_entry
+
+    # Volume entry, then its device path and directory strings
+    volumes_offset = strings_offset + len(strings)
+    path_offset = layout['volume_entry']
+    directories_offset = path_offset + len(_utf16(DEVICE_PATH)) + 2
+    directory_strings = b''.join(struct.pack('<H', len(name)) + _utf16(name) + b'\x00\x00' for name in DIRECTORIES)
+    volume = struct.pack('<2IQ5I', path_offset, len(DEVICE_PATH), FILETIME_2020, 0xDEADBEEF, 0, 0,
+                         directories_offset, len(DIRECTORIES))
+    volume = volume.ljust(layout['volume_entry'], b'\x00') + _utf16(DEVICE_PATH) + b'\x00\x00' + directory_strings
+
+    data = bytearray(metrics_offset)
+    data[0:8] = struct.pack('<I', version) + b'SCCA'
+    data[16:76] = _utf16(executable).ljust(60, b'\x00')
+    data[76:80] = struct.pack('<I', prefetch_hash)
+    data[84:120] = struct.pack('<9I', metrics_offset, len(FILES), volumes_offset, 0, strings_offset, len(strings),
+                               volumes_offset, 1, len(volume))
+    times = list(run_times)[:layout['run_times']]
+    times += [0] * (layout['run_times'] - len(times))
+    struct.pack_into('<%dQ' % layout['run_times'], data, layout['last_run'], *times)
+    struct.pack_into('<I', data, layout['run_count'] - (8 if short else 0), run_count)
+    data += metrics + strings + volume
+    struct.pack_into('<I', data, 12, len(data))
+    return bytes(data)
+
+
+def xpress_huffman(data):
+    """ Returns data compressed to LZXPRESS Huffman, every code 9 bits long
+
+    A complete code with all 512 symbols of the same length is the simplest
+    valid table, the codes then being the symbols themselves. Matches are
+    found greedily on 3 byte prefixes.
+    """
+
+    out = bytearray()
+    last = {}
+    for block_start in range(0, len(data), prefetch_utils.HUFFMAN_BLOCK_SIZE):
+        block_end = min(block_start + prefetch_utils.HUFFMAN_BLOCK_SIZE, len(data))
+        events = []
+        i = block_start
+        while i < block_end:
+            key = data[i:i + 3]
+            j = last.get(key)
+            length = 0
+            if len(key) == 3 and j is not None and i - j < 65536:
+                while i + length < block_end and data[j + length] == data[i + length]:
+                    length += 1
+            if length < 3:
+                last[key] = i
+                events.append((data[i], 9))
+                i += 1
+                continue
+
+            offset_bits = (i - j).bit_length() - 1
+            events.append((256 + (offset_bits << 4) + min(length - 3, 15), 9))
+            if length - 18 >= 255:
+                events.append(b'\xff' + struct.pack('<H', length - 3))
+            elif length - 18 >= 0:
+                events.append(bytes([length - 18]))
+            events.append((i - j - (1 << offset_bits), offset_bits))
+            for k in range(i, i + length):
+                last[data[k:k + 3]] = k
+            i += length
+        if block_end == len(data):
+            events.append((256, 9))
+
+        # Words are placed where the decoder reads them: two first, then one each time it has used up 16 bits
+        chunks = [0, 1]
+        used = 0
+        words = 2
+        bits = []
+        for event in events:
+            if isinstance(event, bytes):
+                chunks.append(event)
+                continue
+            value, count = event
+            bits.append(format(value, '0%db' % count) if count else '')
+            used += count
+            if used > 16 * (words - 1):
+                chunks.append(words)
+                words += 1
+        bits = ''.join(bits).ljust(16 * words, '0')
+
+        out += b'\x99' * 256
+        for chunk in chunks:
+            out += chunk if isinstance(chunk, bytes) else struct.pack('<H', int(bits[16 * chunk:16 * chunk + 16], 2))
+    return bytes(out)
+
+
+def build_mam(data, crc=False):
+    """ Returns data compressed as a Windows 10 MAM prefetch file """
+
+    header = b'MAM' + bytes([prefetch_utils.XPRESS_HUFF | (0x80 if crc else 0)]) + struct.pack('<I', len(data))
+    return header + (b'\x00' * 4 if crc else b'') + xpress_huffman(data)
+
+
+class PrefetchUtilsTestCase(unittest.TestCase):
+    ''' Native prefetch parser test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, data):
+        with open(os.path.join(self.tmpdir.name, name), 'wb') as f:
+            f.write(data)
+
+    def test_decompress(self):
+        ''' check literals, short, long and overlapping matches decompress across several blocks '''
+        rand = random.Random(7)
+        data = bytes(rand.getrandbits(8) for _ in range(20000)) + b'\x00' * 70000 + b'prefetch ' * 3000
+        data += bytes(rand.getrandbits(8) for _ in range(300)) * 40
+
+        self.assertEqual(prefetch_utils.xpress_huffman_decompress(xpress_huffman(data), len(data)), data)
+        self.assertEqual(prefetch_utils.decompress_mam(build_mam(data, crc=True)), data)
+        self.assertRaises(prefetch_utils.PrefetchError, prefetch_utils.decompress_mam, b'MAM\x02' + bytes(300))
+        self.assertRaises(prefetch_utils.PrefetchError, prefetch_utils.decompress_mam, build_mam(data)[:5000])
+
+    def test_parse_versions(self):
+        ''' check every format version is parsed to the same record '''
+        for version, short in ((17, False), (23, False), (26, False), (30, False), (30, True), (31, False)):
+            record = prefetch_utils.parse_prefetch(build_prefetch(version, run_times=[FILETIME_2021, FILETIME_2020],
+                                                                  short=short))
+
+            self.assertEqual(record['version'], version)
+            self.assertEqual(record['executable'], 'CMD.EXE')
+            self.assertEqual(record['prefetch_hash'], '4A81B7E1')
+            self.assertEqual(record['run_count'], 42)
+            self.assertEqual(record['last_run'], '2021-06-15T12:30:00+00:00')
+            self.assertEqual(record['last_run_times'], ['2021-06-15T12:30:00+00:00', '2020-01-01T00:00:00+00:00']
+                             if version >= 26 else ['2021-06-15T12:30:00+00:00'])
+            self.assertEqual(record['files'], FILES)
+            self.assertEqual(record['process_path'], FILES[2])
+            self.assertEqual(record['directories'], DIRECTORIES)
+            self.assertEqual(record['volumes'], [{'device_path': DEVICE_PATH, 'serial': 'DEADBEEF',
+                                                  'created': '2020-01-01T00:00:00+00:00'}])
+            self.assertFalse(record['compressed'])
+
+    def test_compressed(self):
+        ''' check a MAM compressed file gives the record of its decompressed data '''
+        data = build_prefetch(30, run_times=[FILETIME_2021])
+        record = prefetch_utils.parse_prefetch(build_mam(data))
+
+        self.assertTrue(record.pop('compressed'))
+        expected = prefetch_utils.parse_prefetch(data)
+        del expected['compressed']
+        self.assertEqual(record, expected)
+
+        for corrupt in (b'SCCA' * 30, data[:100], build_prefetch(30)[:4] + b'XXXX' + data[8:],
+                        struct.pack('<I', 99) + data[4:]):
+            self.assertRaises(prefetch_utils.PrefetchError, prefetch_utils.parse_prefetch, corrupt)
+
+    def test_parse_directory(self):
+        ''' check a directory is parsed in parallel in name order, unreadable files reporting their error '''
+        for i in range(20):
+            data = build_prefetch(30, executable='TOOL%02d.EXE' % i, run_count=i, run_times=[FILETIME_2021])
+            self.write('TOOL%02d.EXE-%08X.pf' % (i, i), build_mam(data) if i % 2 else data)
+        self.write('BROKEN.EXE-00000000.pf', b'MAM\x04' + bytes(40))
+        self.write('Layout.ini', b'not prefetch')
+
+        records = list(prefetch_utils.parse_directory(self.tmpdir.name, workers=3))
+        self.assertEqual(records, list(prefetch_utils.parse_directory(self.tmpdir.name, workers=1)))
+        self.assertEqual(len(records), 21)
+        self.assertEqual(records[0]['filename'], os.path.join(self.tmpdir.name, 'BROKEN.EXE-00000000.pf'))
+        self.assertEqual(set(records[0]), {'filename', 'error'})
+        self.assertEqual([record['run_count'] for record in records[1:]], list(range(20)))
+        self.assertEqual([record['compressed'] for record in records[1:3]], [False, True])
+
+    def test_write_records(self):
+        ''' check records are written as CSV rows and NDJSON lines '''
+        records = [dict(prefetch_utils.parse_prefetch(build_prefetch(26, run_times=[FILETIME_2021, FILETIME_2020])),
+                        filename='CMD.EXE-4A81B7E1.pf'),
+                   {'filename': 'BROKEN.pf', 'error': 'Not a prefetch file'}]
+
+        output = io.BytesIO()
+        self.assertEqual(prefetch_utils.write_records(records, output, 'csv'), 2)
+        rows = list(csv.DictReader(io.StringIO(output.getvalue().decode('utf-8'))))
+        self.assertEqual(rows[0]['executable'], 'CMD.EXE')
+        self.assertEqual(rows[0]['last_run_times'], '2021-06-15T12:30:00+00:00; 2020-01-01T00:00:00+00:00')
+        self.assertEqual(rows[0]['files'], '; '.join(FILES))
+        self.assertEqual(rows[0]['volumes'], DEVICE_PATH + ' (serial DEADBEEF, created 2020-01-01T00:00:00+00:00)')
+        self.assertEqual((rows[1]['filename'], rows[1]['error'], rows[1]['run_count']),
+                         ('BROKEN.pf', 'Not a prefetch file', ''))
+
+        output = io.BytesIO()
+        prefetch_utils.write_records(records, output, 'ndjson')
+        self.assertEqual([json.loads(line) for line in output.getvalue().decode('utf-8').splitlines()], records)
+        self.assertRaises(ValueError, prefetch_utils.write_records, records, io.BytesIO(), 'xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
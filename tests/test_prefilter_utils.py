@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import yara
+from utils import metrics_utils, prefilter_utils, scan_utils, walk_utils
+
+RULES = '''
+rule pe_marker : pe { strings: $a = "rastrea2r-marker" condition: $a }
+rule script_marker { meta: filetype = "script, document" max_filesize = 1024 strings: $a = "rastrea2r-marker"
+                     condition: $a }
+'''
+
+
+class PrefilterUtilsTestCase(unittest.TestCase):
+    ''' Header-based prefilter test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = {'tool.bin': b'MZ\x90\x00 rastrea2r-marker',
+                      'run.sh': b'#!/bin/sh\necho rastrea2r-marker\n',
+                      'big.ps1': b'rastrea2r-marker' + b' ' * 2048,
+                      'photo.jpg': b'\xff\xd8\xff\xe0 rastrea2r-marker',
+                      'app.log': b'INFO rastrea2r-marker\n',
+                      'docs.zip': b'PK\x03\x04 rastrea2r-marker'}
+        for name, data in self.files.items():
+            with open(os.path.join(self.tmpdir.name, name), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_classify(self):
+        ''' check files are classified by magic and extension '''
+        self.assertEqual(prefilter_utils.classify(b'MZ\x90\x00', 'a.dll'), {'pe'})
+        self.assertEqual(prefilter_utils.classify(b'PK\x03\x04', 'report.docx'), {'archive', 'document'})
+        self.assertEqual(prefilter_utils.classify(b'hello', 'notes'), {'text'})
+        self.assertEqual(prefilter_utils.classify(b'\x00\x01', 'blob'), {'data'})
+
+    def test_undeclared_rules(self):
+        ''' check rules without file types or sizes disable the prefilter '''
+        rules = yara.compile(source=RULES + 'rule any_marker { strings: $a = "x" condition: $a }')
+        self.assertIsNone(prefilter_utils.Prefilter.from_rules(rules))
+
+    def test_unknown_file_type(self):
+        ''' check a filetype meta naming no known type does not constrain the rule '''
+        rules = yara.compile(source='rule exe_marker { meta: filetype = "exe" strings: $a = "rastrea2r-marker" '
+                                    'condition: $a }')
+        with self.assertLogs(prefilter_utils.logger, 'WARNING'):
+            self.assertEqual(prefilter_utils.rule_constraint(next(iter(rules))), (None, None))
+        self.assertIsNone(prefilter_utils.Prefilter.from_rules(rules))
+
+        path = os.path.join(self.tmpdir.name, 'x.exe')
+        with open(path, 'wb') as f:
+            f.write(b'MZ\x90\x00 rastrea2r-marker')
+        scanner = scan_utils.FileScanner(rules, prefilter=True)
+        self.assertEqual([match['rule'] for match in scanner.scan(path)[0][1]], ['exe_marker'])
+
+        rules = yara.compile(source='rule marker { meta: filetype = "exe, pe" condition: true }')
+        self.assertEqual(prefilter_utils.rule_constraint(next(iter(rules)))[0], frozenset(['pe']))
+
+    def test_scan_skips(self):
+        ''' check only the files some rule targets are matched, and skips are counted '''
+        scanner = scan_utils.FileScanner(yara.compile(source=RULES), prefilter=True)
+        metrics = metrics_utils.RunMetrics('yaradisk')
+        matched = sorted(os.path.basename(path) for path, names, error in
+                         scan_utils.scan_files(scanner, walk_utils.walk_files(self.tmpdir.name), metrics=metrics)
+                         if names)
+        self.assertEqual(matched, ['run.sh', 'tool.bin'])
+        self.assertEqual(metrics.report()['counters']['prefiltered'], 4)
+
+        scanner = scan_utils.FileScanner(yara.compile(source=RULES), prefilter=True, archive_depth=1)
+        self.assertTrue(scanner.prefilter.wanted(os.path.join(self.tmpdir.name, 'docs.zip'), 100))
+        self.assertNotEqual(scanner.fingerprint(), scan_utils.FileScanner(yara.compile(source=RULES)).fingerprint())
@@ -0,0 +1,131 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import http_utils, rule_utils
+
+RULE = 'rule marker { strings: $a = "rastrea2r-marker" condition: $a }'
+
+
+class RuleHandler(BaseHTTPRequestHandler):
+    ''' Serves RULE with an ETag and counts full responses '''
+
+    full_responses = 0
+    # When set, bundles that cannot be loaded are offered to clients accepting them
+    bundles = False
+    accepts = []
+
+    def do_GET(self):
+        RuleHandler.accepts.append(self.headers.get('Accept'))
+        if RuleHandler.bundles and rule_utils.COMPILED_RULES_TYPE in self.headers.get('Accept', ''):
+            if self.headers.get('If-None-Match') == '"v1-yarc"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', '"v1-yarc"')
+            self.send_header('Content-Type', rule_utils.COMPILED_RULES_TYPE)
+            self.send_header('Content-Length', '16')
+            self.end_headers()
+            self.wfile.write(b'not a yara build')
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        RuleHandler.full_responses += 1
+        body = RULE.encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RuleUtilsTestCase(unittest.TestCase):
+    ''' Compiled rule cache test cases '''
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.server = HTTPServer(('127.0.0.1', 0), RuleHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/rule?rulename=marker' % self.server.server_port
+        RuleHandler.full_responses = 0
+        RuleHandler.bundles = False
+        RuleHandler.accepts = []
+
+    def tearDown(self):
+        self.stop_server()
+        self.cache_dir.cleanup()
+
+    def stop_server(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def test_warm_run_revalidates(self):
+        ''' check a second load is served from the cache after a 304 '''
+        for _ in range(2):
+            rules = rule_utils.load_rules(self.url, 'marker', self.cache_dir.name)
+            self.assertTrue(rules.match(data=b'rastrea2r-marker'))
+        self.assertEqual(RuleHandler.full_responses, 1)
+        self.assertEqual(len([f for f in os.listdir(self.cache_dir.name) if f.endswith('.yarc')]), 1)
+
+    def test_rejected_bundle_not_asked_again(self):
+        ''' check the source alone is asked for once a bundle could not be loaded '''
+        RuleHandler.bundles = True
+        for _ in range(2):
+            rules = rule_utils.load_rules(self.url, 'marker', self.cache_dir.name)
+            self.assertTrue(rules.match(data=b'rastrea2r-marker'))
+
+        self.assertEqual(RuleHandler.full_responses, 1)
+        self.assertEqual(RuleHandler.accepts, [rule_utils.COMPILED_RULES_TYPE + ', text/plain', 'text/plain',
+                                               'text/plain'])
+
+    def test_stale_removal_keeps_other_rules(self):
+        ''' check refreshing a rule leaves the cache of rules whose names start with its own alone '''
+        other = os.path.join(self.cache_dir.name, 'marker-extra-' + 'a' * 64 + '.yarc')
+        stale = os.path.join(self.cache_dir.name, 'marker-' + 'b' * 64 + '.yarc')
+        for path in (other, stale):
+            with open(path, 'wb') as f:
+                f.write(b'cached')
+
+        rule_utils.load_rules(self.url, 'marker', self.cache_dir.name)
+        self.assertTrue(os.path.exists(other))
+        self.assertFalse(os.path.exists(stale))
+
+    def test_offline_uses_cache(self):
+        ''' check the cached rules are used when the server is unreachable '''
+        rule_utils.load_rules(self.url, 'marker', self.cache_dir.name)
+        self.stop_server()
+        retries, http_utils.retries = http_utils.retries, 0
+        try:
+            rules = rule_utils.load_rules(self.url, 'marker', self.cache_dir.name)
+        finally:
+            http_utils.retries = retries
+        self.assertTrue(rules.match(data=b'rastrea2r-marker'))
+
+    def test_rule_sets(self):
+        ''' check several rule sets are compiled once into one namespace each '''
+        rule_urls = [(name, self.url.replace('marker', name)) for name in ('first', 'second')]
+        for _ in range(2):
+            rules = rule_utils.load_rule_sets(rule_urls, self.cache_dir.name)
+            self.assertEqual(sorted(match.namespace for match in rules.match(data=b'rastrea2r-marker')),
+                             ['first', 'second'])
+        self.assertEqual(RuleHandler.full_responses, 2)
+        info = rule_utils.rule_info(self.cache_dir.name, rule_utils.rule_set_name(['first', 'second']))
+        self.assertEqual(info['max_string_length'], 2 * len('rastrea2r-marker'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+import gzip
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import yara
+from utils import hash_utils, index_utils, scan_utils, walk_utils
+
+RULE = 'rule marker { strings: $a = "rastrea2r-marker" condition: $a }'
+
+# Match record of RULE compiled without a namespace
+MARKER = {'rule': 'marker', 'namespace': 'default'}
+
+
+class ScanUtilsTestCase(unittest.TestCase):
+    ''' Shared yara scanning helper test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.rules = yara.compile(source=RULE)
+        self.scanner = scan_utils.FileScanner(self.rules)
+        for i in range(200):
+            with open(os.path.join(self.tmpdir.name, '%03d.txt' % i), 'w') as f:
+                f.write('rastrea2r-marker' if i % 7 == 0 else 'benign')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_rules_roundtrip(self):
+        ''' check serialized rules still match after loading '''
+        rules = scan_utils.rules_from_bytes(scan_utils.rules_to_bytes(self.rules))
+        self.assertTrue(rules.match(data=b'xx rastrea2r-marker xx'))
+
+    def test_parallel_matches_serial(self):
+        ''' check a worker pool yields the same results in the same order '''
+        paths = sorted(path for path, st in walk_utils.walk_files(self.tmpdir.name))
+        serial = [results[0] for results in scan_utils.match_files(self.scanner, paths)]
+        parallel = [results[0] for results in scan_utils.match_files(self.scanner, iter(paths), workers=3, queue_size=2)]
+        self.assertEqual(serial, parallel)
+        self.assertEqual(sum(1 for _, matches, _ in serial if matches == [MARKER]), 29)
+
+    def test_index_skips_unchanged(self):
+        ''' check a second indexed scan only reads modified files '''
+        db_path = os.path.join(self.tmpdir.name, 'index', 'index.db')
+        files = sorted(walk_utils.walk_files(self.tmpdir.name))
+        paths = [path for path, st in files]
+        index = index_utils.FileIndex(db_path, scan_utils.rules_hash(self.rules))
+        first = list(scan_utils.scan_files(self.scanner, files, index=index))
+        index.close()
+        self.assertEqual(len(first), 200)
+
+        with open(paths[1], 'a') as f:
+            f.write(' rastrea2r-marker')
+
+        files = sorted(walk_utils.walk_files(self.tmpdir.name))
+        files = [(path, st) for path, st in files if path in paths]
+        index = index_utils.FileIndex(db_path, scan_utils.rules_hash(self.rules))
+        second = list(scan_utils.scan_files(self.scanner, files, index=index))
+        full = list(scan_utils.scan_files(self.scanner, files, index=index, full=True))
+        index.close()
+        # 1 modified file scanned plus the 29 cached matches
+        self.assertEqual(len(second), 30)
+        self.assertEqual(sum(1 for _, matches, _ in second if matches), 30)
+        self.assertEqual(len(full), 200)
+
+    def test_walk_skips_excluded_and_special_files(self):
+        ''' check the walker honours excludes, max_size and skips FIFOs and symlinks '''
+        os.makedirs(os.path.join(self.tmpdir.name, 'cache', 'deep'))
+        with open(os.path.join(self.tmpdir.name, 'cache', 'deep', 'x.txt'), 'w') as f:
+            f.write('x')
+        with open(os.path.join(self.tmpdir.name, 'big.bin'), 'wb') as f:
+            f.write(b'0' * 4096)
+        os.mkfifo(os.path.join(self.tmpdir.name, 'fifo'))
+        os.symlink('000.txt', os.path.join(self.tmpdir.name, 'link.txt'))
+
+        names = {os.path.basename(path) for path, st in walk_utils.walk_files(self.tmpdir.name)}
+        self.assertEqual(len(names), 202)
+        self.assertNotIn('fifo', names)
+        self.assertNotIn('link.txt', names)
+
+        names = {os.path.basename(path) for path, st in
+                 walk_utils.walk_files(self.tmpdir.name, excludes=['cache', '*/1??.txt'], max_size=1024)}
+        self.assertEqual(len(names), 100)
+
+    def test_known_good_skipped(self):
+        ''' check files in the known-good set are never matched '''
+        set_path = os.path.join(self.tmpdir.name, 'known.bin')
+        good = os.path.join(self.tmpdir.name, '000.txt')
+        hash_utils.write_hash_set([hash_utils.file_sha256(good).hex(), '00' * 32, 'ff' * 32], set_path)
+        known_good = hash_utils.KnownGoodSet(set_path)
+        self.assertEqual(len(known_good), 3)
+        self.assertIn(b'\x00' * 32, known_good)
+        self.assertNotIn(b'\x01' * 32, known_good)
+
+        other = os.path.join(self.tmpdir.name, 'other.txt')
+        with open(other, 'w') as f:
+            f.write('another rastrea2r-marker')
+        scanner = scan_utils.FileScanner(self.rules, known_good=known_good)
+        paths = [good, other]
+        self.assertEqual([matches for _, matches, _ in scan_utils.scan_files(scanner, [(p, None) for p in paths])],
+                         [[], [MARKER]])
+        self.assertEqual([results[0][1] for results in scan_utils.match_files(scanner, paths, workers=2)],
+                         [[], [MARKER]])
+        known_good.close()
+
+    def test_large_file_windows(self):
+        ''' check strings across window boundaries are found and the byte budget is honoured '''
+        path = os.path.join(self.tmpdir.name, 'large.bin')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * (3 * 65536 - 8) + b'rastrea2r-marker' + b'\0' * 65536)
+
+        for window_workers in (1, 3):
+            scanner = scan_utils.FileScanner(self.rules, large_file_size=1024, window_size=65536 + 64, overlap=64,
+                                             window_workers=window_workers)
+            self.assertEqual(scanner.scan(path), [(path, [MARKER], None)])
+
+        scanner = scan_utils.FileScanner(self.rules, large_file_size=1024, window_size=65536 + 64, overlap=64,
+                                         byte_budget=2 * 65536)
+        self.assertEqual(scanner.scan(path), [(path, [], None)])
+
+    def test_small_window_keeps_overlap(self):
+        ''' check a window smaller than twice the overlap is enlarged, not the overlap shortened '''
+        marker = ''.join(chr(ord('a') + i % 26) for i in range(5000))
+        rules = yara.compile(source='rule long { strings: $a = "%s" condition: $a }' % marker)
+        path = os.path.join(self.tmpdir.name, 'large.bin')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 10000 + marker.encode('ascii') + b'\0' * 20000)
+
+        with self.assertLogs(scan_utils.logger, 'WARNING'):
+            scanner = scan_utils.FileScanner(rules, large_file_size=1024, window_size=4096, overlap=5000)
+        self.assertEqual(scanner.overlap, 5000)
+        self.assertGreaterEqual(scanner.window_size, 2 * scanner.overlap)
+        self.assertEqual([match['rule'] for match in scanner.scan(path)[0][1]], ['long'])
+
+    def test_string_offsets(self):
+        ''' check match records carry the file offsets of the matched strings, across windows too '''
+        path = os.path.join(self.tmpdir.name, 'large.bin')
+        offsets = [3 * 65536 - 8, 4 * 65536 + 100]
+        with open(path, 'wb') as f:
+            for offset in offsets:
+                f.write(b'\0' * (offset - f.tell()) + b'rastrea2r-marker')
+            f.write(b'\0' * 65536)
+
+        expected = dict(MARKER, strings={'$a': offsets})
+        scanner = scan_utils.FileScanner(self.rules, strings=True)
+        self.assertEqual(scanner.scan(path), [(path, [expected], None)])
+        scanner = scan_utils.FileScanner(self.rules, large_file_size=1024, window_size=65536 + 64, overlap=64,
+                                         strings=True)
+        self.assertEqual(scanner.scan(path), [(path, [expected], None)])
+
+    def test_archive_members(self):
+        ''' check members of nested archives are matched and reported by path '''
+        payload = b'\0' * 100000 + b'rastrea2r-marker'
+        tar_buf = io.BytesIO()
+        with tarfile.open(fileobj=tar_buf, mode='w:gz') as archive:
+            info = tarfile.TarInfo('inner/evil.bin')
+            info.size = len(payload)
+            archive.addfile(info, io.BytesIO(payload))
+
+        path = os.path.join(self.tmpdir.name, 'outer.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('docs/clean.txt', 'benign')
+            archive.writestr('docs/bundle.tgz', tar_buf.getvalue())
+        with gzip.open(os.path.join(self.tmpdir.name, 'log.gz'), 'wb') as f:
+            f.write(payload)
+
+        scanner = scan_utils.FileScanner(self.rules, overlap=64, archive_depth=3, archive_memory=4096)
+        self.assertEqual(scanner.scan(path), [(path, [], None),
+                                              (path + '!docs/bundle.tgz!inner/evil.bin', [MARKER], None)])
+        gz_path = os.path.join(self.tmpdir.name, 'log.gz')
+        self.assertEqual(scanner.scan(gz_path)[1], (gz_path + '!log', [MARKER], None))
+
+        shallow = scan_utils.FileScanner(self.rules, archive_depth=1)
+        self.assertEqual(shallow.scan(path), [(path, [], None)])
+
+        db_path = os.path.join(self.tmpdir.name, 'index.db')
+        files = [(p, os.stat(p)) for p in (path, gz_path)]
+        for _ in range(2):
+            index = index_utils.FileIndex(db_path, scanner.fingerprint())
+            results = list(scan_utils.scan_files(scanner, files, index=index))
+            index.close()
+            self.assertEqual([p for p, matches, _ in results if matches],
+                             [path + '!docs/bundle.tgz!inner/evil.bin', gz_path + '!log'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'rastrea2r', 'server'))
+
+from requests.auth import HTTPBasicAuth
+from rastrea2r import API_VERSION, AUTH_USER, AUTH_PASSWD
+from utils import http_utils, rule_utils, upload_utils
+import rastrea2r_server
+
+RULE = 'rule marker { strings: $a = "rastrea2r-marker" condition: $a }'
+
+
+class ServerTestCase(unittest.TestCase):
+    ''' Reference server test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.rules_dir = os.path.join(self.tmpdir.name, 'rules')
+        os.makedirs(self.rules_dir)
+        with open(os.path.join(self.rules_dir, 'marker.yar'), 'w') as f:
+            f.write(RULE)
+        self.server = None
+        self.auth = HTTPBasicAuth(AUTH_USER, AUTH_PASSWD)
+
+    def tearDown(self):
+        self.stop_server()
+        self.tmpdir.cleanup()
+
+    def start_server(self, **kwargs):
+        self.server = rastrea2r_server.Rastrea2rServer(('127.0.0.1', 0), self.rules_dir,
+                                                       os.path.join(self.tmpdir.name, 'knowngood'),
+                                                       os.path.join(self.tmpdir.name, 'results.db'), **kwargs)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d%s' % (self.server.server_port, API_VERSION)
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def test_rule_bundle(self):
+        ''' check rules are served as precompiled bundles and revalidated with ETags '''
+        self.start_server()
+        cache_dir = os.path.join(self.tmpdir.name, 'cache')
+        rules = rule_utils.load_rules(self.url + '/rule?rulename=marker', 'marker', cache_dir, auth=self.auth)
+        self.assertTrue(rules.match(data=b'xx rastrea2r-marker xx'))
+        info = rule_utils.rule_info(cache_dir, 'marker')
+        self.assertTrue(info['etag'].endswith('-yarc"'))
+        self.assertEqual(info['max_string_length'], 2 * len('rastrea2r-marker'))
+
+        response = http_utils.http_get_response(self.url + '/rule?rulename=marker', auth=self.auth,
+                                                headers={'If-None-Match': info['etag'],
+                                                         'Accept': rule_utils.COMPILED_RULES_TYPE})
+        self.assertEqual(response.status_code, 304)
+        response = http_utils.http_get_response(self.url + '/rule?rulename=marker', auth=self.auth)
+        self.assertEqual(response.text, RULE)
+        response = http_utils.http_get_response(self.url + '/rule?rulename=../marker', auth=self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    def test_rule_compile_failure_cached(self):
+        ''' check a bundle is compiled without the store lock and a broken source is compiled once per change '''
+        with open(os.path.join(self.rules_dir, 'broken.yar'), 'w') as f:
+            f.write('rule broken { condition: }')
+        store = rastrea2r_server.RuleStore(self.rules_dir)
+        compile_rules = rastrea2r_server.yara.compile
+        locked = []
+
+        def compile_unlocked(**kwargs):
+            locked.append(store.lock.locked())
+            return compile_rules(**kwargs)
+
+        with mock.patch.object(rastrea2r_server.yara, 'compile', side_effect=compile_unlocked):
+            self.assertIsNotNone(store.get('marker', bundle=True)['bundle'])
+            for _ in range(3):
+                self.assertRaises(rastrea2r_server.yara.Error, store.get, 'broken', bundle=True)
+            self.assertEqual(store.get('broken')['source'], b'rule broken { condition: }')
+        self.assertEqual(locked, [False, False])
+
+    def test_unauthorized(self):
+        ''' check requests without the configured credentials are refused '''
+        self.start_server()
+        response = http_utils.http_get_response(self.url + '/rule?rulename=marker')
+        self.assertEqual(response.status_code, 401)
+
+    def test_ingest_results(self):
+        ''' check uploaded batches are bulk inserted into the results store '''
+        self.start_server(rate=1000, burst=1000)
+        with upload_utils.ResultUploader(self.url + '/results', auth=self.auth, batch_size=7) as uploader:
+            for i in range(100):
+                uploader.add({'rulename': 'marker', 'filename': '/tmp/%d' % i, 'module': 'yaradisk',
+                              'hostname': 'host%d' % (i % 3)})
+        self.assertEqual(uploader.sent, 100)
+
+        store = self.server.results
+        self.stop_server()
+        self.assertEqual(store.count(), 100)
+
+    def test_ingest_ndjson(self):
+        ''' check NDJSON batches are stored with their header fields and the names of every match '''
+        self.start_server(rate=1000, burst=1000)
+        header = {'hostname': 'host', 'module': 'yaradisk'}
+        with upload_utils.ResultUploader(self.url + '/results', auth=self.auth, header=header) as uploader:
+            matches = [{'rule': 'marker', 'namespace': 'first'}, {'rule': 'marker', 'namespace': 'second'}]
+            uploader.add({'filename': '/tmp/a', 'matches': matches})
+        self.assertEqual(uploader.sent, 1)
+
+        store = self.server.results
+        self.stop_server()
+        db = sqlite3.connect(store.db_path)
+        rows = db.execute('SELECT hostname, module, rulename, record FROM results').fetchall()
+        db.close()
+        self.assertEqual([row[:3] for row in rows], [('host', 'yaradisk', 'first:marker, second:marker')])
+        self.assertEqual(json.loads(rows[0][3])['filename'], '/tmp/a')
+
+    def test_rate_limit(self):
+        ''' check a host exceeding its request budget is told to retry later '''
+        self.start_server(rate=0.01, burst=2)
+        statuses = [http_utils.http_post_request(self.url + '/results', body=[{'rulename': 'marker'}],
+                                                 auth=self.auth, retries=0).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_rate_limit_per_hostname(self):
+        ''' check hosts sharing an address are limited by the hostname of their batches '''
+        self.start_server(rate=0.01, burst=2)
+        statuses = [http_utils.http_post_request(self.url + '/results', body=[{'hostname': hostname}],
+                                                 auth=self.auth, retries=0).status_code
+                    for hostname in ('a', 'a', 'b', 'b', 'a')]
+        self.assertEqual(statuses, [200, 200, 200, 200, 429])
+
+    def test_ingest_queue_bound(self):
+        ''' check batches are refused once the writer queue is full '''
+        store = rastrea2r_server.ResultStore(os.path.join(self.tmpdir.name, 'store.db'), queue_size=1)
+        store.close()
+        self.assertTrue(store.put('127.0.0.1', [{'rulename': 'marker'}]))
+        self.assertFalse(store.put('127.0.0.1', [{'rulename': 'marker'}]))
+        self.assertEqual(store.rejected, 1)
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from rastrea2r import __main__ as entry_point
+
+# Prints the scan dependencies imported by the client entry point for --version
+VERSION_PROBE = '''
+import io, runpy, sys
+sys.argv, stdout, sys.stdout = ['rastrea2r', '--version'], sys.stdout, io.StringIO()
+try:
+    runpy.run_module('rastrea2r', run_name='__main__')
+except SystemExit:
+    pass
+sys.stdout = stdout
+print(' '.join(name for name in ('yara', 'psutil', 'requests', 'utils.scan_utils') if name in sys.modules))
+'''
+
+# Prints whether the configuration is parsed by importing the package and by reading a setting
+CONFIG_PROBE = '''
+import rastrea2r
+print(rastrea2r._config is not None, rastrea2r.AUTH_USER is not None, rastrea2r._config is not None)
+'''
+
+
+class StartupTestCase(unittest.TestCase):
+    ''' Client entry point startup test cases '''
+
+    def run_probe(self, source):
+        env = dict(os.environ, PYTHONPATH=SRC_DIR)
+        with tempfile.TemporaryDirectory() as cwd:
+            return subprocess.check_output([sys.executable, '-c', source], cwd=cwd, env=env,
+                                           stderr=subprocess.DEVNULL).decode('utf-8').split()
+
+    def test_client_module(self):
+        ''' check the client module of each platform is found '''
+        self.assertEqual(entry_point.client_module('linux'), 'rastrea2r.linux.rastrea2r_linux')
+        self.assertEqual(entry_point.client_module('darwin'), 'rastrea2r.osx.rastrea2r_osx')
+        self.assertEqual(entry_point.client_module('win32'), 'rastrea2r.windows.rastrea2r_windows')
+        self.assertIsNone(entry_point.client_module('sunos5'))
+
+    @unittest.skipUnless(sys.platform.startswith('linux') or sys.platform == 'darwin', 'POSIX client')
+    def test_version_imports_no_scan_dependencies(self):
+        ''' check --version starts without yara, psutil, requests or the scan modules '''
+        self.assertEqual(self.run_probe(VERSION_PROBE), [])
+
+    def test_config_parsed_on_demand(self):
+        ''' check the configuration is parsed when a setting is first read, not on import '''
+        self.assertEqual(self.run_probe(CONFIG_PROBE), ['False', 'True', 'True'])
+
+
+if __name__ == '__main__':
+    unittest.main()
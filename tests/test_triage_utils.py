@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import metrics_utils, output_utils, triage_utils
+
+# /proc/net/tcp and tcp6 layouts, a listening socket and an established one
+PROC_NET_TCP = '''  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 0100007F:1F90 00000000:0000 0A 00000000:00000000 00:00000000 00000000  1000        0 4242 1 0 100 0 0 10 0
+   1: 0F02000A:0016 0102000A:D431 01 00000000:00000000 02:00000A00 00000000     0        0 4343 4 0 20 4 31 10 -1
+'''
+PROC_NET_TCP6 = '''  sl  local_address                         remote_address                        st tx_queue rx_queue tr tm->when retrnsmt uid timeout inode
+   0: 00000000000000000000000001000000:0277 00000000000000000000000000000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 5151 1 0 100 0 0 10 0
+'''
+
+
+def _collector(*entries):
+    def collector():
+        for entry in entries:
+            yield entry
+    return collector
+
+
+def _failing():
+    yield 'partial.txt', b'before the failure'
+    raise OSError("unreadable")
+
+
+class TriageUtilsTestCase(unittest.TestCase):
+    ''' Native triage collection test cases '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.bundle_path = os.path.join(self.tmpdir.name, 'out', 'triage.tar.gz')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_bundle_manifest(self):
+        ''' check every entry is bundled with its SHA256 in the manifest '''
+        artifacts = {'one': _collector(('a.txt', b'alpha'), ('b.json', b'{}')),
+                     'two': _collector(('c.bin', os.urandom(100000)))}
+        metrics = metrics_utils.RunMetrics('triage')
+        manifest = triage_utils.collect(artifacts, self.bundle_path, workers=2, metrics=metrics)
+
+        with tarfile.open(self.bundle_path, 'r:gz') as tar:
+            names = tar.getnames()
+            bundled = {name: tar.extractfile(name).read() for name in names}
+        self.assertEqual(names[-1], 'manifest.json')
+        self.assertEqual(json.loads(bundled['manifest.json'].decode('utf-8')), manifest)
+        self.assertEqual(sorted(entry['name'] for entry in manifest['entries']),
+                         ['one/a.txt', 'one/b.json', 'two/c.bin'])
+        for entry in manifest['entries']:
+            self.assertEqual(entry['sha256'], hashlib.sha256(bundled[entry['name']]).hexdigest())
+            self.assertEqual(entry['size'], len(bundled[entry['name']]))
+        self.assertEqual(manifest['artifacts']['one']['entries'], 2)
+        self.assertEqual(metrics.counters['entries'], 3)
+        self.assertEqual(os.listdir(os.path.dirname(self.bundle_path)), ['triage.tar.gz'])
+
+    def test_bundle_hashed_while_written(self):
+        ''' check the digests of the bundle are logged without reading it back '''
+        log_path = os.path.join(self.tmpdir.name, 'sha256-hashing.log')
+        manifest = triage_utils.collect({'one': _collector(('a.txt', b'alpha'))}, self.bundle_path,
+                                        hash_log=output_utils.HashLog(log_path), algorithms=('md5',))
+
+        with open(self.bundle_path, 'rb') as f:
+            bundle = f.read()
+        expected = "%s - %s md5:%s \n\n" % (self.bundle_path, hashlib.sha256(bundle).hexdigest(),
+                                            hashlib.md5(bundle).hexdigest())
+        with open(log_path) as f:
+            self.assertEqual(f.read(), expected)
+        self.assertEqual(manifest['entries'][0]['md5'], hashlib.md5(b'alpha').hexdigest())
+
+    def test_failing_collector(self):
+        ''' check a failing collector keeps what it read and does not stop the others '''
+        artifacts = {'broken': _failing, 'fine': _collector(('ok.txt', b'ok'))}
+        manifest = triage_utils.collect(artifacts, self.bundle_path, workers=1)
+
+        self.assertEqual(manifest['artifacts']['broken']['error'], 'unreadable')
+        self.assertNotIn('error', manifest['artifacts']['fine'])
+        self.assertEqual(sorted(entry['name'] for entry in manifest['entries']),
+                         ['broken/partial.txt', 'fine/ok.txt'])
+
+    def test_read_files(self):
+        ''' check files are read once, from their tail when asked, skipping missing ones '''
+        path = os.path.join(self.tmpdir.name, 'app.log')
+        with open(path, 'wb') as f:
+            f.write(b'old lines\nnew line\n')
+        pattern = os.path.join(self.tmpdir.name, '*.log')
+
+        entries = list(triage_utils.read_files([path, pattern, path + '.missing'], size=9, tail=True))
+        self.assertEqual(entries, [('files' + path, b'new line\n')])
+
+    def test_proc_net(self):
+        ''' check /proc/net sockets are decoded with their owning process '''
+        for name, content in (('tcp', PROC_NET_TCP), ('tcp6', PROC_NET_TCP6)):
+            with open(os.path.join(self.tmpdir.name, name), 'w') as f:
+                f.write(content)
+        tcp = triage_utils.parse_proc_net(os.path.join(self.tmpdir.name, 'tcp'), owners={4343: 77})
+        tcp6 = triage_utils.parse_proc_net(os.path.join(self.tmpdir.name, 'tcp6'))
+
+        self.assertEqual((tcp[0]['laddr'], tcp[0]['lport'], tcp[0]['state'], tcp[0]['uid']),
+                         ('127.0.0.1', 8080, 'LISTEN', 1000))
+        self.assertEqual((tcp[1]['laddr'], tcp[1]['raddr'], tcp[1]['rport'], tcp[1]['state'], tcp[1]['pid']),
+                         ('10.0.2.15', '10.0.2.1', 54321, 'ESTABLISHED', 77))
+        self.assertEqual((tcp6[0]['laddr'], tcp6[0]['lport'], tcp6[0]['pid']), ('::1', 631, None))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "requires /proc")
+    def test_proc_process(self):
+        ''' check process metadata is read from /proc '''
+        process = triage_utils.proc_process(os.getpid(), {os.getuid(): 'tester'}, triage_utils._boot_time(),
+                                            os.sysconf('SC_CLK_TCK'))
+        self.assertEqual(process['ppid'], os.getppid())
+        self.assertEqual(process['username'], 'tester')
+        self.assertEqual(process['exe'], os.path.realpath(sys.executable))
+        self.assertEqual(process['cwd'], os.getcwd())
+        self.assertTrue(process['cmdline'])
+        self.assertIsNone(triage_utils.proc_process(2 ** 22 + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import gzip
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import upload_utils
+
+
+class ResultsHandler(BaseHTTPRequestHandler):
+    ''' Records every batch posted to /results '''
+
+    batches = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        if self.path.endswith('/rejected'):
+            self.send_response(400)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        ResultsHandler.batches.append(body)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class UploadUtilsTestCase(unittest.TestCase):
+    ''' Background result uploader test cases '''
+
+    def setUp(self):
+        ResultsHandler.batches = []
+        self.server = HTTPServer(('127.0.0.1', 0), ResultsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/results' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_batches(self):
+        ''' check records are posted in bounded batches and none are lost '''
+        with upload_utils.ResultUploader(self.url, batch_size=10, queue_size=5) as uploader:
+            for i in range(95):
+                uploader.add({'filename': 'file-%d' % i})
+
+        self.assertEqual((uploader.records, uploader.sent, uploader.failed), (95, 95, 0))
+        self.assertEqual(len(ResultsHandler.batches), 10)
+        records = [record for batch in ResultsHandler.batches for record in json.loads(batch)]
+        self.assertEqual([record['filename'] for record in records], ['file-%d' % i for i in range(95)])
+
+    def test_header(self):
+        ''' check batches with a header are posted as NDJSON, the header first '''
+        with upload_utils.ResultUploader(self.url, batch_size=2, header={'hostname': 'host'}) as uploader:
+            for i in range(3):
+                uploader.add({'filename': 'file-%d' % i})
+
+        self.assertEqual(ResultsHandler.batches,
+                         [b'{"hostname":"host"}\n{"filename":"file-0"}\n{"filename":"file-1"}\n',
+                          b'{"hostname":"host"}\n{"filename":"file-2"}\n'])
+
+    def test_flush_unsent(self):
+        ''' check flush() posts a partial batch and failed records are kept with keep_unsent '''
+        with upload_utils.ResultUploader(self.url, batch_size=10, interval=60) as uploader:
+            uploader.add({'filename': 'file-0'})
+            uploader.flush()
+            self.assertEqual(uploader.sent, 1)
+
+        with upload_utils.ResultUploader(self.url + '/rejected', keep_unsent=True) as uploader:
+            uploader.add({'filename': 'file-1'})
+        self.assertEqual([json.loads(record) for record in uploader.unsent], [{'filename': 'file-1'}])
+
+
+if __name__ == '__main__':
+    unittest.main()